@@ -16,6 +16,10 @@ class NullTest(Transformation):
         super().__init__(args, repo)
         self.environments = args.environments
 
+    @classmethod
+    def prefetch_paths(cls, args):
+        return ['service/global-values.yaml', 'CHANGELOG.md']
+
     def run(self):
         file = self.repo.get_objects('service/global-values.yaml')
 
@@ -0,0 +1,330 @@
+import asyncio
+import base64
+import datetime
+import itertools
+import logging
+import os
+import time
+from github import GithubException
+from github import UnknownObjectException
+from github.PullRequest import PullRequest
+from gordian.cache import LRUCache
+from gordian.files import ChangelogFile
+from gordian.path_index import PathIndex, PathFilter, ROOT_FILES
+from gordian.repo import BASE_URL, BLOB_CACHE_SIZE, RepoFile, open_file, next_version
+from gordian.scheduler import parse_retry_after
+from gordian.staging import StagingMixin
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = 100
+MAX_RETRIES = 5
+
+
+def create_async_client(github_api_url=None, token=None, username=None, password=None, max_connections=MAX_CONNECTIONS, http2=False):
+    """Keep-alive HTTP client to share between every AsyncRepo of a run.
+    HTTP/2 multiplexes the requests over a single connection and needs
+    `httpx[http2]`."""
+    if httpx is None:
+        raise ImportError('AsyncRepo needs httpx, install it with `pip install gordian[async]`')
+    if github_api_url is None:
+        github_api_url = BASE_URL
+    username = os.getenv('GIT_USERNAME', username)
+    password = os.getenv('GIT_PASSWORD', password)
+    token = os.getenv('GIT_TOKEN', token)
+
+    headers = {'Accept': 'application/vnd.github+json'}
+    auth = None
+    if token:
+        logger.debug('Using git token for authentication')
+        headers['Authorization'] = f'token {token}'
+    elif username:
+        logger.debug('Using git username and password for authentication')
+        auth = (username, password)
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.AsyncClient(base_url=github_api_url, headers=headers, auth=auth, limits=limits, http2=http2, timeout=30)
+
+
+class AsyncRepo(StagingMixin):
+    """asyncio counterpart of `Repo`, for campaigns driving many repos from a
+    single event loop over one pooled HTTP client.
+
+    Listing and reading files are coroutines: `await repo.get_files()`,
+    `await repo.find_file(path)` and `await repo.get_objects(path)`. Writes
+    are always staged in memory, as with `Repo(batch_commits=True)`, so
+    `update_file`, `create_file`, `delete_file` and the `save` of the file
+    classes don't wait on the network; `await repo.create_pr(...)` pushes them
+    as a single commit.
+    """
+
+    def __init__(self, repo_name, github_api_url=None, branch=None, client=None, semver_label=None, target_branch='master', token=None, username=None, password=None, blob_cache_size=BLOB_CACHE_SIZE, include=None, exclude=None):
+        if github_api_url is None:
+            self.github_api_url = BASE_URL
+        else:
+            self.github_api_url = github_api_url
+
+        self._owns_client = client is None
+        if client is None:
+            client = create_async_client(self.github_api_url, token, username, password)
+        self._client = client
+
+        if repo_name.endswith('.git'):
+            repo_name = repo_name[:-4]
+        self.repo_name = repo_name
+
+        self.files = None
+        self._index = None
+        self._blobs = LRUCache(blob_cache_size)
+        self._path_filter = PathFilter(include, exclude)
+        self._staged = {}
+        self._staged_messages = []
+        self.version_file = None
+        self.changelog_file = None
+        self._changelog = None
+
+        self.branch_exists = False
+        self.dirty = False
+        self.new_version = None
+        self.semver_label = semver_label
+        self.target_branch = target_branch
+        self.target_ref = f"refs/heads/{self.target_branch}"
+        if branch:
+            self.branch_name = f"refs/heads/{branch}"
+            self.source_branch = self.branch_name
+        else:
+            self.branch_name = f"refs/heads/{datetime.datetime.now().strftime('%Y-%m-%d-%H%M%S.%f')}"
+            self.source_branch = self.target_ref
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._owns_client:
+            await self._client.aclose()
+
+    async def get_files(self):
+        if self.files is None:
+            sha = (await self._get_branch(self.target_branch))['commit']['sha']
+            files = []
+            for file in await self._list_tree(sha):
+                if file.path == 'version':
+                    self.version_file = file
+                elif file.path == 'CHANGELOG.md':
+                    self.changelog_file = file
+                else:
+                    files.append(file)
+            self.files = files
+            self._index = PathIndex(files)
+            if self.semver_label is not None and self.version_file is not None:
+                version = await self.read_file(self.version_file)
+                self.new_version = next_version(version.decode('utf-8'), self.semver_label)
+        return self.files
+
+    async def find_file(self, filename):
+        await self.get_files()
+        return self._index.get(filename)
+
+    async def find_files(self, pattern):
+        # Glob on the full path: `*` stays within a directory, `**` spans directories
+        await self.get_files()
+        return self._index.glob(pattern)
+
+    async def find_files_by_name(self, basename):
+        await self.get_files()
+        return self._index.find_basename(basename)
+
+    async def get_objects(self, filename, klass=None):
+        if filename == 'CHANGELOG.md':
+            return await self.get_changelog()
+
+        file = await self.find_file(filename)
+        if file is None:
+            raise FileNotFoundError
+        await self.read_file(file)
+        return open_file(file, self, klass)
+
+    async def get_changelog(self):
+        if self._changelog is None:
+            await self.get_files()
+            if self.changelog_file is not None:
+                await self.read_file(self.changelog_file)
+                self._changelog = ChangelogFile(self.changelog_file, self)
+        return self._changelog
+
+    async def read_file(self, file):
+        """Fetches the contents of a listed file, which its `decoded_content`
+        then returns without waiting."""
+        staged, content = self.get_staged_content(file.path)
+        if staged:
+            return content
+        content = self._blobs.get(file.sha)
+        if content is None:
+            logger.debug(f'Fetching blob {file.sha}...')
+            blob = await self._request('GET', f'/git/blobs/{file.sha}')
+            content = base64.b64decode(blob['content'])
+            self._blobs.put(file.sha, content)
+        return content
+
+    def read_blob(self, sha):
+        # Called by RepoFile.decoded_content, after `read_file` fetched the blob
+        content = self._blobs.get(sha)
+        if content is None:
+            raise LookupError(f'Blob {sha} has not been fetched, `await repo.read_file(file)` first')
+        return content
+
+    def release(self, file):
+        self._blobs.pop(file.sha)
+
+    async def commit_staged(self, message):
+        if not self._staged:
+            return None
+
+        # Build on top of the source branch when it already exists (--branch),
+        # otherwise branch off the target branch
+        source_branch = self.branch_name[len('refs/heads/'):]
+        parent = await self._get_existing_branch(source_branch) if self.source_branch == self.branch_name else None
+        base = parent or await self._get_branch(self.target_branch)
+        base_commit = base['commit']
+
+        logger.debug(f"Committing {len(self._staged)} staged changes on top of {base_commit['sha']}")
+        elements = await asyncio.gather(*(self._tree_element(path, content, mode) for path, (content, mode) in self._staged.items()))
+        tree = await self._request('POST', '/git/trees', {'base_tree': base_commit['commit']['tree']['sha'], 'tree': list(elements)})
+        commit = await self._request('POST', '/git/commits', {'message': self._commit_message(message), 'tree': tree['sha'], 'parents': [base_commit['sha']]})
+
+        if parent is not None:
+            await self._request('PATCH', f'/git/refs/heads/{source_branch}', {'sha': commit['sha']})
+        else:
+            await self._request('POST', '/git/refs', {'ref': self.branch_name, 'sha': commit['sha']})
+        self.branch_exists = True
+        self._clear_staged()
+        return commit
+
+    async def _tree_element(self, path, content, mode):
+        if content is None:
+            return {'path': path, 'mode': mode, 'type': 'blob', 'sha': None}
+        try:
+            return {'path': path, 'mode': mode, 'type': 'blob', 'content': content.decode('utf-8')}
+        except UnicodeDecodeError:
+            blob = await self._request('POST', '/git/blobs', {'content': base64.b64encode(content).decode('ascii'), 'encoding': 'base64'})
+            return {'path': path, 'mode': mode, 'type': 'blob', 'sha': blob['sha']}
+
+    async def create_pr(self, pr_message, pr_body, target_branch, labels=[]):
+        """Pushes the staged changes and opens the PR. It is returned as a
+        PyGithub `PullRequest` built from GitHub's response, so callbacks can
+        read it like the ones `Repo` returns, but it can't make API calls."""
+        await self.commit_staged(pr_message)
+        owner = self.repo_name.split('/')[0]
+        pr = await self._request('POST', '/pulls', {
+            'title': pr_message,
+            'body': pr_body,
+            'base': target_branch,
+            'head': f'{owner}:{self.branch_name}',
+        })
+        if labels:
+            await self._request('PUT', f"/issues/{pr['number']}/labels", {'labels': list(labels)})
+        return PullRequest(None, {}, pr, completed=True)
+
+    async def _list_tree(self, sha):
+        # Only the directories that included files can be in are listed
+        files = []
+        roots = self._path_filter.roots()
+        top = None
+        if '' not in roots:
+            # The version and changelog are at the root, outside the listed directories
+            top = (await self._get_git_tree(sha))['tree']
+            files.extend(RepoFile(e['path'], e['sha'], e.get('size'), self, e['mode']) for e in top if e['type'] == 'blob' and e['path'] in ROOT_FILES)
+        for root in roots:
+            tree_sha = await self._resolve_tree(sha, root, top) if root else sha
+            if tree_sha is None:
+                logger.debug(f'{root} not found in {sha}')
+                continue
+            for file in await self._list_subtree(tree_sha, f'{root}/' if root else ''):
+                if self._path_filter.match(file.path):
+                    files.append(file)
+        return files
+
+    async def _list_subtree(self, sha, base=''):
+        # A single recursive request lists the whole subtree. GitHub truncates
+        # very large trees, in which case the subtrees are listed concurrently.
+        tree = await self._get_git_tree(sha, recursive=True)
+        if tree.get('truncated'):
+            logger.debug(f'Tree listing for {sha} truncated, fetching subtrees...')
+            return await self._walk_tree(sha, base)
+        return [RepoFile(f"{base}{e['path']}", e['sha'], e.get('size'), self, e['mode']) for e in tree['tree'] if e['type'] == 'blob']
+
+    async def _walk_tree(self, sha, base=''):
+        files, subtrees = [], []
+        for element in (await self._get_git_tree(sha))['tree']:
+            path = f"{base}{element['path']}"
+            if element['type'] == 'blob':
+                files.append(RepoFile(path, element['sha'], element.get('size'), self, element['mode']))
+            elif element['type'] == 'tree' and self._path_filter.match_dir(path):
+                subtrees.append(self._walk_tree(element['sha'], f'{path}/'))
+        for subtree_files in await asyncio.gather(*subtrees):
+            files.extend(subtree_files)
+        return files
+
+    async def _resolve_tree(self, sha, path, entries=None):
+        # Walks down to the tree of a directory one level at a time, entries
+        # can hold the already fetched listing of sha
+        for name in path.split('/'):
+            if entries is None:
+                entries = (await self._get_git_tree(sha))['tree']
+            sha = next((e['sha'] for e in entries if e['path'] == name and e['type'] == 'tree'), None)
+            if sha is None:
+                return None
+            entries = None
+        return sha
+
+    async def _get_git_tree(self, sha, recursive=False):
+        logger.debug(f'Fetching tree {sha}{" recursively" if recursive else ""}...')
+        return await self._request('GET', f'/git/trees/{sha}', params={'recursive': '1'} if recursive else None)
+
+    async def _get_branch(self, branch):
+        logger.debug(f'Fetching branch {branch}...')
+        return await self._request('GET', f'/branches/{branch}')
+
+    async def _get_existing_branch(self, branch):
+        try:
+            return await self._get_branch(branch)
+        except GithubException as e:
+            if e.status != 404:
+                raise e
+            return None
+
+    async def _request(self, method, path, body=None, params=None):
+        # Errors are raised as PyGithub's exceptions, so callers handle them like Repo's
+        for attempt in itertools.count():
+            response = await self._client.request(method, f'/repos/{self.repo_name}{path}', json=body, params=params)
+            wait = self._retry_after(response)
+            if wait is not None and attempt < MAX_RETRIES:
+                logger.info(f'Rate limited by GitHub, retrying in {wait:.0f}s')
+                await asyncio.sleep(wait)
+                continue
+
+            data = response.json() if response.content else None
+            if response.status_code == 404:
+                raise UnknownObjectException(404, data, dict(response.headers))
+            if response.status_code >= 400:
+                raise GithubException(response.status_code, data, dict(response.headers))
+            return data
+
+    def _retry_after(self, response):
+        # Seconds to wait before retrying a rate limited request, None if it wasn't
+        if response.status_code not in (403, 429):
+            return None
+        headers = response.headers
+        if headers.get('retry-after'):
+            return parse_retry_after(headers['retry-after'], time.time())
+        if headers.get('x-ratelimit-remaining') == '0' and headers.get('x-ratelimit-reset'):
+            return max(float(headers['x-ratelimit-reset']) - time.time(), 0) + 1
+        return None
@@ -0,0 +1,167 @@
+import datetime
+import hashlib
+import json
+import logging
+import time
+import urllib.parse
+from github import GithubException
+
+logger = logging.getLogger(__name__)
+
+# Files per query, GitHub rejects queries that are too expensive or take too long to resolve
+MAX_OBJECTS = 100
+# Errors that mean the query asked for too much at once
+LIMIT_ERRORS = ('MAX_NODE_LIMIT_EXCEEDED', 'RESOURCE_LIMITS_EXCEEDED', 'TIMEOUT')
+# Statuses of a query GitHub gave up on
+TIMEOUT_STATUSES = (502, 504)
+
+BLOB_FIELDS = '... on Blob { oid byteSize isBinary isTruncated text }'
+
+
+class QueryTooLarge(Exception):
+    pass
+
+
+def graphql_url(github_api_url):
+    # GitHub Enterprise serves GraphQL at /api/graphql next to the /api/v3 REST API
+    if github_api_url is None:
+        return '/graphql'
+    parsed = urllib.parse.urlparse(github_api_url)
+    if parsed.path.rstrip('/') in ('', '/'):
+        return '/graphql'
+    return f'{parsed.scheme}://{parsed.netloc}/api/graphql'
+
+
+def build_query(branch, batch, paths):
+    """Query reading every path of every repo in the batch, aliased by
+    position since repo names and paths aren't valid GraphQL names."""
+    repos = []
+    for i, repo_name in enumerate(batch):
+        owner, name = split_repo_name(repo_name)
+        objects = ' '.join(
+            f'f{j}: object(expression: {json.dumps(f"{branch}:{path}")}) {{ {BLOB_FIELDS} }}'
+            for j, path in enumerate(paths)
+        )
+        repos.append(f'r{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ {objects} }}')
+    return f'query {{ {" ".join(repos)} rateLimit {{ cost remaining resetAt }} }}'
+
+
+def git_blob_sha(content):
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+
+def split_repo_name(repo_name):
+    if repo_name.endswith('.git'):
+        repo_name = repo_name[:-4]
+    owner, _, name = repo_name.partition('/')
+    return owner, name
+
+
+class BulkReader:
+    """Reads a few known paths of many repos with GraphQL, dozens of repos
+    per request, for `Repo.prefill`.
+
+    Queries ask for at most `max_objects` files. A query GitHub refuses as
+    too large, or times out on, is split in half and retried, and the size
+    grows back after successful queries. When the GraphQL rate limit runs
+    low, reads wait for its reset.
+    """
+
+    def __init__(self, github, github_api_url=None, scheduler=None, max_objects=MAX_OBJECTS, sleep=time.sleep, clock=time.time):
+        self._github = github
+        self._url = graphql_url(github_api_url)
+        self._scheduler = scheduler
+        self.max_objects = max_objects
+        self.batch_objects = max_objects
+        self._sleep = sleep
+        self._clock = clock
+        self._reset_at = None
+
+    def read(self, repo_names, branch, paths):
+        """Returns {repo_name: {path: (sha, size, content) or None}}, content
+        being None for binary or truncated blobs, and None for paths that
+        don't exist. Repos that can't be read are left out."""
+        paths = list(dict.fromkeys(paths))
+        pending = list(repo_names)
+        results = {}
+        while pending:
+            size = max(1, self.batch_objects // max(len(paths), 1))
+            batch, rest = pending[:size], pending[size:]
+            try:
+                results.update(self._read_batch(batch, branch, paths))
+            except QueryTooLarge:
+                if len(batch) == 1:
+                    logger.warning(f'Could not read {batch[0]} with GraphQL, its files are read file by file')
+                    pending = rest
+                    continue
+                self.batch_objects = max(len(paths), (len(batch) * len(paths)) // 2)
+                logger.debug(f'Query too large, reading {self.batch_objects} files per query')
+                continue
+            self.batch_objects = min(self.max_objects, self.batch_objects + max(len(paths), self.max_objects // 4))
+            pending = rest
+        return results
+
+    def _read_batch(self, batch, branch, paths):
+        query = build_query(branch, batch, paths)
+        self._wait_for_reset()
+        requester = self._github.get_repo(batch[0], lazy=True)._requester
+        try:
+            _, data = self._call(requester.requestJsonAndCheck, 'POST', self._url, input={'query': query})
+        except GithubException as e:
+            if e.status in TIMEOUT_STATUSES:
+                raise QueryTooLarge() from e
+            raise e
+
+        errors = data.get('errors') or []
+        if any(error.get('type') in LIMIT_ERRORS for error in errors):
+            raise QueryTooLarge()
+        for error in errors:
+            if error.get('type') != 'NOT_FOUND':
+                logger.warning(f"GraphQL error: {error.get('message')}")
+
+        response = data.get('data') or {}
+        self._observe(response.get('rateLimit'))
+        results = {}
+        for i, repo_name in enumerate(batch):
+            repository = response.get(f'r{i}')
+            if repository is None:
+                logger.debug(f'Repository {repo_name} not found')
+                continue
+            results[repo_name] = {path: self._file(repository.get(f'f{j}')) for j, path in enumerate(paths)}
+        return results
+
+    def _file(self, blob):
+        # Paths that don't exist, or aren't files, resolve to null or an empty object
+        if not blob or 'oid' not in blob:
+            return None
+        content = None
+        if not blob['isBinary'] and not blob['isTruncated'] and blob['text'] is not None:
+            content = blob['text'].encode('utf-8')
+            # text is decoded by GitHub, files that weren't UTF-8 don't round trip
+            if git_blob_sha(content) != blob['oid']:
+                content = None
+        return blob['oid'], blob['byteSize'], content
+
+    def _call(self, fn, *args, **kwargs):
+        if self._scheduler is None:
+            return fn(*args, **kwargs)
+        return self._scheduler.call(fn, *args, **kwargs)
+
+    def _observe(self, rate_limit):
+        # Each query costs points from a separate hourly GraphQL budget
+        if not rate_limit:
+            return
+        logger.debug(f"GraphQL query cost {rate_limit['cost']}, {rate_limit['remaining']} remaining")
+        if rate_limit['remaining'] < rate_limit['cost']:
+            self._reset_at = datetime.datetime.fromisoformat(rate_limit['resetAt'].replace('Z', '+00:00')).timestamp()
+        else:
+            self._reset_at = None
+
+    def _wait_for_reset(self):
+        if self._reset_at is None:
+            return
+        wait = self._reset_at - self._clock()
+        if wait > 0:
+            logger.info(f'GraphQL rate limit exhausted, waiting {wait:.0f}s')
+            self._sleep(wait + 1)
+        self._reset_at = None
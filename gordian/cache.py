@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DISK_CACHE_SIZE = 1024 * 1024 * 1024
+RESULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class LRUCache:
+    """In-memory least recently used cache bounded by the total size of its values."""
+
+    def __init__(self, max_size, sizeof=len):
+        self.max_size = max_size
+        self.size = 0
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._sizeof(self._entries.pop(key))
+            if size > self.max_size:
+                return
+            self._entries[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= self._sizeof(evicted)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries.pop(key)
+            self.size -= self._sizeof(value)
+            return value
+
+
+class DiskCache:
+    """Content addressed cache on disk that several gordian processes can share.
+
+    Entries are written to a temporary file and renamed into place, so readers
+    never see partial entries and concurrent writers of the same key are harmless.
+    Reads refresh the entry's mtime, which eviction uses as its recency order.
+    """
+
+    def __init__(self, directory, max_size=DISK_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, namespace, key):
+        path = self._path(namespace, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Missing or evicted by another process in the meantime
+            return None
+        return data
+
+    def put(self, namespace, key, data):
+        path = self._path(namespace, key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # A replaced entry no longer counts towards the size
+            try:
+                replaced_size = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(data) - replaced_size
+            needs_eviction = self._size > self.max_size
+        if needs_eviction:
+            self.evict()
+
+    def evict(self):
+        with self._exclusive() as locked:
+            if not locked:
+                # Another process is already evicting
+                return
+            entries = []
+            for path, stat in self._entries():
+                entries.append((stat.st_mtime, stat.st_size, path))
+            size = sum(e[1] for e in entries)
+            # Evict down to 90% so we don't evict again on the very next write
+            target = self.max_size * 0.9
+            for _, entry_size, path in sorted(entries):
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+            logger.debug(f'Evicted cache entries in {self.directory} down to {size} bytes')
+            with self._lock:
+                self._size = size
+
+    def _path(self, namespace, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, namespace, digest[:2], digest)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+    def _disk_usage(self):
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def _exclusive(self):
+        return _FileLock(os.path.join(self.directory, '.lock'))
+
+
+class ResultCache:
+    """Outputs of transformations by (transformation fingerprint, blob sha).
+
+    A result is either None, when the transformation leaves the blob unchanged,
+    or a `(content, note)` pair of the new contents and a short description of
+    the change. Results are kept in memory for the run and, given a DiskCache,
+    shared between runs.
+    """
+
+    NAMESPACE = 'results'
+
+    def __init__(self, cache=None, max_size=RESULT_CACHE_SIZE):
+        self._results = LRUCache(max_size)
+        self._cache = cache
+
+    def get(self, fingerprint, sha):
+        """Returns a (hit, result) pair."""
+        key = f'{fingerprint}:{sha}'
+        data = self._results.get(key)
+        if data is None and self._cache is not None:
+            data = self._cache.get(self.NAMESPACE, key)
+            if data is not None:
+                self._results.put(key, data)
+        if data is None:
+            return False, None
+        return True, self._decode(data)
+
+    def put(self, fingerprint, sha, result):
+        key = f'{fingerprint}:{sha}'
+        data = self._encode(result)
+        self._results.put(key, data)
+        if self._cache is not None:
+            self._cache.put(self.NAMESPACE, key, data)
+
+    @staticmethod
+    def _encode(result):
+        if result is None:
+            return b'-'
+        content, note = result
+        note = note.encode('utf-8')
+        return b'+%d\n' % len(note) + note + content
+
+    @staticmethod
+    def _decode(data):
+        if data == b'-':
+            return None
+        header, _, rest = data[1:].partition(b'\n')
+        length = int(header)
+        return rest[length:], rest[:length].decode('utf-8')
+
+
+class _FileLock:
+    # Non-blocking inter-process lock; yields False when another process holds it
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is None:  # pragma: no cover
+            return True
+        self._file = open(self.path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
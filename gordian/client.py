@@ -0,0 +1,66 @@
+import functools
+import requests
+from github.Requester import RequestsResponse
+
+
+class PooledConnection:
+    """Drop-in for PyGithub's requests based connection classes that sends every
+    request through one shared keep-alive session.
+
+    PyGithub keeps a single connection object per client and stores the pending
+    request on it, so a client can't be shared between threads as is. Creating
+    one of these lightweight objects per request keeps that state private while
+    the TCP/TLS connections are reused from the session's pool.
+    """
+
+    def __init__(self, session, scheme, host, port=None, timeout=None, verify=True, **kwargs):
+        self.session = session
+        self.scheme = scheme
+        self.host = host
+        self.port = port if port else (443 if scheme == 'https' else 80)
+        self.timeout = timeout
+        self.verify = verify
+
+    def request(self, verb, url, input, headers):
+        self.verb = verb
+        self.url = url
+        self.input = input
+        self.headers = headers
+
+    def getresponse(self):
+        response = self.session.request(
+            self.verb,
+            f'{self.scheme}://{self.host}:{self.port}{self.url}',
+            headers=self.headers,
+            data=self.input,
+            timeout=self.timeout,
+            verify=self.verify,
+            allow_redirects=False,
+        )
+        return RequestsResponse(response)
+
+    def close(self):
+        return
+
+
+def create_pooled_session(pool_size, retry=None):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        max_retries=requests.adapters.DEFAULT_RETRIES if retry is None else retry,
+        pool_connections=1,
+        pool_maxsize=pool_size,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def use_pooled_connections(github, pool_size):
+    # PyGithub 1.x has no public hook for this, so the connection factory is
+    # swapped on the client's requester directly
+    requester = github._Github__requester
+    scheme = 'https' if requester.base_url.startswith('https') else 'http'
+    session = create_pooled_session(pool_size)
+    requester._Requester__connectionClass = functools.partial(PooledConnection, session, scheme)
+    requester._Requester__persist = False
+    return session
@@ -0,0 +1,37 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def start(processes):
+    """Runs `run_compute` calls on a pool of worker processes until `stop`.
+
+    Start it before any threads: the workers are created right away so they
+    aren't forked from a process whose other threads may hold locks.
+    """
+    global _executor
+    stop()
+    _executor = ProcessPoolExecutor(max_workers=processes)
+    # Forks every worker now rather than on the first submit from a worker thread
+    list(_executor.map(abs, range(processes)))
+    logger.debug(f'Started {processes} compute processes')
+
+
+def stop():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def run_compute(fn, *args, **kwargs):
+    """Calls fn, on the process pool when one is started. fn has to be a
+    module level function and its arguments and result picklable, typically
+    bytes in and bytes out. The calling thread waits for the result while
+    other threads keep fetching."""
+    if _executor is None:
+        return fn(*args, **kwargs)
+    return _executor.submit(fn, *args, **kwargs).result()
@@ -1,4 +1,5 @@
 from . import MarkdownFile
+from gordian.compute import run_compute
 import re
 from datetime import datetime
 
@@ -13,49 +14,7 @@ class ChangelogFile(MarkdownFile):
 
     def _load_objects(self):
         string_lines = [line.decode("utf-8") for line in super()._load_objects()]
-        self.header = []
-        changelog_entries = []
-        changelog_entry_block = []
-        empty_previous_line = False
-        inside_changelog_entry_block = False
-        footer_start = None
-
-        for i, line in enumerate(string_lines):
-            # set on previous iteration
-            if empty_previous_line:
-                if re.search(CHANGELOG_ENTRY_REGEX, line):
-
-                    # reached the end of the header (start of the changelog)
-                    if not self.header:
-                        self.header = string_lines[0:i]
-
-                    # reached end of previous block (start of next changelog entry)
-                    if changelog_entry_block:
-                        changelog_entries.append(changelog_entry_block)
-
-                    inside_changelog_entry_block = True
-                    changelog_entry_block = []
-
-                # if previous line was empty and it did _not_ match the changelog entry regex,
-                # it means the end of the changelog entries was reached, and now it's reading
-                # through the footer.
-                else:
-                    inside_changelog_entry_block = False
-                    footer_start = i
-
-            if inside_changelog_entry_block:
-                changelog_entry_block.append(line)
-
-            # used for the subsequent iteration to determine when we've gone through all
-            # the changelog entries
-            empty_previous_line = not line
-
-        changelog_entries.append(changelog_entry_block)
-        if footer_start:
-            self.footer = string_lines[footer_start : len(string_lines) - 1]
-        else:
-            self.footer = []
-
+        self.header, changelog_entries, self.footer = run_compute(parse_changelog, string_lines)
         return changelog_entries
 
     def _dump(self, serialize_options={}):
@@ -107,7 +66,55 @@ class ChangelogFile(MarkdownFile):
                 getattr(self, store).append((entry, ticket))
 
             setattr(ChangelogFile, changelog_entry_type, fn)
-            setattr(ChangelogFile, internal_store, [])
+            # Entries live on the instance so repos processed concurrently don't share them
+            setattr(self, internal_store, [])
 
     def _format_date(self):
         return datetime.now().strftime("%Y-%m-%d")
+
+
+def parse_changelog(string_lines):
+    header = []
+    changelog_entries = []
+    changelog_entry_block = []
+    empty_previous_line = False
+    inside_changelog_entry_block = False
+    footer_start = None
+
+    for i, line in enumerate(string_lines):
+        # set on previous iteration
+        if empty_previous_line:
+            if re.search(CHANGELOG_ENTRY_REGEX, line):
+
+                # reached the end of the header (start of the changelog)
+                if not header:
+                    header = string_lines[0:i]
+
+                # reached end of previous block (start of next changelog entry)
+                if changelog_entry_block:
+                    changelog_entries.append(changelog_entry_block)
+
+                inside_changelog_entry_block = True
+                changelog_entry_block = []
+
+            # if previous line was empty and it did _not_ match the changelog entry regex,
+            # it means the end of the changelog entries was reached, and now it's reading
+            # through the footer.
+            else:
+                inside_changelog_entry_block = False
+                footer_start = i
+
+        if inside_changelog_entry_block:
+            changelog_entry_block.append(line)
+
+        # used for the subsequent iteration to determine when we've gone through all
+        # the changelog entries
+        empty_previous_line = not line
+
+    changelog_entries.append(changelog_entry_block)
+    if footer_start:
+        footer = string_lines[footer_start : len(string_lines) - 1]
+    else:
+        footer = []
+
+    return header, changelog_entries, footer
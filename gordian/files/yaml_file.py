@@ -1,20 +1,23 @@
 from . import BaseFile
+from gordian import yaml_backend
+from gordian.compute import run_compute
 import yaml
 
 
 class YamlFile(BaseFile):
     def __init__(self, github_file, repo):
         super().__init__(github_file, repo)
-        yaml.add_representer(type(None), represent_none)
 
     def _load_objects(self):
-        return list(yaml.safe_load_all(self.file_contents))
+        return run_compute(yaml_backend.load_all, self.file_contents, yaml_backend.safe_loader())
 
     def _dump(self, serialize_options={}):
         default_flow_style = serialize_options.get("default_flow_style", False)
         explicit_start = serialize_options.get("explicit_start", True)
-        return yaml.dump_all(
+        return run_compute(
+            yaml_backend.dump_all,
             self.objects,
+            dumper=get_dumper(),
             default_flow_style=default_flow_style,
             explicit_start=explicit_start,
         )
@@ -24,3 +27,35 @@ def represent_none(self, _):
     # Disable dumping 'null' string for null values
     # Taken from here: https://stackoverflow.com/a/41786451
     return self.represent_scalar("tag:yaml.org,2002:null", "")
+
+
+class YamlDumper(yaml.SafeDumper):
+    # Representers are registered on these classes rather than on PyYAML's
+    # global dumpers, so other YAML output isn't affected
+    pass
+
+
+if yaml_backend.CSafeDumper is not None:
+    class CYamlDumper(yaml_backend.CSafeDumper):
+        pass
+else:  # pragma: no cover
+    CYamlDumper = None
+
+
+def get_dumper():
+    return CYamlDumper if yaml_backend.libyaml_enabled() else YamlDumper
+
+
+def add_representer(data_type, representer):
+    """Customises how YamlFile dumps values of data_type, for all files.
+
+    With `--processes`, call it at import time of the transformation module,
+    before `gordian.compute.start`: the workers are forked then and don't see
+    representers added afterwards.
+    """
+    for dumper in (YamlDumper, CYamlDumper):
+        if dumper is not None:
+            dumper.add_representer(data_type, representer)
+
+
+add_representer(type(None), represent_none)
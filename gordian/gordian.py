@@ -1,16 +1,45 @@
 import logging
 import sys
 import argparse
+import asyncio
+import contextvars
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from .transformations import SearchAndReplace
 from .config import Config
-from .repo import Repo
+from .cache import DiskCache, ResultCache
+from .index import TrigramIndex
+from .bulk_reader import BulkReader
+from .plan import PlanWriter, plan_entry, read_plan, apply_entry
+from .journal import RunJournal, campaign_fingerprint, BRANCH, TRANSFORMED, COMMITTED, NO_CHANGE, PR_EXISTS, PR_OPENED
+from .repo import Repo, create_github_client, pull_request_exists
+from .async_repo import AsyncRepo, create_async_client
+from .local_repo import LocalRepo
+from .scheduler import RateLimitScheduler
+from . import compute
 from github import GithubException
 
+current_repo = contextvars.ContextVar('current_repo', default=None)
+
+DEFAULT_PLAN_FILE = 'gordian-plan.jsonl'
+
+
+class RepoLogFilter(logging.Filter):
+    # Prefixes log lines with the repo being processed so concurrent runs stay readable
+    def filter(self, record):
+        repo_name = current_repo.get()
+        record.repo = f'[{repo_name}] ' if repo_name else ''
+        return True
+
+
 logger = logging.getLogger('gordian')
 ch = logging.StreamHandler()
 logger.setLevel(level=logging.INFO)
-formatter = logging.Formatter('[%(asctime)-15s] %(levelname)s %(message)s')
+formatter = logging.Formatter('[%(asctime)-15s] %(levelname)s %(repo)s%(message)s')
 ch.setFormatter(formatter)
+ch.addFilter(RepoLogFilter())
 logger.addHandler(ch)
 
 
@@ -25,7 +54,7 @@ class VerboseLogging(argparse.Action):
 
     def __call__(self, parser, namespace, values, option_string=None):
         logger.setLevel(level=logging.DEBUG)
-        formatter = logging.Formatter('[%(asctime)-15s] %(module)s.%(funcName)s %(levelname)s %(message)s')
+        formatter = logging.Formatter('[%(asctime)-15s] %(module)s.%(funcName)s %(levelname)s %(repo)s%(message)s')
         logger.handlers[0].setFormatter(formatter)
 
 
@@ -88,6 +117,115 @@ def get_basic_parser():
         help='The file to look for for the search/replace transformations'
     )
 
+    parser.add_argument(
+        '--concurrency',
+        required=False,
+        default=1,
+        type=int,
+        dest='concurrency',
+        help='Number of repositories to process in parallel'
+    )
+
+    parser.add_argument(
+        '--processes',
+        required=False,
+        default=0,
+        type=int,
+        dest='processes',
+        help='Number of processes to parse, transform and dump file contents on, 0 to do it in the worker threads'
+    )
+
+    parser.add_argument(
+        '--batch-commits',
+        required=False,
+        action='store_true',
+        dest='batch_commits',
+        help='Stage all changes to a repo and push them as a single commit when opening the PR'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        required=False,
+        dest='cache_dir',
+        help='Directory to cache file contents, trees and API responses in between runs'
+    )
+    parser.add_argument(
+        '--cache-size',
+        required=False,
+        default=1024,
+        type=int,
+        dest='cache_size',
+        help='Maximum size of the cache directory in MB'
+    )
+
+    parser.add_argument(
+        '--clone',
+        required=False,
+        action='store_true',
+        dest='clone',
+        help='Read and change files in a shallow local clone and push a single commit instead of using the Contents API'
+    )
+    parser.add_argument(
+        '--mirror-dir',
+        required=False,
+        dest='mirror_dir',
+        help='Directory of local mirrors (<org>/<repo>.git) to reuse objects from when cloning'
+    )
+
+    parser.add_argument(
+        '--include',
+        required=False,
+        action='append',
+        dest='include',
+        help='Only read files matching this path glob (`**` spans directories), can be repeated'
+    )
+    parser.add_argument(
+        '--exclude',
+        required=False,
+        action='append',
+        dest='exclude',
+        help='Skip files and directories matching this path glob, can be repeated'
+    )
+
+    parser.add_argument(
+        '--index-file',
+        required=False,
+        dest='index_file',
+        help='Index built with `gordian index`, repos and files that cannot match the search strings are skipped'
+    )
+
+    parser.add_argument(
+        '--journal-file',
+        required=False,
+        dest='journal_file',
+        help='Journal of previous runs, repos that had no changes or an open PR for the same campaign are skipped until their target branch moves'
+    )
+
+    parser.add_argument(
+        '--resume',
+        required=False,
+        action='store_true',
+        default=False,
+        dest='resume',
+        help='Continue an interrupted run of the same campaign from the journal, reusing the branches and commits it already pushed'
+    )
+
+    parser.add_argument(
+        '--existing-pr',
+        required=False,
+        choices=['create', 'skip', 'update'],
+        default='create',
+        dest='existing_pr',
+        help='What to do with repos that already have an open PR into the target branch from --branch, or titled --pr with all of --labels: skip them, or push the changes to the PR branch. Checked before any file is read'
+    )
+
+    parser.add_argument(
+        '--plan-file',
+        required=False,
+        dest='plan_file',
+        help='Write the changes to this plan file for `gordian apply` instead of opening pull requests'
+    )
+
     fork = parser.add_mutually_exclusive_group(required=False)
     fork.add_argument(
         '-f', '--fork',
@@ -169,52 +307,568 @@ def create_parser(args):
         raise argparse.ArgumentTypeError('Number of search and replace arguments must be the same!')
     return args
 
+def create_index_parser(args):
+    parser = argparse.ArgumentParser(prog='gordian index', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-c', '--config',
+        required=False,
+        default='config.yaml',
+        dest='config_file',
+        help='Config file path.'
+    )
+    parser.add_argument(
+        '-g', '--github-api',
+        required=False,
+        dest='github_api',
+        help='Github API URL'
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        required=False,
+        action=VerboseLogging,
+        dest='verbose',
+        help='Enable debug output'
+    )
+    parser.add_argument(
+        '-t', '--target-branch',
+        required=False,
+        default='master',
+        dest='target_branch',
+        help='Branch to index'
+    )
+    parser.add_argument(
+        '-i', '--index-file',
+        required=False,
+        default='gordian.idx',
+        dest='index_file',
+        help='Index file to create or update'
+    )
+    parser.add_argument(
+        '--concurrency',
+        required=False,
+        default=1,
+        type=int,
+        dest='concurrency',
+        help='Number of repositories to index in parallel'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        required=False,
+        dest='cache_dir',
+        help='Directory to cache file contents, trees and API responses in between runs'
+    )
+    parser.add_argument(
+        '--cache-size',
+        required=False,
+        default=1024,
+        type=int,
+        dest='cache_size',
+        help='Maximum size of the cache directory in MB'
+    )
+    return parser.parse_args(args)
+
+def index_repositories(args):
+    config = Config(args.config_file)
+    cache = None
+    if args.cache_dir:
+        cache = DiskCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    scheduler = RateLimitScheduler(max_concurrency=args.concurrency)
+    github = create_github_client(args.github_api, pool_size=args.concurrency)
+    index = TrigramIndex(args.index_file)
+
+    def update(repo_name):
+        current_repo.set(repo_name)
+        repo = Repo(repo_name, github_api_url=args.github_api, github=github, target_branch=args.target_branch, cache=cache, scheduler=scheduler)
+        try:
+            index.update_repo(repo, repo_name)
+        finally:
+            repo.close()
+
+    try:
+        run_all(update, config.get_data(), args.concurrency or 1)
+    finally:
+        index.close()
+
+def create_apply_parser(args):
+    parser = argparse.ArgumentParser(prog='gordian apply', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-P', '--plan-file',
+        required=False,
+        default=DEFAULT_PLAN_FILE,
+        dest='plan_file',
+        help='Plan file written by `gordian plan`'
+    )
+    parser.add_argument(
+        '-g', '--github-api',
+        required=False,
+        dest='github_api',
+        help='Github API URL'
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        required=False,
+        action=VerboseLogging,
+        dest='verbose',
+        help='Enable debug output'
+    )
+    parser.add_argument(
+        '--concurrency',
+        required=False,
+        default=1,
+        type=int,
+        dest='concurrency',
+        help='Number of repositories to push to in parallel'
+    )
+    return parser.parse_args(args)
+
+def apply_plan(args, pr_created_callback=None):
+    callback_lock = threading.Lock()
+    scheduler = RateLimitScheduler(max_concurrency=args.concurrency)
+    github = create_github_client(args.github_api, pool_size=args.concurrency)
+
+    def process(entry):
+        token = current_repo.set(entry['repo'])
+        try:
+            logger.info(f"Applying {len(entry['changes'])} planned changes")
+            repo = Repo(
+                entry['repo'],
+                github_api_url=args.github_api,
+                github=github,
+                branch=entry['branch'],
+                target_branch=entry['target_branch'],
+                fork=entry['fork'],
+                batch_commits=True,
+                scheduler=scheduler
+            )
+            pull_request = apply_entry(entry, repo)
+            if pull_request is None:
+                return None
+            if pr_created_callback is not None:
+                with callback_lock:
+                    pr_created_callback(entry['repo'], pull_request)
+            logger.info(f"PR created: {entry['pr']['title']}. Branch: {repo.branch_name}. Labels: {entry['pr']['labels']}")
+            return pull_request.html_url
+        finally:
+            current_repo.reset(token)
+
+    log_pull_requests(run_all(process, list(read_plan(args.plan_file)), args.concurrency))
+
 def apply_transformations(args, transformations, pr_created_callback=None):
     config = Config(args.config_file)
     pr_description = get_pr_description(args)
     transform(args, transformations, config.get_data(), pr_description, pr_created_callback=pr_created_callback)
 
+def apply_async_transformations(args, transformations, pr_created_callback=None):
+    # Runs `AsyncTransformation`s on `AsyncRepo`s, all repos on one event loop
+    config = Config(args.config_file)
+    pr_description = get_pr_description(args)
+    asyncio.run(transform_async(args, transformations, config.get_data(), pr_description, pr_created_callback))
+
 def get_pr_description(args):
     if args.description_file is not None:
         with open(args.description_file,'r') as fh:
             return fh.read()
     return args.description
 
+class RunContext:
+    """The state shared by every repo of a `transform` run: the arguments,
+    the transformations, the clients and the optional cache, index, plan and
+    journal. `close` flushes and closes whatever was opened."""
+
+    def __init__(self, args, transformations, pr_description, pr_created_callback):
+        self.args = args
+        self.transformations = transformations
+        self.pr_description = pr_description
+        self.pr_created_callback = pr_created_callback
+        self.callback_lock = threading.Lock()
+        if getattr(args, 'resume', False) and not getattr(args, 'journal_file', None):
+            raise ValueError('--resume needs the --journal-file of the interrupted run')
+        self.cache = None
+        if getattr(args, 'cache_dir', None):
+            self.cache = DiskCache(args.cache_dir, args.cache_size * 1024 * 1024)
+        self.concurrency = getattr(args, 'concurrency', 1) or 1
+        self.scheduler = RateLimitScheduler(max_concurrency=self.concurrency)
+        self.github = create_github_client(args.github_api, pool_size=self.concurrency)
+        self.result_cache = ResultCache(self.cache)
+        self.index = None
+        if getattr(args, 'index_file', None):
+            self.index = TrigramIndex(args.index_file)
+        self.plan = None
+        if getattr(args, 'plan_file', None):
+            self.plan = PlanWriter(args.plan_file)
+        self.journal = self.campaign = None
+        if getattr(args, 'journal_file', None):
+            self.journal = RunJournal(args.journal_file)
+            self.campaign = campaign_fingerprint(args, transformations)
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+        if self.plan is not None:
+            self.plan.close()
+            logger.info(f'Plan written to {self.plan.path}')
+        if self.journal is not None:
+            self.journal.close()
+
+
 def transform(args, transformations, repositories, pr_description, pr_created_callback):
-    pull_request_urls = []
-    for repo_name in repositories:
-        logger.info(f'Processing repo: {repo_name}')
-        repo = Repo(
-                repo_name,
-                github_api_url=args.github_api,
-                branch=args.branch,
-                semver_label=args.semver_label,
-                target_branch=args.target_branch,
-                fork=args.fork
-        )
-        for transformation in transformations:
-            transformation(args, repo).run()
-        if repo.dirty:
-            repo.bump_version(args.dry_run)
-            if not args.dry_run:
-                try:
-                    pull_request = repo.create_pr(args.pr_message, pr_description, args.target_branch, args.pr_labels)
-                    pull_request_urls.append(pull_request.html_url)
-                    if pr_created_callback is not None:
-                        logger.debug(f'Calling post pr created callback with: {pull_request}, {repo.branch_name}')
-                        pr_created_callback(repo_name, pull_request)
-                    logger.info(f'PR created: {args.pr_message}. Branch: {repo.branch_name}. Labels: {args.pr_labels}')
-                except GithubException as e:
-                    logger.info(f'PR already exists for {repo.branch_name}')
-                    logger.debug(f'Error: {e}')
+    run = RunContext(args, transformations, pr_description, pr_created_callback)
 
+    def screen(repo_name):
+        token = current_repo.set(repo_name)
+        try:
+            return screen_repo(run, repo_name)
+        finally:
+            current_repo.reset(token)
+
+    # Repos are screened before prefetching, so skipped repos aren't read
+    screened = {}
+    prefetched = {}
+    paths = get_prefetch_paths(args, transformations)
+    if paths is not None:
+        screened = dict(zip(repositories, run_all(screen, repositories, run.concurrency)))
+        survivors = [repo_name for repo_name in repositories if screened[repo_name] is not None]
+        prefetched = prefetch_files(args, paths, survivors, run.github, run.scheduler)
+
+    def process(repo_name):
+        token = current_repo.set(repo_name)
+        try:
+            if repo_name in screened and screened[repo_name] is None:
+                return None
+            return process_repo(run, repo_name, prefetched.get(repo_name), screened.get(repo_name))
+        finally:
+            current_repo.reset(token)
+
+    processes = getattr(args, 'processes', 0)
+    if processes:
+        compute.start(processes)
+    try:
+        results = run_all(process, repositories, run.concurrency)
+    finally:
+        compute.stop()
+        run.close()
+
+    log_pull_requests(results)
+
+
+async def transform_async(args, transformations, repositories, pr_description, pr_created_callback, client=None):
+    if args.fork:
+        raise ValueError('Forks are not supported by AsyncRepo')
+    concurrency = getattr(args, 'concurrency', 1) or 1
+    # Repos in flight are bounded by the concurrency, their requests share the client's connections
+    semaphore = asyncio.Semaphore(concurrency)
+    owns_client = client is None
+    if owns_client:
+        client = create_async_client(args.github_api, max_connections=concurrency)
+
+    async def process(repo_name):
+        async with semaphore:
+            # Every task runs in a copy of the context, so the log prefix stays with its repo
+            current_repo.set(repo_name)
+            return await process_repo_async(args, transformations, repo_name, pr_description, pr_created_callback, client)
+
+    logger.info(f'Processing {len(repositories)} repos with concurrency {concurrency}')
+    try:
+        # gather returns results in config order regardless of completion order
+        results = await asyncio.gather(*(process(repo_name) for repo_name in repositories))
+    finally:
+        if owns_client:
+            await client.aclose()
+
+    log_pull_requests(results)
+
+
+async def process_repo_async(args, transformations, repo_name, pr_description, pr_created_callback, client):
+    logger.info(f'Processing repo: {repo_name}')
+    repo = AsyncRepo(
+        repo_name,
+        github_api_url=args.github_api,
+        branch=args.branch,
+        client=client,
+        semver_label=args.semver_label,
+        target_branch=args.target_branch,
+        include=getattr(args, 'include', None),
+        exclude=getattr(args, 'exclude', None)
+    )
+    for transformation in transformations:
+        await transformation(args, repo).run()
+    if not repo.dirty:
+        return None
+
+    repo.bump_version(args.dry_run)
+    if args.dry_run:
+        return None
+
+    try:
+        pull_request = await repo.create_pr(args.pr_message, pr_description, args.target_branch, args.pr_labels)
+        if pr_created_callback is not None:
+            logger.debug(f'Calling post pr created callback with: {pull_request.html_url}, {repo.branch_name}')
+            pr_created_callback(repo_name, pull_request)
+        logger.info(f'PR created: {args.pr_message}. Branch: {repo.branch_name}. Labels: {args.pr_labels}')
+        return pull_request.html_url
+    except GithubException as e:
+        if not pull_request_exists(e):
+            logger.info(f'Could not create PR for {repo.branch_name}: {e}')
+            return None
+        logger.info(f'PR already exists for {repo.branch_name}')
+        logger.debug(f'Error: {e}')
+        return None
+
+
+def run_all(process, items, concurrency):
+    if concurrency > 1:
+        logger.info(f'Processing {len(items)} repos with concurrency {concurrency}')
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='gordian') as executor:
+            # map yields results in config order regardless of completion order
+            return list(executor.map(process, items))
+    return [process(item) for item in items]
+
+
+def log_pull_requests(results):
+    pull_request_urls = [url for url in results if url is not None]
     if pull_request_urls:
         logger.info('Pull requests')
         [ logger.info(url) for url in pull_request_urls ]
 
 
+def get_search_candidates(args, transformations, repo_name, index):
+    # The index describes the target branch, so it can't be used for other branches
+    if index is None or args.branch:
+        return None
+    terms = [t.index_terms(args) for t in transformations]
+    if any(t is None for t in terms):
+        return None
+    return index.candidate_files(repo_name, args.target_branch, [term for ts in terms for term in ts])
+
+
+def get_prefetch_paths(args, transformations):
+    # The files every transformation declares, None when some transformation can't tell
+    if getattr(args, 'clone', False):
+        return None
+    paths = [t.prefetch_paths(args) for t in transformations]
+    if not paths or any(p is None for p in paths):
+        return None
+    paths = [path for ps in paths for path in ps]
+    # The version is read with the listing otherwise, which prefetched repos may never do
+    if args.semver_label:
+        paths.append('version')
+    return paths
+
+
+def prefetch_files(args, paths, repositories, github, scheduler):
+    # The files are read for all repos with a few GraphQL queries
+    if not repositories:
+        return {}
+    logger.info(f'Reading {len(paths)} files of {len(repositories)} repos with GraphQL')
+    reader = BulkReader(github, args.github_api, scheduler)
+    return reader.read(repositories, args.target_branch, paths)
+
+
+def screen_repo(run, repo_name):
+    """Runs the checks that don't need the repo's files. Returns None for a
+    repo to skip, otherwise (candidates, on_result, progress, pull_request)."""
+    args, github, scheduler, journal = run.args, run.github, run.scheduler, run.journal
+    head = None
+    candidates = get_search_candidates(args, run.transformations, repo_name, run.index)
+    if candidates is not None and not candidates:
+        # Files added or changed since the repo was indexed may still match
+        head = get_head_sha(github, scheduler, repo_name, args.target_branch)
+        if head == candidates.head:
+            logger.info(f'Skipping repo: {repo_name}, no files can match according to the index')
+            return None
+        logger.info(f'Index of {repo_name} is out of date, reading the files changed since {candidates.head}')
+
+    on_result = None
+    progress = {}
+    if journal is not None:
+        if head is None:
+            head = get_head_sha(github, scheduler, repo_name, args.target_branch)
+        settled = journal.settled(repo_name, head, run.campaign)
+        if settled is not None:
+            logger.info(f'Skipping repo: {repo_name}, {settled} at {head} in a previous run')
+            return None
+        on_result = functools.partial(journal.record, repo_name, head, run.campaign)
+        if getattr(args, 'resume', False):
+            progress = journal.progress(repo_name, head, run.campaign)
+
+    existing_pr = getattr(args, 'existing_pr', 'create')
+    pull_request = None
+    if existing_pr != 'create' and run.plan is None:
+        pull_request = find_pull_request(github, scheduler, repo_name, args.target_branch, args.branch, args.pr_message, args.pr_labels, args.fork)
+        if pull_request is not None and existing_pr == 'skip':
+            logger.info(f'Skipping repo: {repo_name}, {pull_request.html_url} is already open')
+            if on_result is not None:
+                on_result(PR_EXISTS, url=pull_request.html_url)
+            return None
+    return candidates, on_result, progress, pull_request
+
+
+def process_repo(run, repo_name, prefetched=None, screened=None):
+    if screened is None:
+        screened = screen_repo(run, repo_name)
+        if screened is None:
+            return None
+    candidates, on_result, progress, pull_request = screened
+    args, plan = run.args, run.plan
+
+    branch = args.branch
+    if BRANCH in progress:
+        branch = progress[BRANCH]['branch']
+        logger.info(f'Resuming repo: {repo_name} on branch {branch}')
+    elif pull_request is not None:
+        branch = pull_request.head.ref
+        logger.info(f'Updating {pull_request.html_url} of repo: {repo_name}')
+    else:
+        logger.info(f'Processing repo: {repo_name}')
+    repo_args = dict(
+            github_api_url=args.github_api,
+            github=run.github,
+            branch=branch,
+            semver_label=args.semver_label,
+            target_branch=args.target_branch,
+            fork=args.fork,
+            # Planned changes are staged and written to the plan instead of pushed. Resumed and
+            # PR branches may differ from the target branch, staging commits on top in one go
+            batch_commits=getattr(args, 'batch_commits', False) or plan is not None or BRANCH in progress or pull_request is not None,
+            cache=run.cache,
+            scheduler=run.scheduler,
+            include=getattr(args, 'include', None),
+            exclude=getattr(args, 'exclude', None),
+            result_cache=run.result_cache
+    )
+    if getattr(args, 'clone', False):
+        repo = LocalRepo(repo_name, mirror_dir=getattr(args, 'mirror_dir', None), **repo_args)
+    else:
+        repo = Repo(repo_name, **repo_args)
+        if prefetched is not None:
+            repo.prefill(prefetched)
+    repo.search_candidates = candidates
+    try:
+        if on_result is not None and BRANCH not in progress and plan is None and not args.dry_run:
+            # Journaled before anything is pushed, so a resumed run reuses the name
+            on_result(BRANCH, branch=repo.branch_name[len('refs/heads/'):])
+        committed = progress.get(COMMITTED)
+        if committed is not None and repo._get_existing_branch(branch) is None:
+            logger.info(f'Branch {branch} no longer exists, transforming again')
+            committed = None
+        return run_transformations(run, repo, repo_name, on_result, committed, pull_request)
+    finally:
+        repo.close()
+
+
+def get_head_sha(github, scheduler, repo_name, branch):
+    # A lazy repository doesn't fetch itself, so this is a single request
+    if repo_name.endswith('.git'):
+        repo_name = repo_name[:-4]
+    source_repo = github.get_repo(repo_name, lazy=True)
+    return scheduler.call(source_repo.get_branch, branch).commit.sha
+
+
+def find_pull_request(github, scheduler, repo_name, target_branch, branch, title, labels, fork=False):
+    # Open PRs into the target branch from `branch`, or titled `title` with all the labels
+    if repo_name.endswith('.git'):
+        repo_name = repo_name[:-4]
+    pulls = github.get_repo(repo_name, lazy=True).get_pulls(state='open', base=target_branch)
+    labels = set(labels or [])
+    # Only PRs from the repo gordian pushes to are reused, the repo itself or the user's fork
+    owner = scheduler.call(lambda: github.get_user().login) if fork else None
+    for page in itertools.count():
+        results = scheduler.call(pulls.get_page, page)
+        for pull_request in results:
+            if not is_from_source_repo(pull_request, owner):
+                continue
+            if branch and pull_request.head.ref == branch:
+                return pull_request
+            if pull_request.title == title and labels <= {label.name for label in pull_request.labels}:
+                return pull_request
+        if len(results) < github.per_page:
+            return None
+
+
+def is_from_source_repo(pull_request, fork_owner=None):
+    head_repo = pull_request.head.repo
+    # The head repo of a PR from a deleted fork is gone
+    if head_repo is None:
+        return False
+    if fork_owner is not None:
+        return head_repo.owner.login == fork_owner
+    return head_repo.full_name == pull_request.base.repo.full_name
+
+
+def run_transformations(run, repo, repo_name, on_result=None, committed=None, pull_request=None):
+    args, plan, pr_description, pr_created_callback = run.args, run.plan, run.pr_description, run.pr_created_callback
+    if committed is not None:
+        # Everything was pushed by an interrupted run, only the PR is missing
+        logger.info(f"Changes already committed to {repo.branch_name} ({committed['commit'] or 'per file'})")
+    else:
+        # Recorded before reading any file, so apply can tell whether the branch moved since
+        base_sha = repo._get_branch().commit.sha if plan is not None else None
+        for transformation in run.transformations:
+            transformation(args, repo).run()
+        if not repo.dirty:
+            if on_result is not None:
+                on_result(NO_CHANGE)
+            return None
+
+        repo.bump_version(args.dry_run)
+        if args.dry_run:
+            return None
+
+        if plan is not None:
+            entry = plan_entry(repo, repo_name, base_sha, args.pr_message, pr_description, args.pr_labels, args.fork)
+            plan.add(entry)
+            logger.info(f"Planned {len(entry['changes'])} changes on {repo.branch_name}")
+            return None
+
+        if on_result is not None:
+            on_result(TRANSFORMED)
+            # create_pr would commit the staged changes too, committing first lets a
+            # resumed run skip straight to the PR
+            commit = repo.commit_staged(args.pr_message)
+            on_result(COMMITTED, commit=getattr(commit, 'sha', commit))
+
+    if pull_request is not None:
+        # The PR is already open on this branch, pushing the changes updates it
+        repo.commit_staged(args.pr_message)
+        logger.info(f'PR updated: {pull_request.html_url}. Branch: {repo.branch_name}')
+        if on_result is not None:
+            on_result(PR_EXISTS, url=pull_request.html_url)
+        return pull_request.html_url
+
+    try:
+        pull_request = repo.create_pr(args.pr_message, pr_description, args.target_branch, args.pr_labels)
+        if pr_created_callback is not None:
+            logger.debug(f'Calling post pr created callback with: {pull_request}, {repo.branch_name}')
+            with run.callback_lock:
+                pr_created_callback(repo_name, pull_request)
+        logger.info(f'PR created: {args.pr_message}. Branch: {repo.branch_name}. Labels: {args.pr_labels}')
+        if on_result is not None:
+            on_result(PR_OPENED, url=pull_request.html_url)
+        return pull_request.html_url
+    except GithubException as e:
+        if not pull_request_exists(e):
+            # Left out of the journal so the next run retries the repo
+            logger.info(f'Could not create PR for {repo.branch_name}: {e}')
+            return None
+        logger.info(f'PR already exists for {repo.branch_name}')
+        logger.debug(f'Error: {e}')
+        if on_result is not None:
+            on_result(PR_EXISTS)
+        return None
+
+
 def main():
-    args = create_parser(sys.argv[1:])
+    if sys.argv[1:2] == ['index']:
+        index_repositories(create_index_parser(sys.argv[2:]))
+        return
+    if sys.argv[1:2] == ['apply']:
+        apply_plan(create_apply_parser(sys.argv[2:]))
+        return
+    if sys.argv[1:2] == ['plan']:
+        args = create_parser(sys.argv[2:])
+        args.plan_file = args.plan_file or DEFAULT_PLAN_FILE
+    else:
+        args = create_parser(sys.argv[1:])
     apply_transformations(args, [SearchAndReplace])
 
 if __name__ == '__main__':
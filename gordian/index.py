@@ -0,0 +1,139 @@
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Larger blobs aren't indexed and are always treated as possible matches
+MAX_INDEXED_SIZE = 1024 * 1024
+NGRAM = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (sha TEXT PRIMARY KEY, indexed INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS postings (trigram BLOB NOT NULL, sha TEXT NOT NULL, PRIMARY KEY (trigram, sha)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS heads (repo TEXT NOT NULL, branch TEXT NOT NULL, sha TEXT NOT NULL, PRIMARY KEY (repo, branch));
+CREATE TABLE IF NOT EXISTS files (repo TEXT NOT NULL, branch TEXT NOT NULL, path TEXT NOT NULL, sha TEXT NOT NULL, PRIMARY KEY (repo, branch, path));
+CREATE INDEX IF NOT EXISTS files_sha ON files (sha);
+"""
+
+
+def trigrams(content):
+    return {content[i:i + NGRAM] for i in range(len(content) - NGRAM + 1)}
+
+
+class Candidates:
+    """(path, sha) pairs of the indexed files of a repo that may contain a
+    search string. A file the index hasn't seen at its current sha, e.g. one
+    changed since the index was built, is always a candidate.
+
+    It is falsy when no indexed file matches, which only means nothing in
+    the repo can match while its branch is still at `head`, the commit it
+    was indexed at."""
+
+    def __init__(self, indexed, matching, head=None):
+        self.indexed = frozenset(indexed)
+        self.matching = frozenset(matching)
+        self.head = head
+
+    def __contains__(self, file):
+        return file in self.matching or file not in self.indexed
+
+    def __bool__(self):
+        return bool(self.matching)
+
+
+class TrigramIndex:
+    """On-disk trigram index of the files of many repositories.
+
+    Postings are stored per blob sha, so a blob shared by many repos (or
+    unchanged between runs) is only indexed once. Each repo records the head
+    sha of the branch it was indexed at and is skipped when that hasn't moved.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def get_head(self, repo_name, branch):
+        with self._lock:
+            row = self._db.execute('SELECT sha FROM heads WHERE repo = ? AND branch = ?', (repo_name, branch)).fetchone()
+        return row[0] if row else None
+
+    def update_repo(self, repo, repo_name):
+        head = repo._get_branch().commit.sha
+        if self.get_head(repo_name, repo.target_branch) == head:
+            logger.info(f'Index for {repo_name} is up to date')
+            return False
+
+        files = repo.get_files()
+        with self._lock:
+            known = {row[0] for row in self._db.execute('SELECT sha FROM blobs')}
+
+        added = 0
+        for file in files:
+            if file.sha in known:
+                continue
+            size = getattr(file, 'size', None)
+            if size is not None and size > MAX_INDEXED_SIZE:
+                self._add_blob(file.sha, None)
+            else:
+                self._add_blob(file.sha, trigrams(file.decoded_content))
+            known.add(file.sha)
+            added += 1
+
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM files WHERE repo = ? AND branch = ?', (repo_name, repo.target_branch))
+            self._db.executemany(
+                'INSERT INTO files (repo, branch, path, sha) VALUES (?, ?, ?, ?)',
+                [(repo_name, repo.target_branch, f.path, f.sha) for f in files]
+            )
+            self._db.execute(
+                'INSERT OR REPLACE INTO heads (repo, branch, sha) VALUES (?, ?, ?)',
+                (repo_name, repo.target_branch, head)
+            )
+        logger.info(f'Indexed {repo_name} at {head}: {len(files)} files, {added} new blobs')
+        return True
+
+    def candidate_files(self, repo_name, branch, searches):
+        """Files of the repo that may contain any of the search strings, or None
+        when the repo isn't indexed and every file has to be considered."""
+        head = self.get_head(repo_name, branch)
+        if head is None:
+            return None
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT f.path, f.sha, b.indexed FROM files f JOIN blobs b ON b.sha = f.sha WHERE f.repo = ? AND f.branch = ?',
+                (repo_name, branch)
+            ).fetchall()
+
+        indexed = {(path, sha) for path, sha, _ in rows}
+        matching = set()
+        for search in searches:
+            grams = trigrams(search)
+            if not grams:
+                # Too short to narrow anything down
+                return Candidates(indexed, indexed, head)
+            matching |= self._blobs_containing(grams)
+        return Candidates(indexed, {(path, sha) for path, sha, is_indexed in rows if not is_indexed or sha in matching}, head)
+
+    def _blobs_containing(self, grams):
+        placeholders = ','.join('?' * len(grams))
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT sha FROM postings WHERE trigram IN ({placeholders}) GROUP BY sha HAVING COUNT(*) = ?',
+                (*grams, len(grams))
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def _add_blob(self, sha, grams):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO blobs (sha, indexed) VALUES (?, ?)', (sha, grams is not None))
+            if grams:
+                self._db.executemany('INSERT OR IGNORE INTO postings (trigram, sha) VALUES (?, ?)', ((g, sha) for g in grams))
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Progress of a repo within a run, in order
+BRANCH = 'branch'
+TRANSFORMED = 'transformed'
+COMMITTED = 'committed'
+# Outcomes
+NO_CHANGE = 'no_change'
+PR_EXISTS = 'pr_exists'
+PR_OPENED = 'pr_opened'
+# Outcomes that stay true until the target branch moves or the campaign changes
+SETTLED = (NO_CHANGE, PR_EXISTS, PR_OPENED)
+
+# Arguments that change how a run is executed but not what it produces
+RUN_OPTIONS = {
+    'config_file', 'verbose', 'dry_run', 'concurrency', 'processes', 'batch_commits', 'cache_dir', 'cache_size',
+    'clone', 'mirror_dir', 'index_file', 'plan_file', 'journal_file', 'resume', 'existing_pr',
+}
+
+
+def campaign_fingerprint(args, transformations):
+    """Digest of the transformations and arguments of a campaign. Arguments
+    naming an existing file, like a patch or description file, contribute
+    the file's contents."""
+    digest = hashlib.sha256()
+    for transformation in transformations:
+        name = getattr(transformation, '__qualname__', None) or repr(transformation)
+        digest.update(f'{getattr(transformation, "__module__", "")}.{name}\n'.encode('utf-8'))
+    for name, value in sorted(vars(args).items()):
+        if name in RUN_OPTIONS:
+            continue
+        digest.update(json.dumps([name, value], default=str).encode('utf-8'))
+        if isinstance(value, str) and os.path.isfile(value):
+            with open(value, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class RunJournal:
+    """Append-only log of the outcome of each repo, one JSON object per line.
+
+    A repo whose target branch head and campaign are the same as when it last
+    settled as "no change" or "PR open" doesn't need to be processed again.
+    The progress events in between (branch, transformed, committed) let an
+    interrupted run resume a repo on the branch it had already pushed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._progress = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    self._add(entry)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def close(self):
+        self._file.close()
+
+    def lookup(self, repo_name, campaign):
+        with self._lock:
+            return self._entries.get((repo_name, campaign))
+
+    def settled(self, repo_name, head, campaign):
+        """The settled outcome recorded for this head, or None."""
+        entry = self.lookup(repo_name, campaign)
+        if entry is not None and entry['head'] == head and entry['event'] in SETTLED:
+            return entry['event']
+        return None
+
+    def progress(self, repo_name, head, campaign):
+        """Events recorded for this head, with the data of the latest one of
+        each kind, e.g. {'branch': {...}, 'committed': {...}}."""
+        with self._lock:
+            progress = self._progress.get((repo_name, campaign))
+            if progress is None or progress['head'] != head:
+                return {}
+            return dict(progress['events'])
+
+    def record(self, repo_name, head, campaign, event, **data):
+        entry = dict(data, repo=repo_name, head=head, campaign=campaign, event=event)
+        line = json.dumps(entry, sort_keys=True)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            self._add(entry)
+
+    def _add(self, entry):
+        key = (entry['repo'], entry['campaign'])
+        self._entries[key] = entry
+        progress = self._progress.get(key)
+        if progress is None or progress['head'] != entry['head']:
+            progress = self._progress[key] = {'head': entry['head'], 'events': {}}
+        progress['events'][entry['event']] = entry
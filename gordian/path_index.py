@@ -0,0 +1,180 @@
+import bisect
+import os
+import re
+from collections import defaultdict
+
+REGEX_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+REGEX_QUANTIFIERS = set('*+?{')
+GLOB_SPECIAL_CHARS = set('*?[')
+
+
+def glob_to_regex(pattern):
+    """Compiles a path glob where `*` and `?` stay within a directory, `**`
+    spans any number of directories and `[...]` is a character class."""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 1) != -1:
+            end = pattern.find(']', i + 1)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex += f'[{body}]'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(f'(?:{regex})\\Z')
+
+
+def glob_prefix(pattern):
+    # Literal leading part of a glob, every match starts with it
+    for i, c in enumerate(pattern):
+        if c in GLOB_SPECIAL_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+def regex_prefix(regexp):
+    # Literal leading part of a regex used with re.match, every match starts with it
+    if '|' in regexp:
+        return ''
+    for i, c in enumerate(regexp):
+        if c in REGEX_SPECIAL_CHARS:
+            # A quantifier applies to the previous character, which is then optional
+            return regexp[:i - 1] if c in REGEX_QUANTIFIERS and i > 0 else regexp[:i]
+    return regexp
+
+
+def dirname_prefix(pattern):
+    # Deepest directory every match of the glob is in, '' for the repository root
+    return glob_prefix(pattern).rpartition('/')[0]
+
+
+# Files gordian itself reads at the root of every repo, listed whatever the filter
+ROOT_FILES = ('version', 'CHANGELOG.md')
+
+
+class PathFilter:
+    """Include/exclude path globs, with checks for whole directories so that
+    traversal can skip subtrees no included file can be in.
+
+    A file is kept when it matches an include glob (or there are none) and
+    neither it nor any of its directories matches an exclude glob, so both
+    `vendor` and `vendor/**` exclude everything under `vendor/`. The
+    ROOT_FILES used to bump versions and update changelogs always match.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self._include = [glob_to_regex(p) for p in self.include]
+        self._exclude = [glob_to_regex(p) for p in self.exclude]
+        self._include_segments = [p.split('/') for p in self.include]
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def match(self, path):
+        if path in ROOT_FILES:
+            return True
+        if self._include and not any(r.match(path) for r in self._include):
+            return False
+        parts = path.split('/')
+        return not any(self._excluded('/'.join(parts[:i])) for i in range(1, len(parts) + 1))
+
+    def match_dir(self, path):
+        # Whether any file below the directory can match
+        if self._excluded(path) or any(r.match(f'{path}/') for r in self._exclude):
+            return False
+        if not self._include:
+            return True
+        parts = path.split('/')
+        return any(self._could_contain(segments, parts) for segments in self._include_segments)
+
+    def roots(self):
+        """Directories all included files are in, [''] when that is the whole tree."""
+        if not self.include:
+            return ['']
+        roots = sorted({dirname_prefix(p) for p in self.include})
+        if '' in roots:
+            return ['']
+        # Nested roots are already listed with their parent
+        return [r for i, r in enumerate(roots) if not any(r.startswith(f'{o}/') for o in roots[:i])]
+
+    def _excluded(self, path):
+        return any(r.match(path) for r in self._exclude)
+
+    @staticmethod
+    def _could_contain(segments, parts):
+        for i, part in enumerate(parts):
+            if i >= len(segments) - 1:
+                # The last segment names the file, which is deeper than this directory
+                return '**' in segments[i]
+            if '**' in segments[i]:
+                return True
+            if not glob_to_regex(segments[i]).match(part):
+                return False
+        return True
+
+
+class PathIndex:
+    """Lookups of repository files by path, basename, extension, glob or regex."""
+
+    def __init__(self, files=()):
+        self.by_path = {}
+        self.by_basename = defaultdict(list)
+        self.by_extension = defaultdict(list)
+        self._paths = None
+        for file in files:
+            self.add(file)
+
+    def __len__(self):
+        return len(self.by_path)
+
+    def add(self, file):
+        self.by_path[file.path] = file
+        basename = os.path.basename(file.path)
+        self.by_basename[basename].append(file)
+        self.by_extension[os.path.splitext(basename)[1]].append(file)
+        self._paths = None
+
+    def get(self, path):
+        return self.by_path.get(path)
+
+    def find_basename(self, basename):
+        return list(self.by_basename.get(basename, []))
+
+    def find_extension(self, extension):
+        return list(self.by_extension.get(extension, []))
+
+    def glob(self, pattern):
+        regex = glob_to_regex(pattern)
+        return [self.by_path[p] for p in self._with_prefix(glob_prefix(pattern)) if regex.match(p)]
+
+    def match(self, regexp):
+        regex = re.compile(regexp)
+        return [self.by_path[p] for p in self._with_prefix(regex_prefix(regexp)) if regex.match(p)]
+
+    def _with_prefix(self, prefix):
+        if self._paths is None:
+            self._paths = sorted(self.by_path)
+        if not prefix:
+            return self._paths
+        start = bisect.bisect_left(self._paths, prefix)
+        end = start
+        while end < len(self._paths) and self._paths[end].startswith(prefix):
+            end += 1
+        return self._paths[start:end]
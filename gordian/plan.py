@@ -0,0 +1,125 @@
+import base64
+import gzip
+import json
+import logging
+import threading
+from github import GithubException
+from gordian.bulk_reader import git_blob_sha
+from gordian.repo import pull_request_exists
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class PlanWriter:
+    """Appends the changes computed for each repo to a plan file, one JSON
+    object per line, so a plan interrupted halfway still holds every repo
+    that was completed."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = _open(path, 'w')
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        line = json.dumps(entry, sort_keys=True)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_plan(path):
+    with _open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get('version') != PLAN_VERSION:
+                raise ValueError(f'Unsupported plan version {entry.get("version")} in {path}')
+            yield entry
+
+
+def plan_entry(repo, repo_name, base_sha, pr_message, pr_description, labels, fork=False):
+    """Describes the changes staged on the repo and the PR to open for them."""
+    changes, messages = repo.get_staged_changes()
+    return {
+        'version': PLAN_VERSION,
+        'repo': repo_name,
+        'target_branch': repo.target_branch,
+        'base_sha': base_sha,
+        'branch': repo.branch_name[len('refs/heads/'):],
+        'fork': fork,
+        'pr': {'title': pr_message, 'body': pr_description, 'labels': list(labels)},
+        'messages': messages,
+        'changes': [
+            {
+                'path': path,
+                'old_sha': _listed_sha(repo, path),
+                'mode': mode,
+                'content': None if content is None else base64.b64encode(content).decode('ascii'),
+            }
+            for path, content, mode in changes
+        ],
+    }
+
+
+def _listed_sha(repo, path):
+    # Blob sha the change was computed from, None for new files
+    for file in (repo.version_file, repo.changelog_file, repo.find_file(path)):
+        if file is not None and file.path == path:
+            return file.sha
+    return None
+
+
+def apply_entry(entry, repo):
+    """Pushes the planned changes of one repo and opens the PR. Returns the
+    pull request, or None when the target branch has moved since planning,
+    the PR already exists or it couldn't be opened. A planned branch that
+    already holds the changes, from an earlier apply, isn't pushed again."""
+    head = repo._get_branch().commit.sha
+    if head != entry['base_sha']:
+        logger.info(f"Skipping, {entry['target_branch']} moved from {entry['base_sha']} to {head} since planning")
+        return None
+
+    changes = [
+        (c['path'], None if c['content'] is None else base64.b64decode(c['content']), c['mode'])
+        for c in entry['changes']
+    ]
+    branch = repo._get_existing_branch(entry['branch'])
+    if branch is not None and _has_changes(repo, branch, changes):
+        logger.info(f"{entry['branch']} already holds the planned changes")
+        repo.branch_exists = True
+    else:
+        repo.stage_changes(changes, entry['messages'])
+    pr = entry['pr']
+    try:
+        return repo.create_pr(pr['title'], pr['body'], entry['target_branch'], pr['labels'])
+    except GithubException as e:
+        if not pull_request_exists(e):
+            logger.error(f'Could not apply the plan to {repo.branch_name}: {e}')
+            return None
+        logger.info(f'PR already exists for {repo.branch_name}')
+        logger.debug(f'Error: {e}')
+        return None
+
+
+def _has_changes(repo, branch, changes):
+    # Compares blob shas with the branch tree, a truncated listing counts as missing changes
+    tree = repo._get_git_tree(branch.commit.sha, recursive=True)
+    if tree.raw_data.get('truncated'):
+        return False
+    blobs = {e.path: e.sha for e in tree.tree if e.type == 'blob'}
+    return all(
+        blobs.get(path) == (None if content is None else git_blob_sha(content))
+        for path, content, _ in changes
+    )
@@ -1,20 +1,57 @@
 from github import Github
 from github import GithubException
+from github import InputGitTreeElement
+from github import UnknownObjectException
+from github.Branch import Branch
+from github.Repository import Repository
+import base64
 import datetime
+import json
 import logging
 import os
-from retry import retry
+from gordian.cache import LRUCache
+from gordian.client import use_pooled_connections
+from gordian.scheduler import RateLimitScheduler
 from gordian.files import *
 from gordian.files.plaintext_file import PlainTextFile
+from gordian.path_index import PathIndex, PathFilter, ROOT_FILES
+from gordian.staging import StagingMixin, DEFAULT_FILE_MODE
 
 logger = logging.getLogger(__name__)
 
 BASE_URL = 'https://api.github.com'
+BLOB_CACHE_SIZE = 64 * 1024 * 1024
+# Shared by every Repo that isn't handed a scheduler explicitly
+DEFAULT_SCHEDULER = RateLimitScheduler()
 
 
-class Repo:
+def create_github_client(github_api_url=None, token=None, username=None, password=None, pool_size=None):
+    # With a pool size the client can be shared by every Repo (and thread) in a
+    # run, reusing keep-alive connections instead of one pool per repository
+    if github_api_url is None:
+        github_api_url = BASE_URL
+    username = os.getenv('GIT_USERNAME', username)
+    password = os.getenv('GIT_PASSWORD', password)
+    token = os.getenv('GIT_TOKEN', token)
 
-    def __init__(self, repo_name, github_api_url=None, branch=None, github=None, files=None, semver_label=None, target_branch='master', fork=False, token=None, username=None, password=None):
+    if token:
+        logger.debug('Using git token for authentication')
+        kwargs = {'login_or_token': token}
+    else:
+        logger.debug('Using git username and password for authentication')
+        kwargs = {'login_or_token': username, 'password': password}
+
+    if pool_size is None:
+        return Github(base_url=github_api_url, **kwargs)
+
+    github = Github(base_url=github_api_url, pool_size=pool_size, **kwargs)
+    use_pooled_connections(github, pool_size)
+    return github
+
+
+class Repo(StagingMixin):
+
+    def __init__(self, repo_name, github_api_url=None, branch=None, github=None, files=None, semver_label=None, target_branch='master', fork=False, token=None, username=None, password=None, blob_cache_size=BLOB_CACHE_SIZE, batch_commits=False, cache=None, scheduler=None, include=None, exclude=None, result_cache=None):
         if github_api_url is None:
             self.github_api_url = BASE_URL
         else:
@@ -23,28 +60,30 @@ class Repo:
         if github is not None:
             self._github = github
         else:
-            username = os.getenv('GIT_USERNAME', username)
-            password = os.getenv('GIT_PASSWORD', password)
-            token = os.getenv('GIT_TOKEN', token)
-
-            if token:
-                logger.debug('Using git token for authentication')
-                self._github = Github(base_url=self.github_api_url, login_or_token=token)
-            else:
-                logger.debug('Using git username and password for authentication')
-                self._github = Github(base_url=self.github_api_url, login_or_token=username, password=password)
+            self._github = create_github_client(self.github_api_url, token, username, password)
 
         if files is None:
             files = []
+        self._index = None
         self.files = files
+        self._blobs = LRUCache(blob_cache_size)
+        self._cache = cache
+        self._scheduler = scheduler or DEFAULT_SCHEDULER
+        self._requester = None
+        self._path_filter = PathFilter(include, exclude)
+        # Shared by the repos of a run so identical blobs are only transformed once
+        self.result_cache = result_cache
+        self.batch_commits = batch_commits
+        self._staged = {}
+        self._staged_messages = []
+        # Paths that may contain the search strings according to an index, None means unknown
+        self.search_candidates = None
 
         if repo_name.endswith('.git'):
             repo_name = repo_name[:-4]
 
         self._initialize_repos(repo_name, fork)
 
-        self.version_file = None
-        self.changelog_file = None
         self.branch_exists = False
         self.dirty = False
         self.new_version = None
@@ -63,49 +102,133 @@ class Repo:
         if file is None:
             raise FileNotFoundError
 
-        if klass:
-            return klass(file, self)
-
-        _, ext = os.path.splitext(filename)
+        return open_file(file, self, klass)
 
-        if ext in ('.yaml', '.yml'):
-            return YamlFile(file, self)
-        if ext == '.json':
-            return JsonFile(file, self)
-        if ext == '.md':
-            return MarkdownFile(file, self)
+    @property
+    def files(self):
+        return self._files
 
-        return PlainTextFile(file, self)
+    @files.setter
+    def files(self, files):
+        self._files = files
+        self._index = None
 
     def get_files(self, path=''):
-        if not self.files:
-            contents = self._get_repo_contents(path)
+        if self._index is None:
+            for _ in self.iter_files(path):
+                pass
+        return self.files
 
-            while contents:
-                file = contents.pop(0)
+    def iter_files(self, path=''):
+        """Yields files as the tree listing discovers them, so callers can start
+        working before a large listing has finished. The listing is kept for
+        later lookups once it has been fully consumed."""
+        if self._index is not None or self.files:
+            files = self.files
+            yield from list(files)
+        else:
+            files = []
+            for file in self._list_tree(path):
                 if file.path == 'version':
                     self.version_file = file
                 elif file.path == 'CHANGELOG.md':
-                    self.changelog = ChangelogFile(file, self)
-                elif file.type == 'dir':
-                    contents.extend(self._get_repo_contents(file.path))
+                    self.changelog_file = file
                 else:
-                    self.files.append(file)
+                    files.append(file)
+                    yield file
+            self.files = files
+
+        if self._index is None:
+            # Built once per listing so lookups don't scan every file
+            self._index = PathIndex(files)
+            self._get_new_version()
+
+    def release(self, file):
+        # Drops the cached contents of a file that has been processed and won't be needed again
+        self._blobs.pop(file.sha)
+
+    def prefill(self, files):
+        """Registers files read ahead of the tree listing, e.g. by
+        `gordian.bulk_reader.BulkReader`, so looking them up doesn't list the
+        tree. `files` maps paths to `(sha, size, content)`, content being None
+        when it still has to be fetched, or to None for paths that don't exist.
+        Prefill `version` too when bumping versions, it is otherwise only read
+        with the listing."""
+        for path, entry in files.items():
+            file = None
+            if entry is not None:
+                sha, size, content = entry
+                file = RepoFile(path, sha, size, self)
+                if content is not None:
+                    self._blobs.put(sha, content)
+            if path == 'version':
+                self.version_file = file
+            elif path == 'CHANGELOG.md':
+                self.changelog_file = file
+            self._prefilled[path] = file
+        if 'version' in files:
+            self._get_new_version()
+
+    @property
+    def changelog(self):
+        # Parsed on first use so repos whose changelog is never touched don't fetch it
+        if self._changelog is None:
+            if 'CHANGELOG.md' not in self._prefilled:
+                self.get_files()
+            if self.changelog_file is not None:
+                self._changelog = ChangelogFile(self.changelog_file, self)
+        return self._changelog
+
+    @changelog.setter
+    def changelog(self, changelog):
+        self._changelog = changelog
+
+    def read_blob(self, sha):
+        content = self._blobs.get(sha)
+        if content is not None:
+            return content
+
+        if self._cache is not None:
+            content = self._cache.get('blobs', sha)
+        if content is None:
+            content = self._get_blob_content(sha)
+            if self._cache is not None:
+                self._cache.put('blobs', sha, content)
+        self._blobs.put(sha, content)
+        return content
 
-        self._get_new_version()
+    def find_file(self, filename):
+        if self._index is None and filename in self._prefilled:
+            return self._prefilled[filename]
+        self.get_files()
+        return self._index.get(filename)
 
-        return self.files
+    def find_files(self, pattern):
+        # Glob on the full path: `*` stays within a directory, `**` spans directories
+        self.get_files()
+        return self._index.glob(pattern)
 
-    def find_file(self, filename):
-        for file in self.get_files():
-            if file.path == filename:
-                return file
+    def find_files_by_name(self, basename):
+        self.get_files()
+        return self._index.find_basename(basename)
+
+    def match_files(self, regexp):
+        # Files whose path matches the regex from the start, as re.match does
+        self.get_files()
+        return self._index.match(regexp)
 
     def _initialize_repos(self, repo_name, fork):
-        self._target_repo = self._github.get_repo(repo_name)
+        if self._cache is not None:
+            lazy_repo = self._github.get_repo(repo_name, lazy=True)
+            self._requester = lazy_repo._requester
+            headers, data = self._conditional_get(lazy_repo._requester, lazy_repo.url)
+            self._target_repo = Repository(lazy_repo._requester, headers, data, completed=True)
+        else:
+            self._target_repo = self._call(self._github.get_repo, repo_name)
+            self._requester = self._target_repo._requester
         if fork:
             logger.info('Forking repo...')
-            self._source_repo = self._target_repo.create_fork()
+            self._source_repo = self._call(self._target_repo.create_fork)
         else:
             self._source_repo = self._target_repo
 
@@ -115,6 +238,10 @@ class Repo:
 
         # Resetting the file cache when we change the branch
         self.files = []
+        self._prefilled = {}
+        self.version_file = None
+        self.changelog_file = None
+        self._changelog = None
 
         self.target_branch = target_branch
         self.target_ref = f"refs/heads/{self.target_branch}"
@@ -126,11 +253,10 @@ class Repo:
             self.branch_name = f"refs/heads/{datetime.datetime.now().strftime('%Y-%m-%d-%H%M%S.%f')}"
             self.source_branch = self.target_ref
 
-    @retry((GithubException, TimeoutError), tries=3, delay=1, backoff=2)
     def _get_repo_contents(self, path):
         try:
             logger.debug(f'Fetching repo contents {path}...')
-            return self._source_repo.get_contents(path, self.target_branch)
+            return self._call(self._source_repo.get_contents, path, self.target_branch)
         except GithubException as e:
             if e.status == 404:
                 raise e
@@ -139,45 +265,153 @@ class Repo:
             logger.info(f'Error fetching repo contents: {e}')
             raise e
 
-    @retry(GithubException, tries=3, delay=1, backoff=2)
+    def _list_tree(self, path=''):
+        if self._cache is not None:
+            files = self._list_cached_tree()
+        else:
+            files = self._list_remote_tree(self.target_branch)
+
+        prefix = f"{path.strip('/')}/" if path else ''
+        for file in files:
+            if file.path.startswith(prefix):
+                yield file
+
+    def _list_cached_tree(self):
+        # Trees are immutable for a given head commit, so they are cached by (repo, head sha)
+        head_sha = self._get_branch().commit.sha
+        key = f'{self._source_repo.full_name}@{head_sha}'
+        if self._path_filter:
+            key += '?' + json.dumps([self._path_filter.include, self._path_filter.exclude])
+        cached = self._cache.get('trees', key)
+        if cached is not None:
+            logger.debug(f'Using cached tree for {key}')
+            return [RepoFile(path, sha, size, self, mode) for path, sha, size, mode in json.loads(cached)]
+
+        files = list(self._list_remote_tree(head_sha))
+        entries = [[f.path, f.sha, f.size, f.mode] for f in files]
+        self._cache.put('trees', key, json.dumps(entries).encode('utf-8'))
+        return files
+
+    def _list_remote_tree(self, sha):
+        # Only the directories that included files can be in are listed
+        roots = self._path_filter.roots()
+        top = None
+        if '' not in roots:
+            # The version and changelog are at the root, outside the listed directories
+            top = self._get_git_tree(sha).tree
+            for e in top:
+                if e.type == 'blob' and e.path in ROOT_FILES:
+                    yield RepoFile(e.path, e.sha, e.size, self, e.mode)
+        for root in roots:
+            tree_sha = self._resolve_tree(sha, root, top) if root else sha
+            if tree_sha is None:
+                logger.debug(f'{root} not found in {sha}')
+                continue
+            for file in self._list_subtree(tree_sha, f'{root}/' if root else ''):
+                if self._path_filter.match(file.path):
+                    yield file
+
+    def _list_subtree(self, sha, base=''):
+        # A single recursive request lists the whole subtree. GitHub truncates
+        # very large trees, in which case we page through the subtrees instead.
+        tree = self._get_git_tree(sha, recursive=True)
+        if tree.raw_data.get('truncated'):
+            logger.debug(f'Tree listing for {sha} truncated, fetching subtrees...')
+            return self._walk_tree(sha, base)
+        return (RepoFile(f'{base}{e.path}', e.sha, e.size, self, e.mode) for e in tree.tree if e.type == 'blob')
+
+    def _walk_tree(self, sha, base=''):
+        for element in self._get_git_tree(sha).tree:
+            path = f'{base}{element.path}'
+            if element.type == 'blob':
+                yield RepoFile(path, element.sha, element.size, self, element.mode)
+            elif element.type == 'tree':
+                if not self._path_filter.match_dir(path):
+                    logger.debug(f'Skipping {path}')
+                    continue
+                yield from self._list_subtree(element.sha, f'{path}/')
+
+    def _resolve_tree(self, sha, path, entries=None):
+        # Follows the directories of path with shallow requests, None if one doesn't exist.
+        # entries can hold the already fetched listing of sha.
+        for name in path.split('/'):
+            if entries is None:
+                entries = self._get_git_tree(sha).tree
+            entry = next((e for e in entries if e.path == name and e.type == 'tree'), None)
+            if entry is None:
+                return None
+            sha = entry.sha
+            entries = None
+        return sha
+
+    def _get_git_tree(self, sha, recursive=False):
+        logger.debug(f'Fetching git tree {sha}...')
+        # The API treats any value of `recursive`, even false, as recursive
+        if recursive:
+            return self._call(self._source_repo.get_git_tree, sha, recursive=True)
+        return self._call(self._source_repo.get_git_tree, sha)
+
+    def _get_blob_content(self, sha):
+        logger.debug(f'Fetching blob {sha}...')
+        blob = self._call(self._source_repo.get_git_blob, sha)
+        return base64.b64decode(blob.content)
+
     def _make_branch(self):
         branch = self._get_branch()
         logger.debug(f'Creating branch {self.branch_name}')
 
         try:
-            ref = self._source_repo.create_git_ref(ref=self.branch_name, sha=branch.commit.sha)
+            ref = self._call(self._source_repo.create_git_ref, ref=self.branch_name, sha=branch.commit.sha)
         except GithubException as e:
             logger.debug(f'Branch {self.branch_name} already exists in github')
         self.branch_exists = True
 
     def _get_branch(self):
         logger.debug(f'Fetching branch {self.target_branch}...')
-        return self._source_repo.get_branch(self.target_branch)
-
-    def bump_version(self, dry_run=False):
-        if self.new_version is None:
-            return
-
-        logger.info(f'Bumping version {self.new_version}')
-        self.update_file(
-            self.version_file,
-            self.new_version,
-            f'Bumping version to {self.new_version}',
-            dry_run
-        )
-
-    def update_file(self, repo_file, content, message, dry_run=False):
-        self.dirty = True
-        logger.info(message)
-        if dry_run:
-            logger.info('dry-run')
-            return
-
+        if self._cache is None:
+            return self._call(self._source_repo.get_branch, self.target_branch)
+
+        requester = self._source_repo._requester
+        headers, data = self._conditional_get(requester, f'{self._source_repo.url}/branches/{self.target_branch}')
+        return Branch(requester, headers, data, completed=True)
+
+    def _conditional_get(self, requester, url, parameters=None):
+        # Replays the validators of the last response so unchanged resources come
+        # back as a 304, which doesn't count against the rate limit
+        key = json.dumps([url, parameters], sort_keys=True)
+        cached = self._cache.get('etags', key)
+        cached = json.loads(cached) if cached is not None else None
+
+        request_headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                request_headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                request_headers['If-Modified-Since'] = cached['last_modified']
+
+        status, headers, output = self._call(requester.requestJson, 'GET', url, parameters, request_headers)
+        if status == 304 and cached is not None:
+            logger.debug(f'Not modified: {url}')
+            return headers, cached['data']
+
+        data = json.loads(output) if output else None
+        if status == 404:
+            raise UnknownObjectException(status, data, headers)
+        if status >= 400:
+            raise GithubException(status, data, headers)
+
+        if headers.get('etag') or headers.get('last-modified'):
+            entry = {'etag': headers.get('etag'), 'last_modified': headers.get('last-modified'), 'data': data}
+            self._cache.put('etags', key, json.dumps(entry).encode('utf-8'))
+        return headers, data
+
+    def _update_remote_file(self, repo_file, content, message):
         if not self.branch_exists:
             self._make_branch()
 
         logger.debug(f'Updating file {repo_file.path}')
-        self._source_repo.update_file(
+        self._call(
+            self._source_repo.update_file,
             repo_file.path,
             message,
             content,
@@ -185,51 +419,85 @@ class Repo:
             branch=self.branch_name
         )
 
-    def create_file(self, path, contents, message, dry_run=False):
-        self.dirty = True
-        logger.info(message)
-        if dry_run:
-            logger.info('dry-run')
-            return
-
+    def _create_remote_file(self, path, contents, message):
         if not self.branch_exists:
             self._make_branch()
 
         logger.debug(f'Creating file {path}')
-        self._source_repo.create_file(
+        self._call(
+            self._source_repo.create_file,
             path,
             message,
             contents,
             branch=self.branch_name
         )
 
-    def delete_file(self, file, message, dry_run=False):
-        self.dirty = True
-        logger.info(message)
-        if dry_run:
-            logger.info('dry-run')
-            return
-
+    def _delete_remote_file(self, file, message):
         if not self.branch_exists:
             self._make_branch()
 
         logger.debug(f'Deleting file {file.path}')
-        self._source_repo.delete_file(
+        self._call(
+            self._source_repo.delete_file,
             file.path,
             message,
             file.sha,
             branch=self.branch_name
         )
 
+    def commit_staged(self, message):
+        if not self._staged:
+            return None
+
+        # Build on top of the source branch when it already exists (--branch),
+        # otherwise branch off the target branch
+        source_branch = self.branch_name[len('refs/heads/'):]
+        parent = self._get_existing_branch(source_branch) if self.source_branch == self.branch_name else None
+        base = parent or self._get_branch()
+        base_commit = base.commit.commit
+
+        logger.debug(f'Committing {len(self._staged)} staged changes on top of {base_commit.sha}')
+        elements = [self._tree_element(path, content, mode) for path, (content, mode) in self._staged.items()]
+        tree = self._call(self._source_repo.create_git_tree, elements, base_commit.tree)
+        commit = self._call(self._source_repo.create_git_commit, self._commit_message(message), tree, [base_commit])
+
+        if parent is not None:
+            ref = self._call(self._source_repo.get_git_ref, f'heads/{source_branch}')
+            self._call(ref.edit, commit.sha)
+        else:
+            self._call(self._source_repo.create_git_ref, ref=self.branch_name, sha=commit.sha)
+        self.branch_exists = True
+        self._clear_staged()
+        return commit
+
+    def _tree_element(self, path, content, mode):
+        if content is None:
+            return InputGitTreeElement(path, mode, 'blob', sha=None)
+        try:
+            return InputGitTreeElement(path, mode, 'blob', content=content.decode('utf-8'))
+        except UnicodeDecodeError:
+            blob = self._call(self._source_repo.create_git_blob, base64.b64encode(content).decode('ascii'), 'base64')
+            return InputGitTreeElement(path, mode, 'blob', sha=blob.sha)
+
+    def _get_existing_branch(self, branch):
+        try:
+            return self._call(self._source_repo.get_branch, branch)
+        except GithubException as e:
+            if e.status != 404:
+                raise e
+            return None
+
     def create_pr(self, pr_message, pr_body, target_branch, labels=[]):
-        pr = self._target_repo.create_pull(
+        self.commit_staged(pr_message)
+        pr = self._call(
+            self._target_repo.create_pull,
             pr_message,
             pr_body,
             target_branch,
             f'{self._source_repo.owner.login}:{self.branch_name}'
         )
         if labels:
-            pr.set_labels(*labels)
+            self._call(pr.set_labels, *labels)
         return pr
 
     def _get_new_version(self):
@@ -241,16 +509,82 @@ class Repo:
             return
 
         version = self.version_file.decoded_content.decode('utf-8')
-        major, minor, patch = version.split('.')
-        if self.semver_label == 'major':
-            major = str(int(major) + 1)
-            minor = patch = '0'
-        elif self.semver_label == 'minor':
-            minor = str(int(minor) + 1)
-            patch = '0'
-        elif self.semver_label == 'patch':
-            patch = str(int(patch) + 1)
-        self.new_version = '.'.join([major, minor, patch])
+        self.new_version = next_version(version, self.semver_label)
+
+    def close(self):
+        # Releases local resources held by the backend, nothing for the API backend
+        return
+
+    def _call(self, fn, *args, **kwargs):
+        # Every API call goes through the shared scheduler so concurrent repos
+        # respect GitHub's primary and secondary rate limits together
+        result = self._scheduler.call(fn, *args, **kwargs)
+        self._scheduler.observe(self._requester)
+        return result
 
     def get_github_client(self):
         return self._github
+
+
+def pull_request_exists(e):
+    # GitHub answers 422 "Validation Failed" with this message among the errors
+    if e.status != 422 or not isinstance(e.data, dict):
+        return False
+    errors = [error for error in e.data.get('errors') or [] if isinstance(error, dict)]
+    messages = [e.data.get('message')] + [error.get('message') for error in errors]
+    return any('A pull request already exists' in (message or '') for message in messages)
+
+
+def open_file(file, repo, klass=None):
+    # Wraps a listed file in the class handling its format, by extension
+    if klass:
+        return klass(file, repo)
+
+    _, ext = os.path.splitext(file.path)
+
+    if ext in ('.yaml', '.yml'):
+        return YamlFile(file, repo)
+    if ext == '.json':
+        return JsonFile(file, repo)
+    if ext == '.md':
+        return MarkdownFile(file, repo)
+
+    return PlainTextFile(file, repo)
+
+
+def next_version(version, semver_label):
+    major, minor, patch = version.split('.')
+    if semver_label == 'major':
+        major = str(int(major) + 1)
+        minor = patch = '0'
+    elif semver_label == 'minor':
+        minor = str(int(minor) + 1)
+        patch = '0'
+    elif semver_label == 'patch':
+        patch = str(int(patch) + 1)
+    return '.'.join([major, minor, patch])
+
+
+class RepoFile:
+    """A blob listed from the repository tree, mirroring the parts of
+    ContentFile that gordian uses. Contents are fetched when accessed and
+    kept in the repo's bounded blob cache rather than on the entry."""
+
+    def __init__(self, path, sha, size, repo, mode=DEFAULT_FILE_MODE):
+        self.path = path
+        self.sha = sha
+        self.size = size
+        self.mode = mode
+        self.type = 'file'
+        self.name = os.path.basename(path)
+        self._repo = repo
+
+    def __repr__(self):
+        return f'RepoFile(path="{self.path}")'
+
+    @property
+    def decoded_content(self):
+        staged, content = self._repo.get_staged_content(self.path)
+        if staged:
+            return content
+        return self._repo.read_blob(self.sha)
@@ -0,0 +1,173 @@
+import email.utils
+import itertools
+import logging
+import threading
+import time
+from github import GithubException
+from github import RateLimitExceededException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 15.0
+DEFAULT_BURST = 50
+MIN_RATE = 0.1
+# Share of the primary rate limit below which calls are paced to last until the reset
+LOW_WATER_MARK = 0.1
+SECONDARY_LIMIT_BACKOFF = 60
+# Server errors and timeouts are retried after 1s, then 2s
+TRANSIENT_RETRIES = 2
+TRANSIENT_DELAY = 1
+
+
+def parse_retry_after(value, now):
+    """Seconds to wait for a Retry-After header, which GitHub may send as a
+    number of seconds or as an HTTP date."""
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - now, 0)
+    except (TypeError, ValueError, IndexError):
+        logger.debug(f'Could not parse Retry-After: {value}')
+        return SECONDARY_LIMIT_BACKOFF
+
+
+def is_transient(e):
+    if isinstance(e, TimeoutError):
+        return True
+    return isinstance(e, GithubException) and isinstance(e.status, int) and e.status >= 500
+
+
+class RateLimitScheduler:
+    """Paces the GitHub API calls of every Repo sharing it.
+
+    Calls take a token from a bucket refilled at `rate` per second. Once less
+    than LOW_WATER_MARK of the primary rate limit is left, the rate is lowered
+    to spread the remainder over the rest of its window, and when GitHub
+    reports a rate limit every caller waits until the reset (or Retry-After)
+    before the call is retried. Secondary rate limits (abuse detection) also
+    halve the number of calls allowed in flight, which then grows back by one
+    after a run of successful calls. Server errors and timeouts are retried
+    by the failing caller alone, with a short backoff.
+    """
+
+    def __init__(self, max_concurrency=8, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_retries=5, clock=time.time, sleep=time.sleep):
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = burst
+        self._refilled_at = clock()
+        self._paused_until = 0
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def call(self, fn, *args, **kwargs):
+        failures = 0
+        for attempt in itertools.count():
+            backoff = None
+            self._acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except (GithubException, TimeoutError) as e:
+                wait = self._throttle(e) if isinstance(e, GithubException) else None
+                if wait is None and is_transient(e) and failures < TRANSIENT_RETRIES:
+                    backoff = TRANSIENT_DELAY * 2 ** failures
+                    failures += 1
+                    logger.info(f'{type(e).__name__}: {e}, retrying in {backoff:.0f}s')
+                elif wait is None or attempt >= self.max_retries:
+                    raise e
+                else:
+                    logger.info(f'Rate limited by GitHub, retrying in {wait:.0f}s')
+            else:
+                self._succeeded()
+                return result
+            finally:
+                self._release()
+            if backoff is not None:
+                # Outside the scheduler, other callers keep going meanwhile
+                self._sleep(backoff)
+
+    def observe(self, requester):
+        # PyGithub keeps the X-RateLimit-* headers of the last response on its requester
+        try:
+            remaining, limit = requester.rate_limiting
+            reset = requester.rate_limiting_resettime
+        except (AttributeError, TypeError, ValueError):
+            return
+        if not all(isinstance(v, int) for v in (remaining, limit, reset)) or remaining < 0:
+            return
+
+        with self._condition:
+            now = self._clock()
+            if remaining == 0:
+                self._paused_until = max(self._paused_until, reset + 1)
+            elif remaining < limit * LOW_WATER_MARK:
+                self.rate = min(self.max_rate, max(remaining / max(reset - now, 1), MIN_RATE))
+            else:
+                # Plenty of budget left, pacing would only slow the run down
+                self.rate = self.max_rate
+
+    def _acquire(self):
+        with self._condition:
+            while True:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+
+                if now < self._paused_until:
+                    timeout = self._paused_until - now
+                elif self._in_flight >= self.concurrency:
+                    timeout = None
+                elif self._tokens < 1:
+                    timeout = (1 - self._tokens) / self.rate
+                else:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+                self._condition.wait(timeout)
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _succeeded(self):
+        with self._condition:
+            self._successes += 1
+            if self.concurrency < self.max_concurrency and self._successes >= 10 * self.concurrency:
+                self.concurrency += 1
+                self._successes = 0
+
+    def _throttle(self, e):
+        headers = e.headers or {}
+        message = e.data.get('message', '') if isinstance(e.data, dict) else ''
+        now = self._clock()
+
+        if e.status in (403, 429) and headers.get('x-ratelimit-remaining') == '0':
+            try:
+                reset = int(headers['x-ratelimit-reset'])
+            except (KeyError, TypeError, ValueError):
+                reset = now + SECONDARY_LIMIT_BACKOFF
+            wait = max(reset - now, 0) + 1
+        elif e.status in (403, 429) and ('retry-after' in headers or 'secondary rate limit' in message.lower() or 'abuse' in message.lower()):
+            wait = parse_retry_after(headers['retry-after'], now) if 'retry-after' in headers else SECONDARY_LIMIT_BACKOFF
+            with self._condition:
+                self.concurrency = max(1, self.concurrency // 2)
+                self._successes = 0
+            logger.info(f'Hit a secondary rate limit, lowering concurrency to {self.concurrency}')
+        elif isinstance(e, RateLimitExceededException):
+            wait = SECONDARY_LIMIT_BACKOFF
+        else:
+            return None
+
+        with self._condition:
+            self._paused_until = max(self._paused_until, now + wait)
+            self._condition.notify_all()
+        return wait
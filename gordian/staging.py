@@ -0,0 +1,96 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILE_MODE = '100644'
+
+
+class StagingMixin:
+    """File changes kept in memory until `commit_staged` pushes them as one
+    commit, shared by `Repo` and `AsyncRepo`.
+
+    Classes using it set `_staged` and `_staged_messages` up in `__init__`.
+    With `batch_commits` off, writes go through `_update_remote_file`,
+    `_create_remote_file` and `_delete_remote_file` instead of being staged.
+    """
+
+    batch_commits = True
+
+    def bump_version(self, dry_run=False):
+        if self.new_version is None:
+            return
+
+        logger.info(f'Bumping version {self.new_version}')
+        self.update_file(
+            self.version_file,
+            self.new_version,
+            f'Bumping version to {self.new_version}',
+            dry_run
+        )
+
+    def update_file(self, repo_file, content, message, dry_run=False):
+        if not self._start_change(message, dry_run):
+            return
+        if self.batch_commits:
+            self._stage(repo_file.path, content, message, getattr(repo_file, 'mode', DEFAULT_FILE_MODE))
+        else:
+            self._update_remote_file(repo_file, content, message)
+
+    def create_file(self, path, contents, message, dry_run=False):
+        if not self._start_change(message, dry_run):
+            return
+        if self.batch_commits:
+            self._stage(path, contents, message)
+        else:
+            self._create_remote_file(path, contents, message)
+
+    def delete_file(self, file, message, dry_run=False):
+        if not self._start_change(message, dry_run):
+            return
+        if self.batch_commits:
+            self._stage(file.path, None, message)
+        else:
+            self._delete_remote_file(file, message)
+
+    def get_staged_content(self, path):
+        # Returns (staged, content), content being None for staged deletions
+        if path not in self._staged:
+            return False, None
+        return True, self._staged[path][0]
+
+    def get_staged_changes(self):
+        # Returns the staged (path, content, mode) changes and their messages
+        return [(path, content, mode) for path, (content, mode) in self._staged.items()], list(self._staged_messages)
+
+    def stage_changes(self, changes, messages):
+        # Stages changes computed elsewhere, e.g. read back from a plan
+        self.dirty = True
+        for path, content, mode in changes:
+            self._staged[path] = (content, mode)
+        self._staged_messages.extend(messages)
+
+    def _start_change(self, message, dry_run):
+        # False when the change is only logged
+        self.dirty = True
+        logger.info(message)
+        if dry_run:
+            logger.info('dry-run')
+            return False
+        return True
+
+    def _stage(self, path, content, message, mode=None):
+        logger.debug(f'Staging {"deletion of" if content is None else "changes to"} {path}')
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if mode is None:
+            mode = self._staged.get(path, (None, DEFAULT_FILE_MODE))[1]
+        self._staged[path] = (content, mode)
+        self._staged_messages.append(message)
+
+    def _commit_message(self, message):
+        body = '\n'.join(f'- {m}' for m in self._staged_messages)
+        return f'{message}\n\n{body}'
+
+    def _clear_staged(self):
+        self._staged = {}
+        self._staged_messages = []
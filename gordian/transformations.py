@@ -1,16 +1,21 @@
+import functools
+import hashlib
+import json
 import logging
-import os
 
-import yaml
 import re
 import jsonpatch
 import copy
 from deepdiff import DeepDiff
 
+from gordian import yaml_backend
+from gordian.compute import run_compute
 from gordian.files.plaintext_file import PlainTextFile
 
 logger = logging.getLogger(__name__)
 
+MISSING = object()
+
 
 class Transformation(object):
 
@@ -22,68 +27,230 @@ class Transformation(object):
     def run(self):
         raise NotImplementedError('Please subclass the transformation and overrite this method')
 
+    @classmethod
+    def index_terms(cls, args):
+        # Literal strings a file must contain to be changed, None if any file may be
+        return None
+
+    @classmethod
+    def prefetch_paths(cls, args):
+        # Paths the transformation reads, read ahead for every repo in bulk; None to list the tree as usual
+        return None
+
+    def fingerprint(self):
+        """Digest of everything besides the file contents that the output of
+        `transform_blob` depends on, None if results can't be reused."""
+        return None
+
+    def transform_blob(self, file, compute):
+        """Calls `compute(content)`, which returns None for no change or a
+        `(content, note)` pair, reusing the result for a blob that was already
+        transformed the same way in this or, with a cache dir, a previous run."""
+        result_cache = self.repo.result_cache
+        fingerprint = self.fingerprint()
+        staged, _ = self.repo.get_staged_content(file.path)
+        # Staged contents no longer match the blob sha
+        if result_cache is None or fingerprint is None or staged:
+            return compute(file.decoded_content)
+
+        hit, result = result_cache.get(fingerprint, file.sha)
+        if hit:
+            logger.debug(f'Reusing result for {file.path} ({file.sha})')
+            return result
+        result = compute(file.decoded_content)
+        result_cache.put(fingerprint, file.sha, result)
+        return result
+
+
+class AsyncTransformation(object):
+    """Transformation of an `AsyncRepo`, run by `apply_async_transformations`.
+    Files are read with `await self.repo.get_objects(...)` and saved as usual."""
+
+    def __init__(self, args, repo):
+        self.args = args
+        self.repo = repo
+        self.dry_run = args.dry_run
+
+    async def run(self):
+        raise NotImplementedError('Please subclass the transformation and overrite this method')
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
 
 class SearchAndReplace(Transformation):
 
     def __init__(self, args, repo):
         super().__init__(args, repo)
-        self.changesets = zip(args.search, args.replace)
+        self.changesets = list(zip(args.search, args.replace))
+
+    @classmethod
+    def index_terms(cls, args):
+        return [search.encode() for search in args.search]
+
+    def fingerprint(self):
+        return fingerprint(type(self).__name__, [list(c) for c in self.changesets])
 
     def is_word_found(self, file, search):
+        if isinstance(file, bytes):
+            return search.encode() in file
         return search in str(file)
 
     def run(self):
         changes = False
+        if not self.changesets:
+            return changes
+
+        # All search strings are matched in a single pass over each file and
+        # replaced together, so every changed file is written exactly once
+        replacements = {}
         for search, replace in self.changesets:
-            for file in self.repo.get_files():
-                file_str = file.decoded_content
-                if not self.is_word_found(file_str, search):
-                    logger.debug(f"Ignoring {file}")
-                    continue
-                file_str = file_str.replace(search.encode(), replace.encode())
-                changes = True
+            replacements.setdefault(search.encode(), replace.encode())
+        # Longest first, so overlapping search strings prefer the longer match
+        searches = sorted(replacements, key=len, reverse=True)
+        regex = re.compile(b'|'.join(re.escape(search) for search in searches))
+
+        def compute(content):
+            # Most files don't match, and shipping them to a worker costs more than this scan
+            if regex.search(content) is None:
+                return None
+            file_str, found = run_compute(replace_all, content, regex, replacements)
+            if not found:
+                return None
+            return file_str, ', '.join(f"'{search.decode()}' with '{replace.decode()}'" for search, replace in replacements.items() if search in found)
+
+        for file in self.repo.iter_files():
+            if self.repo.search_candidates is not None and (file.path, file.sha) not in self.repo.search_candidates:
+                logger.debug(f"Ignoring {file}, not a candidate in the index")
+                continue
+            result = self.transform_blob(file, compute)
+            if result is None:
+                logger.debug(f"Ignoring {file}")
+                self.repo.release(file)
+                continue
+            changes = True
 
-                message = f"Replacing '{search}' with '{replace}' in {file}"
-                self.repo.update_file(file, file_str, message, self.dry_run)
+            file_str, pairs = result
+            message = f"Replacing {pairs} in {file}"
+            self.repo.update_file(file, file_str, message, self.dry_run)
         return changes
 
 
+def replace_all(content, regex, replacements):
+    found = set()
+
+    def substitute(match):
+        found.add(match.group())
+        return replacements[match.group()]
+
+    return regex.sub(substitute, content), found
+
+
 class JsonPatch(Transformation):
 
     def __init__(self, args, repo):
         super().__init__(args, repo)
         self.patch_path = args.patch_path
         self.file_regexp = args.file_regexp
-        self.patch = jsonpatch.JsonPatch.from_string(open(self.patch_path, 'r').read())
+        with open(self.patch_path, 'r') as f:
+            self.patch_str = f.read()
+        self.patch = jsonpatch.JsonPatch.from_string(self.patch_str)
+        self.operations = compile_patch(self.patch_str)
+
+    def fingerprint(self):
+        return fingerprint(type(self).__name__, self.patch_str)
 
     def run(self):
         changes = False
-        for f in self.repo.get_files():
-            file_changes = False
-            if not re.match(self.file_regexp, f.path):
-                continue
+        message = f'Applied json patch defined in {self.patch_path}'
+        for f in self.repo.match_files(self.file_regexp):
             logger.info(f'Path name: {f.path}')
-            k8s_patches = list(yaml.safe_load_all(f.decoded_content))
-            for r in k8s_patches:
-                original = copy.deepcopy(r)
-                try:
-                    self.patch.apply(r, in_place=True)
-                except jsonpatch.JsonPointerException as e:
-                    logger.debug(e)
-                except jsonpatch.JsonPatchTestFailed as e:
-                    logger.debug(e)
-                diff = DeepDiff(r, original)
-                if diff != {}:
-                    logger.info(f'Detected changes: {diff}')
-                    message = f'Applied json patch defined in {self.patch_path}'
-                    file_changes = True
-            if file_changes:
-                changes = True
-                file_str = yaml.dump_all(k8s_patches, default_flow_style=False, explicit_start=True)
-                logger.debug(file_str)
-                self.repo.update_file(f, file_str, message, self.dry_run)
+            result = self.transform_blob(f, self.apply_patch)
+            if result is None:
+                self.repo.release(f)
+                continue
+            changes = True
+            file_str, _ = result
+            self.repo.update_file(f, file_str, message, self.dry_run)
         return changes
 
+    def apply_patch(self, content):
+        file_str, changed = run_compute(patch_yaml, content, self.patch_str, logger.isEnabledFor(logging.DEBUG))
+        for i in changed:
+            logger.info(f'Detected changes in document {i}')
+        if file_str is None:
+            return None
+        return file_str, ''
+
+    def apply_operations(self, doc):
+        return apply_operations(self.operations, doc)
+
+
+@functools.lru_cache(maxsize=16)
+def compile_patch(patch_str):
+    # Operations are applied one at a time to tell whether they change a document without diffing it
+    return [
+        (op, jsonpatch.JsonPatch([op]), jsonpatch.JsonPointer(op['path']), jsonpatch.JsonPointer(op['from']) if 'from' in op else None)
+        for op in jsonpatch.JsonPatch.from_string(patch_str).patch
+    ]
+
+
+def patch_yaml(content, patch_str, debug=False):
+    """Applies a JSON patch to every document of a YAML file. Returns the new
+    contents, None if no document changed, and the indexes of changed documents."""
+    operations = compile_patch(patch_str)
+    changed_documents = []
+    k8s_patches = yaml_backend.load_all(content)
+    for i, r in enumerate(k8s_patches):
+        # The diff is only worth computing when it is logged
+        original = copy.deepcopy(r) if debug else None
+        k8s_patches[i], changed = apply_operations(operations, r)
+        if changed:
+            if debug:
+                logger.debug(f'Changes in document {i}: {DeepDiff(k8s_patches[i], original)}')
+            changed_documents.append(i)
+    if not changed_documents:
+        return None, changed_documents
+    file_str = yaml_backend.dump_all(k8s_patches, default_flow_style=False, explicit_start=True)
+    logger.debug(file_str)
+    return file_str.encode('utf-8'), changed_documents
+
+
+def apply_operations(operations, doc):
+    """Applies the patch in place like `JsonPatch.apply` and tells whether
+    any operation changed the document. The patch stops at the first
+    operation that fails or whose target doesn't exist, keeping the changes
+    of the operations before it."""
+    changed = False
+    for op, patch, pointer, source in operations:
+        kind = op['op']
+        before = pointer.resolve(doc, MISSING)
+        if before is MISSING and kind in ('remove', 'replace', 'test'):
+            logger.debug(f"{op['path']} not found, skipping {kind}")
+            break
+        if source is not None and source.resolve(doc, MISSING) is MISSING:
+            logger.debug(f"{op['from']} not found, skipping {kind}")
+            break
+        try:
+            # Adding to a list always inserts, even an equal value
+            inserted = kind in ('add', 'copy') and pointer.parts and isinstance(pointer.to_last(doc)[0], list)
+            doc = patch.apply(doc, in_place=True)
+        except (jsonpatch.JsonPointerException, jsonpatch.JsonPatchTestFailed, jsonpatch.JsonPatchConflict) as e:
+            logger.debug(e)
+            break
+
+        if kind == 'test':
+            continue
+        if kind == 'remove' or inserted:
+            changed = True
+        elif kind == 'move':
+            changed = changed or op['from'] != op['path']
+        else:
+            after = pointer.resolve(doc, MISSING)
+            changed = changed or type(before) is not type(after) or before != after
+    return doc, changed
+
 
 class PlainTextUpdater(Transformation):
 
@@ -93,16 +260,21 @@ class PlainTextUpdater(Transformation):
     def run(self):
         changes = False
         regex = re.compile(str.encode(f"{self.args.search[0]}"), re.MULTILINE|re.DOTALL)
-        for file in self.repo.get_files():
-            if os.path.basename(file.path) == self.args.file:
-                logger.info(f'Found file {self.args.file} at the path {file.path}')
-                file_objects = self.repo.get_objects(file.path, PlainTextFile)
-                content_updated = regex.sub(str.encode(f"{self.args.replace[0]}"), file_objects.file_contents)
-                if content_updated != file_objects.file_contents:
-                    logger.info(f'Updating file {file.path}')
-                    file_objects.file_contents = content_updated
-                    logger.debug(f"File has been changed:\n{file_objects._dump()}")
-                    if not self.dry_run:
-                        file_objects.save(f"Updated the file `{file.path}` to search for: {self.args.search[0]} and replace by {self.args.replace[0]}", self.dry_run)
-                    changes = True
+        for file in self.repo.find_files_by_name(self.args.file):
+            logger.info(f'Found file {self.args.file} at the path {file.path}')
+            file_objects = self.repo.get_objects(file.path, PlainTextFile)
+            if regex.search(file_objects.file_contents) is None:
+                continue
+            content_updated = run_compute(substitute, regex, str.encode(f"{self.args.replace[0]}"), file_objects.file_contents)
+            if content_updated != file_objects.file_contents:
+                logger.info(f'Updating file {file.path}')
+                file_objects.file_contents = content_updated
+                logger.debug(f"File has been changed:\n{file_objects._dump()}")
+                if not self.dry_run:
+                    file_objects.save(f"Updated the file `{file.path}` to search for: {self.args.search[0]} and replace by {self.args.replace[0]}", self.dry_run)
+                changes = True
         return changes
+
+
+def substitute(regex, replacement, content):
+    return regex.sub(replacement, content)
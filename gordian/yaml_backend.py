@@ -0,0 +1,37 @@
+import os
+import yaml
+
+try:
+    from yaml import CSafeLoader, CSafeDumper
+except ImportError:  # pragma: no cover
+    CSafeLoader = CSafeDumper = None
+
+# Set GORDIAN_PURE_YAML (or call use_libyaml(False)) to force the pure Python implementation
+_use_libyaml = CSafeLoader is not None and not os.getenv('GORDIAN_PURE_YAML')
+
+
+def use_libyaml(enabled=True):
+    """Switches between libyaml's C loader/dumper and the pure Python ones.
+    Enabling it has no effect when PyYAML was built without libyaml."""
+    global _use_libyaml
+    _use_libyaml = enabled and CSafeLoader is not None
+
+
+def libyaml_enabled():
+    return _use_libyaml
+
+
+def safe_loader():
+    return CSafeLoader if _use_libyaml else yaml.SafeLoader
+
+
+def safe_dumper():
+    return CSafeDumper if _use_libyaml else yaml.SafeDumper
+
+
+def load_all(content, loader=None):
+    return list(yaml.load_all(content, Loader=loader or safe_loader()))
+
+
+def dump_all(objects, dumper=None, **kwargs):
+    return yaml.dump_all(objects, Dumper=dumper or safe_dumper(), **kwargs)
@@ -0,0 +1,207 @@
+import base64
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+try:
+    from unittest.mock import AsyncMock
+except ImportError:  # pragma: no cover
+    # Python 3.7
+    AsyncMock = None
+from github import GithubException
+from gordian.async_repo import AsyncRepo, create_async_client
+from gordian.files import YamlFile, ChangelogFile
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = json.dumps(data).encode('utf-8') if data is not None else b''
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+def blob(content):
+    return {'content': base64.b64encode(content).decode('ascii'), 'encoding': 'base64'}
+
+
+def branch(sha):
+    return {'commit': {'sha': sha, 'commit': {'tree': {'sha': f'{sha}-tree'}}}}
+
+
+@unittest.skipIf(AsyncMock is None, 'AsyncMock and IsolatedAsyncioTestCase need Python 3.8')
+class TestAsyncRepo(getattr(unittest, 'IsolatedAsyncioTestCase', unittest.TestCase)):
+
+    def setUp(self):
+        self.routes = {
+            ('GET', '/repos/org/repo/branches/master'): FakeResponse(200, branch('head')),
+            ('GET', '/repos/org/repo/git/trees/head'): FakeResponse(200, {'truncated': False, 'tree': [
+                {'path': 'version', 'type': 'blob', 'sha': 'v', 'size': 5, 'mode': '100644'},
+                {'path': 'CHANGELOG.md', 'type': 'blob', 'sha': 'c', 'size': 12, 'mode': '100644'},
+                {'path': 'deploy', 'type': 'tree', 'sha': 'd', 'mode': '040000'},
+                {'path': 'deploy/values.yaml', 'type': 'blob', 'sha': 'y', 'size': 8, 'mode': '100644'},
+            ]}),
+            ('GET', '/repos/org/repo/git/blobs/v'): FakeResponse(200, blob(b'1.2.3')),
+            ('GET', '/repos/org/repo/git/blobs/y'): FakeResponse(200, blob(b'a: test\n')),
+            ('GET', '/repos/org/repo/git/blobs/c'): FakeResponse(200, blob(b'# Changelog\n')),
+            ('POST', '/repos/org/repo/git/trees'): FakeResponse(201, {'sha': 'tree'}),
+            ('POST', '/repos/org/repo/git/commits'): FakeResponse(201, {'sha': 'commit'}),
+            ('POST', '/repos/org/repo/git/refs'): FakeResponse(201, {'ref': 'refs/heads/test'}),
+            ('POST', '/repos/org/repo/pulls'): FakeResponse(201, {'number': 7, 'html_url': 'https://github.com/org/repo/pull/7'}),
+            ('PUT', '/repos/org/repo/issues/7/labels'): FakeResponse(200, []),
+        }
+        self.client = MagicMock()
+        self.client.request = AsyncMock(side_effect=self.route)
+
+    async def route(self, method, url, json=None, params=None):
+        response = self.routes.get((method, url), FakeResponse(404, {'message': 'Not Found'}))
+        if isinstance(response, list):
+            return response.pop(0)
+        return response
+
+    def requests(self, method=None):
+        return [c for c in self.client.request.call_args_list if method is None or c.args[0] == method]
+
+    async def test_get_files(self):
+        repo = AsyncRepo('org/repo.git', client=self.client, semver_label='minor')
+        files = await repo.get_files()
+        self.assertEqual([f.path for f in files], ['deploy/values.yaml'])
+        self.assertEqual(repo.version_file.sha, 'v')
+        self.assertEqual(repo.changelog_file.sha, 'c')
+        self.assertEqual(repo.new_version, '1.3.0')
+        self.assertEqual((await repo.find_file('deploy/values.yaml')).sha, 'y')
+        self.assertEqual(await repo.find_files('**/*.yaml'), files)
+        # Listed once
+        await repo.get_files()
+        self.assertEqual(len(self.requests('GET')), 3)
+        self.assertEqual(self.requests('GET')[1].kwargs['params'], {'recursive': '1'})
+
+    async def test_get_objects(self):
+        repo = AsyncRepo('org/repo', client=self.client)
+        objects = await repo.get_objects('deploy/values.yaml')
+        self.assertIsInstance(objects, YamlFile)
+        self.assertEqual(objects.objects, [{'a': 'test'}])
+        self.assertIsInstance(await repo.get_objects('CHANGELOG.md'), ChangelogFile)
+        with self.assertRaises(FileNotFoundError):
+            await repo.get_objects('missing.yaml')
+
+    async def test_read_blob_before_read_file(self):
+        repo = AsyncRepo('org/repo', client=self.client)
+        file = await repo.find_file('deploy/values.yaml')
+        with self.assertRaises(LookupError):
+            file.decoded_content
+        await repo.read_file(file)
+        self.assertEqual(file.decoded_content, b'a: test\n')
+
+    async def test_create_pr(self):
+        repo = AsyncRepo('org/repo', client=self.client, branch='test', semver_label='patch')
+        objects = await repo.get_objects('deploy/values.yaml')
+        objects.objects[0]['a'] = 'updated'
+        objects.save('Update values', False)
+        repo.create_file('binary.bin', b'\xff\xfe', 'Add binary')
+        self.routes[('POST', '/repos/org/repo/git/blobs')] = FakeResponse(201, {'sha': 'binary'})
+        repo.bump_version()
+        self.assertTrue(repo.dirty)
+        # Nothing is sent until the PR is created
+        self.assertEqual(self.requests('POST'), [])
+
+        pr = await repo.create_pr('test', 'body', 'master', ['label'])
+        self.assertEqual(pr.html_url, 'https://github.com/org/repo/pull/7')
+        self.assertEqual(pr.number, 7)
+        posts = {c.args[1]: c.kwargs['json'] for c in self.requests('POST')}
+        self.assertEqual(posts['/repos/org/repo/git/trees'], {'base_tree': 'head-tree', 'tree': [
+            {'path': 'deploy/values.yaml', 'mode': '100644', 'type': 'blob', 'content': '---\na: updated\n'},
+            {'path': 'binary.bin', 'mode': '100644', 'type': 'blob', 'sha': 'binary'},
+            {'path': 'version', 'mode': '100644', 'type': 'blob', 'content': '1.2.4'},
+        ]})
+        self.assertEqual(posts['/repos/org/repo/git/commits'], {
+            'message': 'test\n\n- Update values\n- Add binary\n- Bumping version to 1.2.4', 'tree': 'tree', 'parents': ['head']
+        })
+        self.assertEqual(posts['/repos/org/repo/git/refs'], {'ref': 'refs/heads/test', 'sha': 'commit'})
+        self.assertEqual(posts['/repos/org/repo/pulls'], {'title': 'test', 'body': 'body', 'base': 'master', 'head': 'org:refs/heads/test'})
+        self.assertEqual(self.requests('PUT')[0].kwargs['json'], {'labels': ['label']})
+
+    async def test_create_pr_existing_branch(self):
+        self.routes[('GET', '/repos/org/repo/branches/test')] = FakeResponse(200, branch('branch-head'))
+        self.routes[('PATCH', '/repos/org/repo/git/refs/heads/test')] = FakeResponse(200, {})
+        repo = AsyncRepo('org/repo', client=self.client, branch='test')
+        repo.create_file('new.txt', 'hello', 'Add file')
+        await repo.create_pr('test', 'body', 'master')
+        commits = [c.kwargs['json'] for c in self.requests('POST') if c.args[1].endswith('/git/commits')]
+        self.assertEqual(commits[0]['parents'], ['branch-head'])
+        self.assertEqual(self.requests('PATCH')[0].kwargs['json'], {'sha': 'commit'})
+        self.assertEqual(self.requests('PUT'), [])
+
+    async def test_create_pr_existing_pr(self):
+        self.routes[('POST', '/repos/org/repo/pulls')] = FakeResponse(422, {'message': 'A pull request already exists'})
+        repo = AsyncRepo('org/repo', client=self.client)
+        repo.create_file('new.txt', 'hello', 'Add file')
+        with self.assertRaises(GithubException) as context:
+            await repo.create_pr('test', 'body', 'master')
+        self.assertEqual(context.exception.status, 422)
+
+    async def test_include_keeps_version_and_changelog(self):
+        self.routes[('GET', '/repos/org/repo/git/trees/head')] = [
+            FakeResponse(200, {'tree': [
+                {'path': 'version', 'type': 'blob', 'sha': 'v', 'size': 5, 'mode': '100644'},
+                {'path': 'CHANGELOG.md', 'type': 'blob', 'sha': 'c', 'size': 12, 'mode': '100644'},
+                {'path': 'deploy', 'type': 'tree', 'sha': 'd', 'mode': '040000'},
+            ]}),
+        ]
+        self.routes[('GET', '/repos/org/repo/git/trees/d')] = FakeResponse(200, {'truncated': False, 'tree': [
+            {'path': 'values.yaml', 'type': 'blob', 'sha': 'y', 'size': 8, 'mode': '100644'},
+        ]})
+        repo = AsyncRepo('org/repo', client=self.client, semver_label='patch', include=['deploy/*.yaml'])
+        files = await repo.get_files()
+        self.assertEqual([f.path for f in files], ['deploy/values.yaml'])
+        self.assertEqual(repo.new_version, '1.2.4')
+        self.assertIsInstance(await repo.get_changelog(), ChangelogFile)
+
+    async def test_truncated_tree(self):
+        self.routes[('GET', '/repos/org/repo/git/trees/head')] = [
+            FakeResponse(200, {'truncated': True, 'tree': []}),
+            FakeResponse(200, {'tree': [
+                {'path': 'a.yaml', 'type': 'blob', 'sha': 'a', 'size': 1, 'mode': '100644'},
+                {'path': 'deploy', 'type': 'tree', 'sha': 'd', 'mode': '040000'},
+                {'path': 'vendor', 'type': 'tree', 'sha': 'v', 'mode': '040000'},
+            ]}),
+        ]
+        self.routes[('GET', '/repos/org/repo/git/trees/d')] = FakeResponse(200, {'tree': [
+            {'path': 'values.yaml', 'type': 'blob', 'sha': 'y', 'size': 8, 'mode': '100644'},
+        ]})
+        repo = AsyncRepo('org/repo', client=self.client, exclude=['vendor'])
+        files = await repo.get_files()
+        self.assertEqual([f.path for f in files], ['a.yaml', 'deploy/values.yaml'])
+        self.assertNotIn('/repos/org/repo/git/trees/v', [c.args[1] for c in self.requests()])
+
+    async def test_rate_limited_requests_are_retried(self):
+        self.routes[('GET', '/repos/org/repo/branches/master')] = [
+            FakeResponse(429, {'message': 'slow down'}, {'retry-after': '0'}),
+            FakeResponse(403, {'message': 'rate limit'}, {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '0'}),
+            FakeResponse(200, branch('head')),
+        ]
+        repo = AsyncRepo('org/repo', client=self.client)
+        with patch('gordian.async_repo.asyncio.sleep', new=AsyncMock()) as sleep_mock:
+            self.assertEqual((await repo._get_branch('master'))['commit']['sha'], 'head')
+        self.assertEqual(sleep_mock.await_count, 2)
+
+    async def test_forbidden_is_not_retried(self):
+        self.routes[('GET', '/repos/org/repo/branches/master')] = FakeResponse(403, {'message': 'Forbidden'})
+        repo = AsyncRepo('org/repo', client=self.client)
+        with self.assertRaises(GithubException):
+            await repo._get_branch('master')
+        self.assertEqual(self.client.request.await_count, 1)
+
+    async def test_close(self):
+        repo = AsyncRepo('org/repo', client=self.client)
+        await repo.close()
+        self.client.aclose.assert_not_called()
+
+    def test_client_needs_httpx(self):
+        with patch('gordian.async_repo.httpx', None):
+            with self.assertRaises(ImportError):
+                create_async_client()
@@ -1,7 +1,10 @@
 import unittest
 from unittest.mock import MagicMock
 from gordian.repo import Repo
+from gordian import yaml_backend
 from gordian.files import YamlFile
+from gordian.files.yaml_file import add_representer, YamlDumper, CYamlDumper
+import yaml
 from .utils import Utils
 
 
@@ -37,3 +40,47 @@ class TestYamlFile(unittest.TestCase):
             "Test message",
             False,
         )
+
+    @unittest.skipUnless(yaml_backend.CSafeLoader, 'PyYAML was built without libyaml')
+    def test_libyaml_and_pure_python_identical(self):
+        enabled_before = yaml_backend.libyaml_enabled()
+        with open('./tests/fixtures/manifests.yaml', 'rb') as f:
+            github_file = MagicMock(decoded_content=f.read())
+        outputs = []
+        try:
+            for enabled in (True, False):
+                yaml_backend.use_libyaml(enabled)
+                self.assertEqual(yaml_backend.safe_loader().__name__, 'CSafeLoader' if enabled else 'SafeLoader')
+                yaml_file = YamlFile(github_file, self.repo)
+                outputs.append((yaml_file.objects, yaml_file._dump()))
+        finally:
+            yaml_backend.use_libyaml(enabled_before)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn("- name: EMPTY\n          value:\n", outputs[0][1])
+
+    def test_global_dumpers_not_modified(self):
+        YamlFile(self.github_file, self.repo)
+        self.assertEqual(yaml.safe_dump({'a': None}), 'a: null\n')
+        self.assertEqual(yaml.dump({'a': None}), 'a: null\n')
+        self.assertEqual(yaml_backend.dump_all([{'a': None}]), 'a: null\n')
+
+    @unittest.skipUnless(yaml_backend.CSafeLoader, 'PyYAML was built without libyaml')
+    def test_add_representer(self):
+        class Secret(str):
+            pass
+
+        def represent_secret(dumper, _):
+            return dumper.represent_scalar('tag:yaml.org,2002:str', '<redacted>')
+
+        enabled_before = yaml_backend.libyaml_enabled()
+        add_representer(Secret, represent_secret)
+        try:
+            for enabled in (True, False):
+                yaml_backend.use_libyaml(enabled)
+                yaml_file = YamlFile(self.github_file, self.repo)
+                yaml_file.objects[0]['test']['foo'] = Secret('bar')
+                self.assertEqual(yaml_file._dump(), '---\ntest:\n  foo: <redacted>\n  iam: blah\n')
+        finally:
+            yaml_backend.use_libyaml(enabled_before)
+            del YamlDumper.yaml_representers[Secret]
+            del CYamlDumper.yaml_representers[Secret]
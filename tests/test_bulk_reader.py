@@ -0,0 +1,103 @@
+import unittest
+from unittest.mock import MagicMock, call
+from github import GithubException
+from gordian.bulk_reader import BulkReader, build_query, graphql_url, git_blob_sha
+
+
+def blob(text):
+    content = text.encode('utf-8')
+    return {'oid': git_blob_sha(content), 'byteSize': len(content), 'isBinary': False, 'isTruncated': False, 'text': text}
+
+
+class TestBulkReader(unittest.TestCase):
+
+    def setUp(self):
+        self.github = MagicMock()
+        self.requester = self.github.get_repo.return_value._requester
+        self.rate_limit = {'cost': 1, 'remaining': 4999, 'resetAt': '2024-01-01T00:00:00Z'}
+
+    def respond(self, query, files):
+        # Answers a query from {repo_name: {path: text}}, in the order the repos appear in it
+        data = {'rateLimit': self.rate_limit}
+        for i, repo_name in enumerate(self.repos_in(query)):
+            repository = files.get(repo_name)
+            if repository is None:
+                data[f'r{i}'] = None
+                continue
+            data[f'r{i}'] = {f'f{j}': (blob(repository[path]) if path in repository else None) for j, path in enumerate(self.paths)}
+        return {}, {'data': data}
+
+    def repos_in(self, query):
+        return [part.split('"')[1] + '/' + part.split('"')[3] for part in query.split('repository(owner: ')[1:]]
+
+    def test_graphql_url(self):
+        self.assertEqual(graphql_url(None), '/graphql')
+        self.assertEqual(graphql_url('https://api.github.com'), '/graphql')
+        self.assertEqual(graphql_url('https://github.example.com/api/v3'), 'https://github.example.com/api/graphql')
+
+    def test_build_query(self):
+        query = build_query('master', ['org/a', 'org/b.git'], ['version', 'deploy/values.yaml'])
+        self.assertIn('r0: repository(owner: "org", name: "a")', query)
+        self.assertIn('r1: repository(owner: "org", name: "b")', query)
+        self.assertIn('f1: object(expression: "master:deploy/values.yaml")', query)
+        self.assertIn('rateLimit { cost remaining resetAt }', query)
+
+    def test_read(self):
+        self.paths = ['version', 'values.yaml']
+        files = {'org/a': {'version': '1.0.0', 'values.yaml': 'a: 1\n'}, 'org/b': {'version': '2.0.0'}}
+        self.requester.requestJsonAndCheck.side_effect = lambda verb, url, input: self.respond(input['query'], files)
+        reader = BulkReader(self.github, max_objects=4)
+        results = reader.read(['org/a', 'org/b', 'org/missing'], 'master', self.paths)
+        self.assertEqual(results['org/a']['values.yaml'], (git_blob_sha(b'a: 1\n'), 5, b'a: 1\n'))
+        self.assertEqual(results['org/b']['version'][2], b'2.0.0')
+        self.assertIsNone(results['org/b']['values.yaml'])
+        self.assertNotIn('org/missing', results)
+        # Two repos of two files per query
+        self.assertEqual(self.requester.requestJsonAndCheck.call_count, 2)
+        self.assertEqual(self.requester.requestJsonAndCheck.call_args[0][:2], ('POST', '/graphql'))
+
+    def test_content_fetched_later_when_not_utf8(self):
+        self.paths = ['latin1.txt', 'image.png']
+        text = blob('café\n')
+        text['oid'] = git_blob_sha('café\n'.encode('latin-1'))
+        binary = {'oid': 'abc', 'byteSize': 10, 'isBinary': True, 'isTruncated': False, 'text': None}
+        self.requester.requestJsonAndCheck.return_value = ({}, {'data': {'r0': {'f0': text, 'f1': binary}}})
+        results = BulkReader(self.github).read(['org/a'], 'master', self.paths)
+        self.assertEqual(results['org/a']['latin1.txt'], (text['oid'], text['byteSize'], None))
+        self.assertEqual(results['org/a']['image.png'], ('abc', 10, None))
+
+    def test_splits_queries_that_are_too_large(self):
+        self.paths = ['version']
+        files = {f'org/{i}': {'version': f'{i}.0.0'} for i in range(8)}
+        limit_error = {'errors': [{'type': 'MAX_NODE_LIMIT_EXCEEDED', 'message': 'too many nodes'}]}
+        sizes = []
+
+        def request(verb, url, input):
+            repos = self.repos_in(input['query'])
+            sizes.append(len(repos))
+            if len(repos) > 2:
+                return {}, limit_error
+            if len(repos) == 2 and len(sizes) == 3:
+                raise GithubException(502, {'message': 'timeout'}, {})
+            return self.respond(input['query'], files)
+
+        self.requester.requestJsonAndCheck.side_effect = request
+        reader = BulkReader(self.github, max_objects=8)
+        results = reader.read(list(files), 'master', self.paths)
+        self.assertEqual(sorted(results), sorted(files))
+        self.assertEqual(sizes[:4], [8, 4, 2, 1])
+
+    def test_waits_for_rate_limit_reset(self):
+        self.paths = ['version']
+        self.rate_limit = {'cost': 1, 'remaining': 0, 'resetAt': '1970-01-01T00:01:40Z'}
+        files = {'org/a': {'version': '1.0.0'}, 'org/b': {'version': '1.0.0'}}
+        self.requester.requestJsonAndCheck.side_effect = lambda verb, url, input: self.respond(input['query'], files)
+        sleep = MagicMock()
+        reader = BulkReader(self.github, max_objects=1, sleep=sleep, clock=lambda: 40)
+        reader.read(list(files), 'master', self.paths)
+        self.assertEqual(sleep.call_args_list, [call(61)])
+
+    def test_other_errors_raise(self):
+        self.requester.requestJsonAndCheck.side_effect = GithubException(401, {'message': 'Bad credentials'}, {})
+        with self.assertRaises(GithubException):
+            BulkReader(self.github).read(['org/a'], 'master', ['version'])
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import time
+import unittest
+from gordian.cache import LRUCache, DiskCache, ResultCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(10)
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get('missing'))
+
+    def test_put_and_get(self):
+        self.cache.put('a', b'12345')
+        self.assertEqual(self.cache.get('a'), b'12345')
+        self.assertEqual(self.cache.size, 5)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', b'1234')
+        self.cache.put('b', b'1234')
+        self.cache.get('a')
+        self.cache.put('c', b'1234')
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('c', self.cache)
+        self.assertEqual(self.cache.size, 8)
+
+    def test_value_larger_than_cache_not_stored(self):
+        self.cache.put('a', b'x' * 11)
+        self.assertNotIn('a', self.cache)
+        self.assertEqual(self.cache.size, 0)
+
+    def test_replace_value(self):
+        self.cache.put('a', b'1234')
+        self.cache.put('a', b'12')
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size, 2)
+
+    def test_pop(self):
+        self.cache.put('a', b'1234')
+        self.assertEqual(self.cache.pop('a'), b'1234')
+        self.assertEqual(self.cache.size, 0)
+        self.assertIsNone(self.cache.pop('a'))
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.directory.name, max_size=100)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get('blobs', 'abc'))
+
+    def test_put_and_get(self):
+        self.cache.put('blobs', 'abc', b'content')
+        self.assertEqual(self.cache.get('blobs', 'abc'), b'content')
+        self.assertIsNone(self.cache.get('trees', 'abc'))
+
+    def test_shared_between_instances(self):
+        self.cache.put('blobs', 'abc', b'content')
+        other = DiskCache(self.directory.name, max_size=100)
+        self.assertEqual(other.get('blobs', 'abc'), b'content')
+
+    def test_no_temporary_files_left(self):
+        self.cache.put('blobs', 'abc', b'content')
+        for _, _, files in os.walk(self.directory.name):
+            self.assertFalse([f for f in files if f.startswith('.tmp-')])
+
+    def test_evicts_least_recently_used(self):
+        self.cache.max_size = 130
+        for i, key in enumerate(['a', 'b', 'c']):
+            self.cache.put('blobs', key, b'x' * 40)
+            past = time.time() - 100 + i
+            os.utime(self.cache._path('blobs', key), (past, past))
+        self.cache.get('blobs', 'a')
+        self.cache.put('blobs', 'd', b'x' * 40)
+        self.assertIsNotNone(self.cache.get('blobs', 'a'))
+        self.assertIsNone(self.cache.get('blobs', 'b'))
+        self.assertIsNone(self.cache.get('blobs', 'c'))
+        self.assertIsNotNone(self.cache.get('blobs', 'd'))
+
+    def test_replacing_entry_keeps_size(self):
+        self.cache.put('blobs', 'a', b'x' * 10)
+        for _ in range(3):
+            self.cache.put('blobs', 'b', b'x' * 40)
+        self.cache.put('blobs', 'b', b'x' * 30)
+        self.assertEqual(self.cache._size, 40)
+
+    def test_evict_skipped_when_locked(self):
+        self.cache.put('blobs', 'a', b'x' * 60)
+        self.cache.max_size = 10
+        with self.cache._exclusive() as locked:
+            self.assertTrue(locked)
+            self.cache.evict()
+        self.assertIsNotNone(self.cache.get('blobs', 'a'))
+        self.cache.evict()
+        self.assertIsNone(self.cache.get('blobs', 'a'))
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_get_missing(self):
+        self.assertEqual(ResultCache().get('fingerprint', 'sha'), (False, None))
+
+    def test_put_and_get(self):
+        results = ResultCache()
+        results.put('fingerprint', 'unchanged', None)
+        results.put('fingerprint', 'changed', (b'new\ncontent', "'a' with 'b'"))
+        results.put('fingerprint', 'emptied', (b'', ''))
+        self.assertEqual(results.get('fingerprint', 'unchanged'), (True, None))
+        self.assertEqual(results.get('fingerprint', 'changed'), (True, (b'new\ncontent', "'a' with 'b'")))
+        self.assertEqual(results.get('fingerprint', 'emptied'), (True, (b'', '')))
+        self.assertEqual(results.get('other', 'changed'), (False, None))
+
+    def test_shared_between_runs_with_disk_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            ResultCache(DiskCache(directory)).put('fingerprint', 'sha', (b'content', 'note'))
+            self.assertEqual(ResultCache(DiskCache(directory)).get('fingerprint', 'sha'), (True, (b'content', 'note')))
@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from gordian.client import PooledConnection, create_pooled_session
+from gordian.repo import create_github_client
+
+
+class TestClient(unittest.TestCase):
+
+    def test_pooled_session(self):
+        session = create_pooled_session(16)
+        adapter = session.get_adapter('https://api.github.com')
+        self.assertIs(adapter, session.get_adapter('http://github.example.com'))
+        self.assertEqual(adapter._pool_maxsize, 16)
+
+    def test_pooled_connection_uses_shared_session(self):
+        session = MagicMock()
+        session.request.return_value = MagicMock(status_code=200, headers={'etag': 'abc'}, text='{}')
+        cnx = PooledConnection(session, 'https', 'api.github.com', timeout=15, verify=True)
+        cnx.request('GET', '/repos/org/repo', None, {'Authorization': 'token x'})
+        response = cnx.getresponse()
+        session.request.assert_called_once_with(
+            'GET',
+            'https://api.github.com:443/repos/org/repo',
+            headers={'Authorization': 'token x'},
+            data=None,
+            timeout=15,
+            verify=True,
+            allow_redirects=False
+        )
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.read(), '{}')
+
+    @patch('gordian.repo.Github')
+    def test_create_github_client_without_pool(self, mock_git):
+        client = create_github_client(token='abcdef')
+        mock_git.assert_called_once_with(base_url='https://api.github.com', login_or_token='abcdef')
+        self.assertIs(client, mock_git.return_value)
+
+    def test_create_github_client_with_pool(self):
+        client = create_github_client('https://github.example.com/api/v3', token='abcdef', pool_size=8)
+        requester = client._Github__requester
+        self.assertFalse(requester._Requester__persist)
+        cnx = requester._Requester__createConnection()
+        self.assertIsInstance(cnx, PooledConnection)
+        self.assertIsNot(cnx, requester._Requester__createConnection())
+        self.assertIs(cnx.session, requester._Requester__createConnection().session)
+        self.assertEqual(cnx.host, 'github.example.com')
@@ -0,0 +1,51 @@
+import json
+import os
+import re
+import unittest
+from unittest.mock import MagicMock
+from gordian import compute
+from gordian.compute import run_compute
+from gordian.files import YamlFile, ChangelogFile
+from gordian.transformations import replace_all, patch_yaml, substitute
+
+
+class TestCompute(unittest.TestCase):
+
+    def tearDown(self):
+        compute.stop()
+
+    def test_inline(self):
+        self.assertEqual(run_compute(os.getpid), os.getpid())
+
+    def test_process_pool(self):
+        compute.start(2)
+        self.assertNotEqual(run_compute(os.getpid), os.getpid())
+        regex = re.compile(b'iam|foo')
+        self.assertEqual(
+            run_compute(replace_all, b'iam foo bar', regex, {b'iam': b'hello', b'foo': b'bar'}),
+            (b'hello bar bar', {b'iam', b'foo'})
+        )
+        self.assertEqual(run_compute(substitute, re.compile(b'a+'), b'b', b'caaat'), b'cbt')
+        patch = json.dumps([{'op': 'replace', 'path': '/spec/replicas', 'value': 3}])
+        self.assertEqual(
+            run_compute(patch_yaml, b'---\nkind: A\nspec:\n  replicas: 2\n---\nkind: B\n', patch),
+            (b'---\nkind: A\nspec:\n  replicas: 3\n---\nkind: B\n', [0])
+        )
+        compute.stop()
+        self.assertEqual(run_compute(os.getpid), os.getpid())
+
+    def test_files_on_process_pool(self):
+        with open('./tests/fixtures/manifests.yaml', 'rb') as f:
+            yaml_github_file = MagicMock(decoded_content=f.read())
+        with open('./tests/fixtures/changelog_with_footer.md', 'rb') as f:
+            changelog_github_file = MagicMock(decoded_content=f.read())
+        repo = MagicMock(new_version='1.2.3')
+
+        inline = YamlFile(yaml_github_file, repo), ChangelogFile(changelog_github_file, repo)
+        compute.start(2)
+        pooled = YamlFile(yaml_github_file, repo), ChangelogFile(changelog_github_file, repo)
+        self.assertEqual(pooled[0].objects, inline[0].objects)
+        self.assertEqual(pooled[0]._dump(), inline[0]._dump())
+        self.assertEqual(pooled[1].objects, inline[1].objects)
+        self.assertEqual(pooled[1].header, inline[1].header)
+        self.assertEqual(pooled[1].footer, inline[1].footer)
@@ -1,8 +1,20 @@
+import asyncio
+import tempfile
 import unittest
 from gordian.config import Config
-from gordian.gordian import apply_transformations
+from gordian.gordian import apply_transformations, apply_plan, index_repositories, create_apply_parser, transform, transform_async, current_repo, RepoLogFilter
+from gordian.index import Candidates
+from gordian.plan import PlanWriter, read_plan, PLAN_VERSION
+from gordian.journal import RunJournal, campaign_fingerprint, BRANCH, COMMITTED, PR_OPENED, PR_EXISTS
+from github import GithubException
 from unittest.mock import MagicMock, patch, call, Mock, mock_open, ANY
 
+try:
+    from unittest.mock import AsyncMock
+except ImportError:  # pragma: no cover
+    # Python 3.7
+    AsyncMock = None
+
 
 class TestGordian(unittest.TestCase):
 
@@ -22,19 +34,25 @@ class TestGordian(unittest.TestCase):
             self.description = ''
             self.description_file = None
             self.fork = False
+            self.concurrency = 1
+            self.batch_commits = False
+            self.cache_dir = None
+            self.cache_size = 1024
 
     def test_apply_transformations_without_changes(self):
         with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
             instance = RepoMock.return_value
             instance.dirty = False
             apply_transformations(TestGordian.Args(), [TransformationMockClass])
-            RepoMock.assert_has_calls([
-                call('testOrg/TestService1', github_api_url=None, branch='test', semver_label=None, target_branch='master', fork=False),
-                call('testOrg/TestService2', github_api_url=None, branch='test', semver_label=None, target_branch='master', fork=False)
+            self.assertEqual(RepoMock.call_args_list, [
+                call('testOrg/TestService1', github_api_url=None, github=ANY, branch='test', semver_label=None, target_branch='master', fork=False, batch_commits=False, cache=None, scheduler=ANY, include=None, exclude=None, result_cache=ANY),
+                call('testOrg/TestService2', github_api_url=None, github=ANY, branch='test', semver_label=None, target_branch='master', fork=False, batch_commits=False, cache=None, scheduler=ANY, include=None, exclude=None, result_cache=ANY)
             ])
 
     def test_apply_transformations_with_changes(self):
         with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
             instance = RepoMock.return_value
             instance.dirty = True
             apply_transformations(TestGordian.Args(), [TransformationMockClass])
@@ -43,6 +61,7 @@ class TestGordian(unittest.TestCase):
 
     def test_apply_transformations_with_changes_dry_run(self):
         with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
             instance = RepoMock.return_value
             instance.dirty = True
             apply_transformations(TestGordian.Args(dry_run=True), [TransformationMockClass])
@@ -51,6 +70,7 @@ class TestGordian(unittest.TestCase):
 
     def test_apply_transformations_with_changes_and_callback(self):
         with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
             instance = RepoMock.return_value
             instance.dirty = True
             callback_mock = MagicMock()
@@ -71,6 +91,7 @@ class TestGordian(unittest.TestCase):
 
     def test_apply_transformations_with_changes_default_labels(self):
         with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation', ) as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
             instance = RepoMock.return_value
             instance.dirty = True
             gordian_args = TestGordian.Args()
@@ -82,6 +103,7 @@ class TestGordian(unittest.TestCase):
 
     def test_apply_transformations_with_changes_custom_description(self):
         with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation', ) as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
             instance = RepoMock.return_value
             instance.dirty = True
             gordian_args = TestGordian.Args()
@@ -90,3 +112,437 @@ class TestGordian(unittest.TestCase):
             apply_transformations(gordian_args, [TransformationMockClass])
             RepoMock.assert_has_calls([call().bump_version(False), call().bump_version(False)], any_order=True)
             RepoMock.assert_has_calls([call().create_pr('test', description, 'master', ANY), call().create_pr('test', description, 'master', ANY)], any_order=True)
+
+    def test_apply_transformations_with_cache_dir(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation') as TransformationMockClass, tempfile.TemporaryDirectory() as cache_dir:
+            TransformationMockClass.prefetch_paths.return_value = None
+            RepoMock.return_value.dirty = False
+            args = TestGordian.Args()
+            args.cache_dir = cache_dir
+            apply_transformations(args, [TransformationMockClass])
+            caches = {c.kwargs['cache'] for c in RepoMock.call_args_list}
+            self.assertEqual(len(caches), 1)
+            cache = caches.pop()
+            self.assertEqual(cache.directory, cache_dir)
+            self.assertEqual(cache.max_size, 1024 * 1024 * 1024)
+
+    def test_apply_transformations_shares_github_client(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            RepoMock.return_value.dirty = False
+            args = TestGordian.Args()
+            args.concurrency = 4
+            apply_transformations(args, [TransformationMockClass])
+            client_mock.assert_called_once_with(None, pool_size=4)
+            self.assertEqual([c.kwargs['github'] for c in RepoMock.call_args_list], [client_mock.return_value] * 2)
+
+    def test_apply_transformations_with_clone(self):
+        with patch('gordian.gordian.LocalRepo') as LocalRepoMock, patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            LocalRepoMock.return_value.dirty = False
+            args = TestGordian.Args()
+            args.clone = True
+            args.mirror_dir = '/mirrors'
+            apply_transformations(args, [TransformationMockClass])
+            RepoMock.assert_not_called()
+            self.assertEqual(LocalRepoMock.call_count, 2)
+            self.assertEqual(LocalRepoMock.call_args.kwargs['mirror_dir'], '/mirrors')
+            LocalRepoMock.return_value.close.assert_called()
+
+    def test_apply_transformations_with_index(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.TrigramIndex') as IndexMock, patch('gordian.gordian.create_github_client') as client_mock:
+            client_mock.return_value.get_repo.return_value.get_branch.return_value.commit.sha = 'head1'
+            RepoMock.return_value.dirty = False
+            candidates = Candidates({('values.yaml', 'abc')}, {('values.yaml', 'abc')}, 'head1')
+            IndexMock.return_value.candidate_files.side_effect = [Candidates({('values.yaml', 'def')}, set(), 'head1'), candidates]
+            transformation = MagicMock()
+            transformation.prefetch_paths.return_value = None
+            transformation.index_terms.return_value = [b'hello']
+            args = TestGordian.Args()
+            args.branch = None
+            args.index_file = 'gordian.idx'
+            apply_transformations(args, [transformation])
+            IndexMock.return_value.candidate_files.assert_has_calls([
+                call('testOrg/TestService1', 'master', [b'hello']),
+                call('testOrg/TestService2', 'master', [b'hello'])
+            ])
+            RepoMock.assert_called_once()
+            self.assertEqual(RepoMock.return_value.search_candidates, candidates)
+            IndexMock.return_value.close.assert_called_once()
+
+    def test_apply_transformations_with_outdated_index(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.TrigramIndex') as IndexMock, patch('gordian.gordian.create_github_client') as client_mock:
+            # The branch moved since it was indexed, new files may match
+            client_mock.return_value.get_repo.return_value.get_branch.return_value.commit.sha = 'head2'
+            RepoMock.return_value.dirty = False
+            candidates = Candidates({('values.yaml', 'def')}, set(), 'head1')
+            IndexMock.return_value.candidate_files.return_value = candidates
+            transformation = MagicMock()
+            transformation.prefetch_paths.return_value = None
+            transformation.index_terms.return_value = [b'hello']
+            args = TestGordian.Args()
+            args.branch = None
+            args.index_file = 'gordian.idx'
+            apply_transformations(args, [transformation])
+            self.assertEqual(RepoMock.call_count, 2)
+            self.assertEqual(RepoMock.return_value.search_candidates, candidates)
+
+    def test_apply_transformations_with_index_and_unindexed_transformation(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.TrigramIndex') as IndexMock:
+            RepoMock.return_value.dirty = False
+            transformation = MagicMock()
+            transformation.prefetch_paths.return_value = None
+            transformation.index_terms.return_value = None
+            args = TestGordian.Args()
+            args.branch = None
+            args.index_file = 'gordian.idx'
+            apply_transformations(args, [transformation])
+            IndexMock.return_value.candidate_files.assert_not_called()
+            self.assertEqual(RepoMock.call_count, 2)
+            self.assertIsNone(RepoMock.return_value.search_candidates)
+
+    def test_index_repositories(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.TrigramIndex') as IndexMock:
+            args = TestGordian.Args()
+            args.index_file = 'gordian.idx'
+            args.concurrency = 2
+            index_repositories(args)
+            IndexMock.assert_called_once_with('gordian.idx')
+            IndexMock.return_value.update_repo.assert_has_calls([
+                call(RepoMock.return_value, 'testOrg/TestService1'),
+                call(RepoMock.return_value, 'testOrg/TestService2')
+            ], any_order=True)
+            self.assertEqual(RepoMock.return_value.close.call_count, 2)
+            IndexMock.return_value.close.assert_called_once()
+
+    def test_apply_transformations_with_prefetch(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.BulkReader') as ReaderMock:
+            RepoMock.return_value.dirty = False
+            files = {'values.yaml': ('abc', 8, b'a: test\n')}
+            ReaderMock.return_value.read.return_value = {'testOrg/TestService1': files}
+            transformation = MagicMock()
+            transformation.prefetch_paths.return_value = ['values.yaml']
+            args = TestGordian.Args()
+            apply_transformations(args, [transformation])
+            ReaderMock.assert_called_once_with(ANY, None, ANY)
+            # The version is only read to bump it
+            ReaderMock.return_value.read.assert_called_once_with(['testOrg/TestService1', 'testOrg/TestService2'], 'master', ['values.yaml'])
+            # Repos missing from the results list their tree as usual
+            RepoMock.return_value.prefill.assert_called_once_with(files)
+            self.assertEqual(RepoMock.call_count, 2)
+
+    def test_apply_transformations_prefetches_only_repos_not_skipped(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.BulkReader') as ReaderMock, patch('gordian.gordian.TrigramIndex') as IndexMock, patch('gordian.gordian.create_github_client') as client_mock:
+            client_mock.return_value.get_repo.return_value.get_branch.return_value.commit.sha = 'head1'
+            RepoMock.return_value.dirty = False
+            IndexMock.return_value.candidate_files.side_effect = [
+                Candidates({('values.yaml', 'def')}, set(), 'head1'),
+                Candidates({('values.yaml', 'abc')}, {('values.yaml', 'abc')}, 'head1')
+            ]
+            ReaderMock.return_value.read.return_value = {}
+            transformation = MagicMock()
+            transformation.prefetch_paths.return_value = ['values.yaml']
+            transformation.index_terms.return_value = [b'hello']
+            args = TestGordian.Args()
+            args.branch = None
+            args.index_file = 'gordian.idx'
+            args.semver_label = 'patch'
+            apply_transformations(args, [transformation])
+            ReaderMock.return_value.read.assert_called_once_with(['testOrg/TestService2'], 'master', ['values.yaml', 'version'])
+            self.assertEqual(IndexMock.return_value.candidate_files.call_count, 2)
+            RepoMock.assert_called_once()
+
+    def test_apply_transformations_with_processes(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.compute') as compute_mock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            RepoMock.return_value.dirty = False
+            args = TestGordian.Args()
+            args.processes = 4
+            apply_transformations(args, [TransformationMockClass])
+            compute_mock.start.assert_called_once_with(4)
+            compute_mock.stop.assert_called_once()
+
+    def test_apply_transformations_with_plan_file(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.plan_entry') as plan_entry_mock, patch('gordian.transformations.Transformation') as TransformationMockClass, tempfile.TemporaryDirectory() as tmp:
+            TransformationMockClass.prefetch_paths.return_value = None
+            RepoMock.return_value.dirty = True
+            RepoMock.return_value._get_branch.return_value.commit.sha = 'base-sha'
+            plan_entry_mock.side_effect = lambda repo, repo_name, *args: {'version': PLAN_VERSION, 'repo': repo_name, 'changes': []}
+            args = TestGordian.Args()
+            args.plan_file = f'{tmp}/plan.jsonl'
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual([c.kwargs['batch_commits'] for c in RepoMock.call_args_list], [True, True])
+            RepoMock.return_value.create_pr.assert_not_called()
+            plan_entry_mock.assert_called_with(RepoMock.return_value, 'testOrg/TestService2', 'base-sha', 'test', '', ['test'], False)
+            self.assertEqual([e['repo'] for e in read_plan(args.plan_file)], ['testOrg/TestService1', 'testOrg/TestService2'])
+
+    def test_apply_plan(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.apply_entry') as apply_entry_mock, patch('gordian.gordian.create_github_client'), tempfile.TemporaryDirectory() as tmp:
+            plan = PlanWriter(f'{tmp}/plan.jsonl')
+            for repo_name in ('testOrg/TestService1', 'testOrg/TestService2'):
+                plan.add({'version': PLAN_VERSION, 'repo': repo_name, 'target_branch': 'master', 'branch': 'planned', 'fork': False, 'pr': {'title': 'test', 'labels': []}, 'changes': []})
+            plan.close()
+            pull_request = MagicMock(html_url='https://github.com/testOrg/TestService1/pull/1')
+            apply_entry_mock.side_effect = lambda entry, repo: pull_request if entry['repo'] == 'testOrg/TestService1' else None
+            callback_mock = MagicMock()
+            args = create_apply_parser(['-P', f'{tmp}/plan.jsonl', '--concurrency', '2'])
+            apply_plan(args, callback_mock)
+            self.assertCountEqual(RepoMock.call_args_list, [
+                call(f'testOrg/TestService{i}', github_api_url=None, github=ANY, branch='planned', target_branch='master', fork=False, batch_commits=True, scheduler=ANY)
+                for i in (1, 2)
+            ])
+            self.assertEqual(apply_entry_mock.call_count, 2)
+            callback_mock.assert_called_once_with('testOrg/TestService1', pull_request)
+
+    def test_apply_transformations_with_journal(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass, tempfile.TemporaryDirectory() as tmp:
+            TransformationMockClass.prefetch_paths.return_value = None
+            get_branch = client_mock.return_value.get_repo.return_value.get_branch
+            get_branch.return_value.commit.sha = 'head1'
+            RepoMock.return_value.dirty = False
+            RepoMock.return_value.branch_name = 'refs/heads/test'
+            args = TestGordian.Args()
+            args.journal_file = f'{tmp}/journal.jsonl'
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_count, 2)
+            client_mock.return_value.get_repo.assert_called_with('testOrg/TestService2', lazy=True)
+            get_branch.assert_called_with('master')
+
+            # Nothing moved, both repos are skipped after the branch lookup
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_count, 2)
+            self.assertEqual(get_branch.call_count, 4)
+
+            # A different campaign processes them again
+            args.pr_message = 'other'
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_count, 4)
+
+            # As does a moved target branch
+            get_branch.return_value.commit.sha = 'head2'
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_count, 6)
+
+    def test_apply_transformations_journal_only_records_existing_prs(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass, tempfile.TemporaryDirectory() as tmp:
+            TransformationMockClass.prefetch_paths.return_value = None
+            client_mock.return_value.get_repo.return_value.get_branch.return_value.commit.sha = 'head1'
+            instance = RepoMock.return_value
+            instance.dirty = True
+            instance.branch_name = 'refs/heads/test'
+            instance.commit_staged.return_value.sha = 'commit'
+            exists = GithubException(422, {'message': 'Validation Failed', 'errors': [{'message': 'A pull request already exists for testOrg:test.'}]}, {})
+            failed = GithubException(502, {'message': 'Server Error'}, {})
+
+            def create_pr(*args):
+                # Repos are processed one at a time, the last constructed one is opening its PR
+                raise exists if RepoMock.call_args.args[0] == 'testOrg/TestService1' else failed
+            instance.create_pr.side_effect = create_pr
+            args = TestGordian.Args()
+            args.journal_file = f'{tmp}/journal.jsonl'
+            apply_transformations(args, [TransformationMockClass])
+
+            campaign = campaign_fingerprint(args, [TransformationMockClass])
+            journal = RunJournal(args.journal_file)
+            self.assertEqual(journal.settled('testOrg/TestService1', 'head1', campaign), PR_EXISTS)
+            self.assertIsNone(journal.settled('testOrg/TestService2', 'head1', campaign))
+            journal.close()
+
+    def test_apply_transformations_resume(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass, tempfile.TemporaryDirectory() as tmp:
+            TransformationMockClass.prefetch_paths.return_value = None
+            client_mock.return_value.get_repo.return_value.get_branch.return_value.commit.sha = 'head1'
+            instance = RepoMock.return_value
+            instance.dirty = True
+            instance.commit_staged.return_value.sha = 'commit2'
+            instance.create_pr.return_value.html_url = 'https://github.com/testOrg/pull/1'
+            args = TestGordian.Args()
+            args.branch = None
+            args.journal_file = f'{tmp}/journal.jsonl'
+            args.resume = True
+
+            campaign = campaign_fingerprint(args, [TransformationMockClass])
+            journal = RunJournal(args.journal_file)
+            # The first repo was pushed before the run died, the second one only got a branch name
+            journal.record('testOrg/TestService1', 'head1', campaign, BRANCH, branch='2024-01-01-000000.000001')
+            journal.record('testOrg/TestService1', 'head1', campaign, COMMITTED, commit='commit1')
+            journal.record('testOrg/TestService2', 'head1', campaign, BRANCH, branch='2024-01-01-000000.000002')
+            journal.close()
+
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_args_list, [
+                call('testOrg/TestService1', github_api_url=None, github=ANY, branch='2024-01-01-000000.000001', semver_label=None, target_branch='master', fork=False, batch_commits=True, cache=None, scheduler=ANY, include=None, exclude=None, result_cache=ANY),
+                call('testOrg/TestService2', github_api_url=None, github=ANY, branch='2024-01-01-000000.000002', semver_label=None, target_branch='master', fork=False, batch_commits=True, cache=None, scheduler=ANY, include=None, exclude=None, result_cache=ANY)
+            ])
+            # Only the second repo is transformed and committed again
+            self.assertEqual(TransformationMockClass.call_count, 1)
+            self.assertEqual(instance.commit_staged.call_count, 1)
+            self.assertEqual(instance.create_pr.call_count, 2)
+
+            journal = RunJournal(args.journal_file)
+            self.assertEqual(journal.settled('testOrg/TestService1', 'head1', campaign), PR_OPENED)
+            self.assertEqual(journal.settled('testOrg/TestService2', 'head1', campaign), PR_OPENED)
+            self.assertEqual(journal.progress('testOrg/TestService2', 'head1', campaign)[COMMITTED]['commit'], 'commit2')
+            journal.close()
+
+    def test_apply_transformations_resume_without_journal(self):
+        args = TestGordian.Args()
+        args.resume = True
+        with self.assertRaises(ValueError):
+            apply_transformations(args, [MagicMock()])
+
+    def open_pull_requests(self, client_mock, pages):
+        client_mock.return_value.per_page = 2
+        pulls = client_mock.return_value.get_repo.return_value.get_pulls.return_value
+        pulls.get_page.side_effect = lambda page: pages[page]
+        return pulls
+
+    def pull_request(self, title, ref, labels=[], url='https://github.com/testOrg/pull/1', head_repo='testOrg/TestService'):
+        label_mocks = [Mock() for _ in labels]
+        for label_mock, label in zip(label_mocks, labels):
+            label_mock.name = label
+        head = Mock(ref=ref, repo=Mock(full_name=head_repo, owner=Mock(login=head_repo.split('/')[0])))
+        return Mock(title=title, head=head, base=Mock(repo=Mock(full_name='testOrg/TestService')), labels=label_mocks, html_url=url)
+
+    def test_apply_transformations_skip_existing_pr(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            pulls = self.open_pull_requests(client_mock, [
+                [self.pull_request('other', 'other'), self.pull_request('test', 'other', labels=['other'])],
+                [self.pull_request('test', '2024-01-01', labels=['test', 'other'])],
+            ])
+            args = TestGordian.Args()
+            args.branch = None
+            args.existing_pr = 'skip'
+            apply_transformations(args, [TransformationMockClass])
+            client_mock.return_value.get_repo.return_value.get_pulls.assert_called_with(state='open', base='master')
+            self.assertEqual(pulls.get_page.call_args_list, [call(0), call(1), call(0), call(1)])
+            RepoMock.assert_not_called()
+            TransformationMockClass.assert_not_called()
+
+    def test_apply_transformations_no_existing_pr(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            self.open_pull_requests(client_mock, [[self.pull_request('test', 'other', labels=['other'])]])
+            RepoMock.return_value.dirty = True
+            args = TestGordian.Args()
+            args.existing_pr = 'skip'
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_count, 2)
+            RepoMock.assert_has_calls([call().create_pr('test', '', 'master', ['test'])])
+
+    def test_apply_transformations_update_existing_pr(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            self.open_pull_requests(client_mock, [[self.pull_request('old title', 'test')]])
+            instance = RepoMock.return_value
+            instance.dirty = True
+            args = TestGordian.Args()
+            args.existing_pr = 'update'
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_args_list[0], call('testOrg/TestService1', github_api_url=None, github=ANY, branch='test', semver_label=None, target_branch='master', fork=False, batch_commits=True, cache=None, scheduler=ANY, include=None, exclude=None, result_cache=ANY))
+            self.assertEqual(TransformationMockClass.call_count, 2)
+            self.assertEqual(instance.commit_staged.call_args_list, [call('test'), call('test')])
+            instance.create_pr.assert_not_called()
+
+    def test_apply_transformations_existing_pr_from_fork_is_not_updated(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            # Same branch name and title, but from someone else's fork
+            self.open_pull_requests(client_mock, [[self.pull_request('test', 'test', labels=['test'], head_repo='someone/TestService')]])
+            RepoMock.return_value.dirty = True
+            args = TestGordian.Args()
+            args.existing_pr = 'update'
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_args_list[0].kwargs['batch_commits'], False)
+            RepoMock.return_value.commit_staged.assert_not_called()
+            self.assertEqual(RepoMock.return_value.create_pr.call_count, 2)
+
+    def test_apply_transformations_update_existing_pr_from_own_fork(self):
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.gordian.create_github_client') as client_mock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            client_mock.return_value.get_user.return_value.login = 'me'
+            self.open_pull_requests(client_mock, [[
+                self.pull_request('test', 'test', head_repo='someone/TestService'),
+                self.pull_request('test', 'test', head_repo='me/TestService'),
+            ]])
+            RepoMock.return_value.dirty = True
+            args = TestGordian.Args()
+            args.existing_pr = 'update'
+            args.fork = True
+            apply_transformations(args, [TransformationMockClass])
+            self.assertEqual(RepoMock.call_args_list[0].kwargs['branch'], 'test')
+            self.assertEqual(RepoMock.return_value.commit_staged.call_count, 2)
+            RepoMock.return_value.create_pr.assert_not_called()
+
+    def test_transform_concurrently_keeps_config_order(self):
+        repositories = [f'testOrg/TestService{i}' for i in range(10)]
+        with patch('gordian.gordian.Repo') as RepoMock, patch('gordian.transformations.Transformation') as TransformationMockClass:
+            TransformationMockClass.prefetch_paths.return_value = None
+            def make_repo(repo_name, **kwargs):
+                repo = MagicMock(dirty=True)
+                repo.create_pr.return_value.html_url = f'https://github.com/{repo_name}/pull/1'
+                return repo
+            RepoMock.side_effect = make_repo
+            callback_mock = MagicMock()
+            args = TestGordian.Args()
+            args.concurrency = 4
+            with self.assertLogs('gordian', level='INFO') as logs:
+                transform(args, [TransformationMockClass], repositories, '', callback_mock)
+            self.assertEqual(RepoMock.call_count, 10)
+            self.assertEqual(callback_mock.call_count, 10)
+            summary = logs.output[logs.output.index('INFO:gordian:Pull requests') + 1:]
+            self.assertEqual(summary, [f'INFO:gordian:https://github.com/{r}/pull/1' for r in repositories])
+
+    @unittest.skipIf(AsyncMock is None, 'AsyncMock needs Python 3.8')
+    def test_transform_async(self):
+        repositories = [f'testOrg/TestService{i}' for i in range(6)]
+        with patch('gordian.gordian.AsyncRepo') as RepoMock:
+            def make_repo(repo_name, **kwargs):
+                repo = MagicMock(dirty=repo_name != 'testOrg/TestService3')
+                repo.create_pr = AsyncMock(return_value=MagicMock(html_url=f'https://github.com/{repo_name}/pull/1'))
+                return repo
+            RepoMock.side_effect = make_repo
+            transformation = MagicMock()
+            transformation.return_value.run = AsyncMock()
+            client = MagicMock()
+            callback_mock = MagicMock()
+            args = TestGordian.Args()
+            args.concurrency = 3
+            with self.assertLogs('gordian', level='INFO') as logs:
+                asyncio.run(transform_async(args, [transformation], repositories, 'description', callback_mock, client))
+            RepoMock.assert_any_call('testOrg/TestService0', github_api_url=None, branch='test', client=client, semver_label=None, target_branch='master', include=None, exclude=None)
+            self.assertEqual(transformation.return_value.run.await_count, 6)
+            self.assertEqual(callback_mock.call_count, 5)
+            summary = logs.output[logs.output.index('INFO:gordian:Pull requests') + 1:]
+            self.assertEqual(summary, [f'INFO:gordian:https://github.com/{r}/pull/1' for r in repositories if r != 'testOrg/TestService3'])
+            client.aclose.assert_not_called()
+
+    @unittest.skipIf(AsyncMock is None, 'AsyncMock needs Python 3.8')
+    def test_transform_async_create_pr_errors(self):
+        exists = GithubException(422, {'message': 'Validation Failed', 'errors': [{'message': 'A pull request already exists for testOrg:test.'}]}, {})
+        failed = GithubException(422, {'message': 'Validation Failed', 'errors': [{'message': 'No commits between master and test'}]}, {})
+        with patch('gordian.gordian.AsyncRepo') as RepoMock:
+            RepoMock.return_value.dirty = True
+            RepoMock.return_value.branch_name = 'refs/heads/test'
+            RepoMock.return_value.create_pr = AsyncMock(side_effect=[exists, failed])
+            transformation = MagicMock()
+            transformation.return_value.run = AsyncMock()
+            callback_mock = MagicMock()
+            with self.assertLogs('gordian', level='INFO') as logs:
+                asyncio.run(transform_async(TestGordian.Args(), [transformation], ['testOrg/TestService1', 'testOrg/TestService2'], '', callback_mock, MagicMock()))
+            callback_mock.assert_not_called()
+            self.assertIn('INFO:gordian:PR already exists for refs/heads/test', logs.output)
+            self.assertTrue(any('Could not create PR for refs/heads/test' in line for line in logs.output))
+
+    def test_repo_log_filter(self):
+        log_filter = RepoLogFilter()
+        record = MagicMock()
+        log_filter.filter(record)
+        self.assertEqual(record.repo, '')
+        token = current_repo.set('testOrg/TestService1')
+        try:
+            log_filter.filter(record)
+        finally:
+            current_repo.reset(token)
+        self.assertEqual(record.repo, '[testOrg/TestService1] ')
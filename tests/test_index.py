@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from gordian.index import Candidates, TrigramIndex, trigrams, MAX_INDEXED_SIZE
+
+
+class TestTrigramIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index = TrigramIndex(os.path.join(self.tmpdir.name, 'gordian.idx'))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def make_repo(self, head, files):
+        repo = MagicMock(target_branch='master')
+        repo._get_branch.return_value.commit.sha = head
+        repo.get_files.return_value = [
+            MagicMock(path=path, sha=sha, size=len(content), decoded_content=content)
+            for path, sha, content in files
+        ]
+        return repo
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams(b'abcd'), {b'abc', b'bcd'})
+        self.assertEqual(trigrams(b'ab'), set())
+
+    def test_candidate_files(self):
+        repo = self.make_repo('head1', [
+            ('values.yaml', 'sha1', b'image: nginx:1.19'),
+            ('README.md', 'sha2', b'hello world'),
+        ])
+        self.assertTrue(self.index.update_repo(repo, 'org/service'))
+        self.assertEqual(self.index.candidate_files('org/service', 'master', [b'nginx']).matching, {('values.yaml', 'sha1')})
+        self.assertEqual(self.index.candidate_files('org/service', 'master', [b'nginx', b'world']).matching, {('values.yaml', 'sha1'), ('README.md', 'sha2')})
+        self.assertEqual(self.index.candidate_files('org/service', 'master', [b'redis']).matching, set())
+
+    def test_files_changed_since_indexing_are_candidates(self):
+        repo = self.make_repo('head1', [('values.yaml', 'sha1', b'image: nginx'), ('README.md', 'sha2', b'hello')])
+        self.index.update_repo(repo, 'org/service')
+        candidates = self.index.candidate_files('org/service', 'master', [b'nginx'])
+        self.assertEqual(candidates.head, 'head1')
+        self.assertIn(('values.yaml', 'sha1'), candidates)
+        self.assertNotIn(('README.md', 'sha2'), candidates)
+        # Same path with content the index hasn't seen, or a new path
+        self.assertIn(('README.md', 'sha3'), candidates)
+        self.assertIn(('new.yaml', 'sha4'), candidates)
+
+    def test_candidates(self):
+        candidates = Candidates({('a', 'sha1'), ('b', 'sha2')}, set())
+        self.assertFalse(candidates)
+        self.assertNotIn(('a', 'sha1'), candidates)
+        self.assertIn(('a', 'sha2'), candidates)
+
+    def test_trigrams_are_a_superset(self):
+        # Both trigrams of 'abcd' are present without the string itself
+        repo = self.make_repo('head1', [('file', 'sha1', b'abc bcd')])
+        self.index.update_repo(repo, 'org/service')
+        self.assertEqual(self.index.candidate_files('org/service', 'master', [b'abcd']).matching, {('file', 'sha1')})
+
+    def test_short_search_matches_everything(self):
+        repo = self.make_repo('head1', [('a', 'sha1', b'foo'), ('b', 'sha2', b'bar')])
+        self.index.update_repo(repo, 'org/service')
+        self.assertEqual(self.index.candidate_files('org/service', 'master', [b'zz']).matching, {('a', 'sha1'), ('b', 'sha2')})
+
+    def test_unknown_repo(self):
+        self.assertIsNone(self.index.candidate_files('org/unknown', 'master', [b'nginx']))
+
+    def test_large_blobs_always_match(self):
+        repo = self.make_repo('head1', [('big', 'sha1', b'x')])
+        repo.get_files.return_value[0].size = MAX_INDEXED_SIZE + 1
+        self.index.update_repo(repo, 'org/service')
+        self.assertEqual(self.index.candidate_files('org/service', 'master', [b'nginx']).matching, {('big', 'sha1')})
+
+    def test_incremental_update(self):
+        repo = self.make_repo('head1', [('values.yaml', 'sha1', b'nginx')])
+        self.index.update_repo(repo, 'org/service')
+        self.assertFalse(self.index.update_repo(repo, 'org/service'))
+        repo.get_files.assert_called_once()
+
+        # Blobs already indexed for another repo aren't read again
+        other = self.make_repo('head2', [('values.yaml', 'sha1', b'nginx'), ('new.yaml', 'sha3', b'redis')])
+        self.index.update_repo(other, 'org/other')
+        self.assertEqual(self.index.candidate_files('org/other', 'master', [b'redis']).matching, {('new.yaml', 'sha3')})
+        self.assertEqual(self.index.candidate_files('org/service', 'master', [b'redis']).matching, set())
+
+        # Files removed from the branch are dropped when the head moves
+        repo = self.make_repo('head3', [('other.yaml', 'sha3', b'redis')])
+        self.assertTrue(self.index.update_repo(repo, 'org/service'))
+        self.assertEqual(self.index.candidate_files('org/service', 'master', [b'nginx']).matching, set())
+        self.assertEqual(self.index.get_head('org/service', 'master'), 'head3')
@@ -0,0 +1,97 @@
+import argparse
+import os
+import tempfile
+import unittest
+from gordian.journal import RunJournal, campaign_fingerprint, BRANCH, COMMITTED, NO_CHANGE, PR_OPENED
+from gordian.transformations import SearchAndReplace, JsonPatch
+
+
+class TestCampaignFingerprint(unittest.TestCase):
+
+    def args(self, **kwargs):
+        values = dict(search=['a'], replace=['b'], pr_message='test', concurrency=1, verbose=None, config_file='config.yaml')
+        values.update(kwargs)
+        return argparse.Namespace(**values)
+
+    def test_stable(self):
+        self.assertEqual(campaign_fingerprint(self.args(), [SearchAndReplace]), campaign_fingerprint(self.args(), [SearchAndReplace]))
+
+    def test_changes_with_campaign(self):
+        fingerprint = campaign_fingerprint(self.args(), [SearchAndReplace])
+        self.assertNotEqual(fingerprint, campaign_fingerprint(self.args(replace=['c']), [SearchAndReplace]))
+        self.assertNotEqual(fingerprint, campaign_fingerprint(self.args(pr_message='other'), [SearchAndReplace]))
+        self.assertNotEqual(fingerprint, campaign_fingerprint(self.args(), [JsonPatch]))
+
+    def test_ignores_run_options(self):
+        self.assertEqual(
+            campaign_fingerprint(self.args(), [SearchAndReplace]),
+            campaign_fingerprint(self.args(concurrency=8, verbose=True, config_file='other.yaml'), [SearchAndReplace])
+        )
+
+    def test_file_contents(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'patch.json')
+            with open(path, 'w') as f:
+                f.write('[]')
+            fingerprint = campaign_fingerprint(self.args(patch_path=path), [JsonPatch])
+            with open(path, 'w') as f:
+                f.write('[{"op": "remove", "path": "/a"}]')
+            self.assertNotEqual(fingerprint, campaign_fingerprint(self.args(patch_path=path), [JsonPatch]))
+
+
+class TestRunJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'journal.jsonl')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_settled(self):
+        journal = RunJournal(self.path)
+        self.assertIsNone(journal.settled('org/repo', 'head1', 'campaign'))
+        journal.record('org/repo', 'head1', 'campaign', NO_CHANGE)
+        journal.record('org/other', 'head1', 'campaign', PR_OPENED, url='https://github.com/org/other/pull/1')
+        journal.record('org/failed', 'head1', 'campaign', 'listed')
+        self.assertEqual(journal.settled('org/repo', 'head1', 'campaign'), NO_CHANGE)
+        self.assertIsNone(journal.settled('org/repo', 'head2', 'campaign'))
+        self.assertIsNone(journal.settled('org/repo', 'head1', 'other-campaign'))
+        self.assertIsNone(journal.settled('org/failed', 'head1', 'campaign'))
+        journal.close()
+
+        journal = RunJournal(self.path)
+        self.assertEqual(journal.settled('org/other', 'head1', 'campaign'), PR_OPENED)
+        self.assertEqual(journal.lookup('org/other', 'campaign')['url'], 'https://github.com/org/other/pull/1')
+        journal.record('org/repo', 'head2', 'campaign', NO_CHANGE)
+        journal.close()
+
+        self.assertEqual(RunJournal(self.path).settled('org/repo', 'head2', 'campaign'), NO_CHANGE)
+
+    def test_progress(self):
+        journal = RunJournal(self.path)
+        self.assertEqual(journal.progress('org/repo', 'head1', 'campaign'), {})
+        journal.record('org/repo', 'head1', 'campaign', BRANCH, branch='my-branch')
+        journal.record('org/repo', 'head1', 'campaign', COMMITTED, commit='abc')
+        journal.close()
+
+        journal = RunJournal(self.path)
+        progress = journal.progress('org/repo', 'head1', 'campaign')
+        self.assertEqual(progress[BRANCH]['branch'], 'my-branch')
+        self.assertEqual(progress[COMMITTED]['commit'], 'abc')
+        self.assertEqual(journal.progress('org/repo', 'head2', 'campaign'), {})
+        self.assertEqual(journal.progress('org/repo', 'head1', 'other-campaign'), {})
+
+        # A run against a new head starts over
+        journal.record('org/repo', 'head2', 'campaign', BRANCH, branch='other-branch')
+        self.assertEqual(journal.progress('org/repo', 'head1', 'campaign'), {})
+        self.assertEqual(list(journal.progress('org/repo', 'head2', 'campaign')), [BRANCH])
+        journal.close()
+
+    def test_truncated_line(self):
+        journal = RunJournal(self.path)
+        journal.record('org/repo', 'head1', 'campaign', NO_CHANGE)
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('{"repo": "org/repo", "hea')
+        self.assertEqual(RunJournal(self.path).settled('org/repo', 'head1', 'campaign'), NO_CHANGE)
@@ -1,5 +1,5 @@
 import unittest
-from gordian.gordian import create_parser
+from gordian.gordian import create_parser, create_index_parser
 
 class TestParser(unittest.TestCase):
 
@@ -38,3 +38,41 @@ class TestParser(unittest.TestCase):
         self.assertEqual(args.config_file, './gordian/config/ex_config.yaml')
         self.assertEqual(args.search, ['hello'])
         self.assertEqual(args.replace, ['goodbye'])
+
+    def test_concurrency(self):
+        args = create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test'])
+        self.assertEqual(args.concurrency, 1)
+        args = create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test', '--concurrency', '8'])
+        self.assertEqual(args.concurrency, 8)
+
+    def test_processes(self):
+        self.assertEqual(create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test']).processes, 0)
+        self.assertEqual(create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test', '--processes', '4']).processes, 4)
+
+    def test_include_exclude(self):
+        args = create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test'])
+        self.assertIsNone(args.include)
+        self.assertIsNone(args.exclude)
+        args = create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test', '--include', 'deploy/**/*.yaml', '--exclude', 'vendor', '--exclude', '**/tests/**'])
+        self.assertEqual(args.include, ['deploy/**/*.yaml'])
+        self.assertEqual(args.exclude, ['vendor', '**/tests/**'])
+
+    def test_journal_file(self):
+        self.assertIsNone(create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test']).journal_file)
+        args = create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test', '--journal-file', 'journal.jsonl'])
+        self.assertEqual(args.journal_file, 'journal.jsonl')
+        self.assertFalse(args.resume)
+        self.assertTrue(create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test', '--journal-file', 'journal.jsonl', '--resume']).resume)
+
+    def test_existing_pr(self):
+        self.assertEqual(create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test']).existing_pr, 'create')
+        self.assertEqual(create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test', '--existing-pr', 'skip']).existing_pr, 'skip')
+        with self.assertRaises(SystemExit):
+            create_parser(['-s', 'hello', '-r', 'goodbye', '--pr', 'test', '--existing-pr', 'close'])
+
+    def test_index_args(self):
+        args = create_index_parser(['-c', 'config.yaml', '-i', 'repos.idx', '--concurrency', '4'])
+        self.assertEqual(args.config_file, 'config.yaml')
+        self.assertEqual(args.index_file, 'repos.idx')
+        self.assertEqual(args.concurrency, 4)
+        self.assertEqual(args.target_branch, 'master')
@@ -0,0 +1,111 @@
+import unittest
+from unittest.mock import MagicMock
+from gordian.path_index import PathIndex, PathFilter, glob_to_regex, glob_prefix, regex_prefix
+
+
+class TestPathIndex(unittest.TestCase):
+
+    def setUp(self):
+        paths = [
+            'README.md',
+            'deploy/values.yaml',
+            'deploy/prd/values.yaml',
+            'deploy/prd/config.json',
+            'service/global-values.yaml',
+            'vendor/lib/values.yaml',
+        ]
+        self.files = [MagicMock(path=p) for p in paths]
+        self.index = PathIndex(self.files)
+
+    def paths(self, files):
+        return [f.path for f in files]
+
+    def test_get(self):
+        self.assertIs(self.index.get('deploy/prd/config.json'), self.files[3])
+        self.assertIsNone(self.index.get('missing'))
+        self.assertEqual(len(self.index), 6)
+
+    def test_find_basename(self):
+        self.assertEqual(self.paths(self.index.find_basename('values.yaml')), [
+            'deploy/values.yaml', 'deploy/prd/values.yaml', 'vendor/lib/values.yaml'
+        ])
+        self.assertEqual(self.index.find_basename('missing'), [])
+
+    def test_find_extension(self):
+        self.assertEqual(self.paths(self.index.find_extension('.json')), ['deploy/prd/config.json'])
+
+    def test_glob(self):
+        self.assertEqual(self.paths(self.index.glob('deploy/**/*.yaml')), ['deploy/prd/values.yaml', 'deploy/values.yaml'])
+        self.assertEqual(self.paths(self.index.glob('deploy/*.yaml')), ['deploy/values.yaml'])
+        self.assertEqual(self.paths(self.index.glob('**/values.yaml')), [
+            'deploy/prd/values.yaml', 'deploy/values.yaml', 'vendor/lib/values.yaml'
+        ])
+        self.assertEqual(self.paths(self.index.glob('*.md')), ['README.md'])
+
+    def test_match(self):
+        self.assertEqual(self.paths(self.index.match('deploy/.*\\.yaml')), ['deploy/prd/values.yaml', 'deploy/values.yaml'])
+        self.assertEqual(self.paths(self.index.match('.*global')), ['service/global-values.yaml'])
+        self.assertEqual(self.paths(self.index.match('README|vendor')), ['README.md', 'vendor/lib/values.yaml'])
+
+    def test_add_after_lookup(self):
+        self.index.glob('*.md')
+        self.index.add(MagicMock(path='CONTRIBUTING.md'))
+        self.assertEqual(self.paths(self.index.glob('*.md')), ['CONTRIBUTING.md', 'README.md'])
+
+    def test_glob_to_regex(self):
+        self.assertTrue(glob_to_regex('charts/*/tests/**').match('charts/app/tests/a/b.yaml'))
+        self.assertFalse(glob_to_regex('charts/*/tests/**').match('charts/app/x/tests/b.yaml'))
+        self.assertTrue(glob_to_regex('file?.[!a]xt').match('file1.txt'))
+        self.assertFalse(glob_to_regex('file?.[!a]xt').match('file1.axt'))
+
+    def test_prefixes(self):
+        self.assertEqual(glob_prefix('deploy/**/*.yaml'), 'deploy/')
+        self.assertEqual(regex_prefix('deploy/prd/.*'), 'deploy/prd/')
+        self.assertEqual(regex_prefix('deploys?/'), 'deploy')
+        self.assertEqual(regex_prefix('(?i)deploy'), '')
+
+
+class TestPathFilter(unittest.TestCase):
+
+    def test_empty(self):
+        path_filter = PathFilter()
+        self.assertFalse(path_filter)
+        self.assertTrue(path_filter.match('vendor/lib/values.yaml'))
+        self.assertTrue(path_filter.match_dir('vendor'))
+        self.assertEqual(path_filter.roots(), [''])
+
+    def test_include(self):
+        path_filter = PathFilter(include=['deploy/**/*.yaml', 'charts/*/values.yaml'])
+        self.assertTrue(path_filter.match('deploy/values.yaml'))
+        self.assertTrue(path_filter.match('deploy/prd/values.yaml'))
+        self.assertFalse(path_filter.match('deploy/prd/config.json'))
+        self.assertTrue(path_filter.match('charts/app/values.yaml'))
+        self.assertTrue(path_filter.match_dir('deploy'))
+        self.assertTrue(path_filter.match_dir('deploy/prd/eu'))
+        self.assertTrue(path_filter.match_dir('charts/app'))
+        self.assertFalse(path_filter.match_dir('charts/app/tests'))
+        self.assertFalse(path_filter.match_dir('vendor'))
+        self.assertEqual(path_filter.roots(), ['charts', 'deploy'])
+
+    def test_include_root_files(self):
+        path_filter = PathFilter(include=['*.yaml'])
+        self.assertTrue(path_filter.match('values.yaml'))
+        self.assertFalse(path_filter.match('deploy/values.yaml'))
+        self.assertFalse(path_filter.match_dir('deploy'))
+        self.assertEqual(path_filter.roots(), [''])
+
+    def test_nested_roots(self):
+        self.assertEqual(PathFilter(include=['deploy/prd/*.yaml', 'deploy/**', 'service/*.json']).roots(), ['deploy', 'service'])
+
+    def test_exclude(self):
+        path_filter = PathFilter(exclude=['vendor', 'node_modules/**', 'charts/*/tests', '**/*.lock'])
+        self.assertTrue(path_filter)
+        self.assertFalse(path_filter.match('vendor/lib/values.yaml'))
+        self.assertFalse(path_filter.match('node_modules/pkg/index.js'))
+        self.assertFalse(path_filter.match('charts/app/tests/values.yaml'))
+        self.assertFalse(path_filter.match('deploy/yarn.lock'))
+        self.assertTrue(path_filter.match('charts/app/values.yaml'))
+        self.assertFalse(path_filter.match_dir('vendor'))
+        self.assertFalse(path_filter.match_dir('node_modules'))
+        self.assertFalse(path_filter.match_dir('charts/app/tests'))
+        self.assertTrue(path_filter.match_dir('charts/app'))
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from github import GithubException
+from gordian.bulk_reader import git_blob_sha
+from gordian.plan import PlanWriter, read_plan, plan_entry, apply_entry
+from gordian.repo import Repo, RepoFile
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.mock_git = MagicMock()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_repo(self, branch=None):
+        repo = Repo('test_repo', github=self.mock_git, branch=branch, batch_commits=True)
+        repo._source_repo = MagicMock()
+        repo._target_repo = MagicMock()
+        repo._source_repo.owner.login = 'someone'
+        repo._source_repo.get_branch.return_value.commit.sha = 'base-sha'
+        repo._source_repo.create_git_blob.return_value.sha = 'blobsha'
+        return repo
+
+    def planned_entry(self):
+        repo = self.make_repo('planned')
+        afile = RepoFile('afile.txt', 'abc', 5, repo)
+        repo.files = [afile]
+        repo.version_file = RepoFile('version', 'ver', 5, repo)
+        repo.update_file(afile, 'content', 'update file')
+        repo.update_file(repo.version_file, '1.1.0', 'bump version')
+        repo.create_file('binary.bin', b'\xff\xfe', 'add binary')
+        repo.delete_file(MagicMock(path='old.txt'), 'delete file')
+        return plan_entry(repo, 'org/test_repo', 'base-sha', 'title', 'body', ['label'])
+
+    def test_plan_entry(self):
+        entry = self.planned_entry()
+        self.assertEqual(entry['repo'], 'org/test_repo')
+        self.assertEqual(entry['target_branch'], 'master')
+        self.assertEqual(entry['branch'], 'planned')
+        self.assertEqual(entry['base_sha'], 'base-sha')
+        self.assertEqual(entry['pr'], {'title': 'title', 'body': 'body', 'labels': ['label']})
+        self.assertEqual(entry['messages'], ['update file', 'bump version', 'add binary', 'delete file'])
+        self.assertEqual(entry['changes'], [
+            {'path': 'afile.txt', 'old_sha': 'abc', 'mode': '100644', 'content': 'Y29udGVudA=='},
+            {'path': 'version', 'old_sha': 'ver', 'mode': '100644', 'content': 'MS4xLjA='},
+            {'path': 'binary.bin', 'old_sha': None, 'mode': '100644', 'content': '//4='},
+            {'path': 'old.txt', 'old_sha': None, 'mode': '100644', 'content': None},
+        ])
+
+    def test_write_and_read(self):
+        entry = self.planned_entry()
+        for name in ('plan.jsonl', 'plan.jsonl.gz'):
+            path = os.path.join(self.tmp.name, name)
+            plan = PlanWriter(path)
+            plan.add(entry)
+            plan.add(dict(entry, repo='org/other'))
+            plan.close()
+            self.assertEqual([e['repo'] for e in read_plan(path)], ['org/test_repo', 'org/other'])
+            self.assertEqual(next(read_plan(path)), entry)
+
+    def test_read_unsupported_version(self):
+        path = os.path.join(self.tmp.name, 'plan.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"version": 99}\n')
+        with self.assertRaises(ValueError):
+            list(read_plan(path))
+
+    def test_apply(self):
+        entry = self.planned_entry()
+        repo = self.make_repo(entry['branch'])
+        base = repo._source_repo.get_branch.return_value
+        # Target branch head, then the planned branch doesn't exist yet (checked before staging
+        # and again before committing), then the base to commit on
+        not_found = GithubException(404, 'Not found', None)
+        repo._source_repo.get_branch.side_effect = [base, not_found, not_found, base]
+        self.assertIs(apply_entry(entry, repo), repo._target_repo.create_pull.return_value)
+
+        elements = repo._source_repo.create_git_tree.call_args[0][0]
+        self.assertEqual([e._identity for e in elements], [
+            {'path': 'afile.txt', 'mode': '100644', 'type': 'blob', 'content': 'content'},
+            {'path': 'version', 'mode': '100644', 'type': 'blob', 'content': '1.1.0'},
+            {'path': 'binary.bin', 'mode': '100644', 'type': 'blob', 'sha': 'blobsha'},
+            {'path': 'old.txt', 'mode': '100644', 'type': 'blob', 'sha': None},
+        ])
+        self.assertEqual(
+            repo._source_repo.create_git_commit.call_args[0][0],
+            'title\n\n- update file\n- bump version\n- add binary\n- delete file'
+        )
+        repo._source_repo.create_git_ref.assert_called_once_with(ref='refs/heads/planned', sha=repo._source_repo.create_git_commit.return_value.sha)
+        repo._target_repo.create_pull.assert_called_once_with('title', 'body', 'master', 'someone:refs/heads/planned')
+        repo._target_repo.create_pull.return_value.set_labels.assert_called_once_with('label')
+
+    def test_apply_base_moved(self):
+        entry = self.planned_entry()
+        repo = self.make_repo(entry['branch'])
+        repo._source_repo.get_branch.return_value.commit.sha = 'new-sha'
+        self.assertIsNone(apply_entry(entry, repo))
+        repo._source_repo.create_git_tree.assert_not_called()
+        repo._target_repo.create_pull.assert_not_called()
+
+    def test_apply_pr_exists(self):
+        entry = self.planned_entry()
+        repo = self.make_repo(entry['branch'])
+        repo._source_repo.get_git_tree.return_value = MagicMock(raw_data={'truncated': False}, tree=[])
+        repo._target_repo.create_pull.side_effect = GithubException(422, {
+            'message': 'Validation Failed',
+            'errors': [{'resource': 'PullRequest', 'code': 'custom', 'message': 'A pull request already exists for someone:planned.'}]
+        }, None)
+        with self.assertLogs('gordian.plan', level='INFO') as logs:
+            self.assertIsNone(apply_entry(entry, repo))
+        self.assertIn('PR already exists', logs.output[-1])
+
+    def test_apply_fails(self):
+        entry = self.planned_entry()
+        repo = self.make_repo(entry['branch'])
+        repo._source_repo.get_git_tree.return_value = MagicMock(raw_data={'truncated': False}, tree=[])
+        repo._source_repo.create_git_tree.side_effect = GithubException(422, {'message': 'tree.sha is not a valid blob'}, None)
+        with self.assertLogs('gordian.plan', level='ERROR') as logs:
+            self.assertIsNone(apply_entry(entry, repo))
+        self.assertIn('Could not apply the plan', logs.output[0])
+        repo._target_repo.create_pull.assert_not_called()
+
+    def test_apply_again_does_not_push_twice(self):
+        entry = self.planned_entry()
+        repo = self.make_repo(entry['branch'])
+        # The planned branch already holds every change
+        repo._source_repo.get_git_tree.return_value = MagicMock(raw_data={'truncated': False}, tree=[
+            MagicMock(path='afile.txt', sha=git_blob_sha(b'content'), type='blob'),
+            MagicMock(path='version', sha=git_blob_sha(b'1.1.0'), type='blob'),
+            MagicMock(path='binary.bin', sha=git_blob_sha(b'\xff\xfe'), type='blob'),
+        ])
+        self.assertIs(apply_entry(entry, repo), repo._target_repo.create_pull.return_value)
+        repo._source_repo.create_git_tree.assert_not_called()
+        repo._source_repo.create_git_commit.assert_not_called()
+        repo._target_repo.create_pull.assert_called_once_with('title', 'body', 'master', 'someone:refs/heads/planned')
+
+        # A branch missing some of the changes gets them pushed
+        repo = self.make_repo(entry['branch'])
+        repo._source_repo.get_git_tree.return_value = MagicMock(raw_data={'truncated': False}, tree=[
+            MagicMock(path='afile.txt', sha=git_blob_sha(b'content'), type='blob'),
+        ])
+        apply_entry(entry, repo)
+        repo._source_repo.create_git_commit.assert_called_once()
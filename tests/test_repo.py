@@ -1,9 +1,14 @@
+import json
+import tempfile
 import unittest
 import pytest
 import os
-from gordian.repo import Repo
+from gordian.repo import Repo, RepoFile
+from gordian.cache import DiskCache
+from github import GithubException, UnknownObjectException
+from gordian.scheduler import RateLimitScheduler
 from unittest.mock import MagicMock, patch, call
-from gordian.files import YamlFile
+from gordian.files import YamlFile, ChangelogFile
 from .utils import Utils
 
 class TestRepo(unittest.TestCase):
@@ -81,11 +86,196 @@ class TestRepo(unittest.TestCase):
         self.repo._set_target_branch('target')
         self.repo.files = []
         self.repo._source_repo = MagicMock()
-        repository_file = MagicMock(path='afile.txt', type='not_dir')
-        self.repo._source_repo.get_contents.side_effect = [[MagicMock(path='directory', type='dir')],[repository_file]]
+        tree = MagicMock(raw_data={'truncated': False})
+        tree.tree = [
+            MagicMock(path='directory', type='tree'),
+            MagicMock(path='directory/afile.txt', type='blob', sha='abc', size=3),
+            MagicMock(path='version', type='blob', sha='def', size=5),
+        ]
+        self.repo._source_repo.get_git_tree.return_value = tree
         self.repo.get_files()
-        self.repo._source_repo.get_contents.assert_has_calls([call('', 'target'), call('directory', 'target')])
-        self.assertEquals(self.repo.files, [repository_file])
+        self.repo._source_repo.get_git_tree.assert_called_once_with('target', recursive=True)
+        self.repo._source_repo.get_contents.assert_not_called()
+        self.assertEqual([f.path for f in self.repo.files], ['directory/afile.txt'])
+        self.assertEqual(self.repo.files[0].sha, 'abc')
+        self.assertEqual(self.repo.version_file.path, 'version')
+
+    def test_get_files_truncated_tree(self):
+        self.repo._set_target_branch('target')
+        self.repo.files = []
+        self.repo._source_repo = MagicMock()
+        truncated = MagicMock(raw_data={'truncated': True})
+        root = MagicMock(tree=[
+            MagicMock(path='afile.txt', type='blob', sha='abc', size=3),
+            MagicMock(path='directory', type='tree', sha='tree-sha'),
+        ])
+        subtree = MagicMock(raw_data={'truncated': False})
+        subtree.tree = [MagicMock(path='nested/bfile.txt', type='blob', sha='def', size=3)]
+        self.repo._source_repo.get_git_tree.side_effect = [truncated, root, subtree]
+        self.repo.get_files()
+        self.repo._source_repo.get_git_tree.assert_has_calls([
+            call('target', recursive=True),
+            call('target'),
+            call('tree-sha', recursive=True)
+        ])
+        self.assertEqual([f.path for f in self.repo.files], ['afile.txt', 'directory/nested/bfile.txt'])
+
+    def test_get_files_include_lists_only_matching_subtrees(self):
+        repo = Repo('test', github=self.mock_git, target_branch='target', include=['deploy/prd/**/*.yaml'], exclude=['**/tests/**'])
+        repo._source_repo = MagicMock()
+        root = MagicMock(tree=[
+            MagicMock(path='deploy', type='tree', sha='deploy-sha'),
+            MagicMock(path='vendor', type='tree', sha='vendor-sha'),
+        ])
+        deploy = MagicMock(tree=[MagicMock(path='prd', type='tree', sha='prd-sha')])
+        prd = MagicMock(raw_data={'truncated': False})
+        prd.tree = [
+            MagicMock(path='values.yaml', type='blob', sha='abc', size=3),
+            MagicMock(path='config.json', type='blob', sha='def', size=3),
+            MagicMock(path='tests/values.yaml', type='blob', sha='ghi', size=3),
+        ]
+        repo._source_repo.get_git_tree.side_effect = [root, deploy, prd]
+        self.assertEqual([f.path for f in repo.get_files()], ['deploy/prd/values.yaml'])
+        repo._source_repo.get_git_tree.assert_has_calls([
+            call('target'),
+            call('deploy-sha'),
+            call('prd-sha', recursive=True)
+        ])
+
+    def test_get_files_include_keeps_version_and_changelog(self):
+        repo = Repo('test', github=self.mock_git, target_branch='target', semver_label='patch', include=['deploy/**/*.yaml'], exclude=['version'])
+        repo._source_repo = MagicMock()
+        root = MagicMock(tree=[
+            MagicMock(path='version', type='blob', sha='version-sha', size=5),
+            MagicMock(path='CHANGELOG.md', type='blob', sha='changelog-sha', size=12),
+            MagicMock(path='README.md', type='blob', sha='readme-sha', size=3),
+            MagicMock(path='deploy', type='tree', sha='deploy-sha'),
+        ])
+        deploy = MagicMock(raw_data={'truncated': False})
+        deploy.tree = [MagicMock(path='values.yaml', type='blob', sha='abc', size=3)]
+        repo._source_repo.get_git_tree.side_effect = [root, deploy]
+        repo._source_repo.get_git_blob.side_effect = lambda sha: MagicMock(content={
+            'version-sha': 'MS4yLjM=', 'changelog-sha': 'IyBDaGFuZ2Vsb2cK'
+        }[sha])
+        self.assertEqual([f.path for f in repo.get_files()], ['deploy/values.yaml'])
+        self.assertEqual(repo.version_file.sha, 'version-sha')
+        self.assertEqual(repo.new_version, '1.2.4')
+        self.assertIsInstance(repo.changelog, ChangelogFile)
+        # The root listing is reused to find the deploy directory
+        self.assertEqual(repo._source_repo.get_git_tree.call_args_list, [call('target'), call('deploy-sha', recursive=True)])
+
+    def test_get_files_include_missing_directory(self):
+        repo = Repo('test', github=self.mock_git, target_branch='target', include=['deploy/**'])
+        repo._source_repo = MagicMock()
+        repo._source_repo.get_git_tree.return_value = MagicMock(tree=[MagicMock(path='deploy', type='blob')])
+        self.assertEqual(repo.get_files(), [])
+        repo._source_repo.get_git_tree.assert_called_once_with('target')
+
+    def test_get_files_truncated_tree_prunes_excluded_directories(self):
+        repo = Repo('test', github=self.mock_git, target_branch='target', exclude=['vendor', 'node_modules/**'])
+        repo._source_repo = MagicMock()
+        truncated = MagicMock(raw_data={'truncated': True})
+        root = MagicMock(tree=[
+            MagicMock(path='afile.txt', type='blob', sha='abc', size=3),
+            MagicMock(path='vendor', type='tree', sha='vendor-sha'),
+            MagicMock(path='node_modules', type='tree', sha='modules-sha'),
+        ])
+        repo._source_repo.get_git_tree.side_effect = [truncated, root]
+        self.assertEqual([f.path for f in repo.get_files()], ['afile.txt'])
+        self.assertEqual(repo._source_repo.get_git_tree.call_count, 2)
+
+    def test_iter_files_streams_listing(self):
+        self.repo.files = []
+        listed = []
+
+        def list_tree(path=''):
+            for name in ('a.txt', 'version', 'b.txt'):
+                listed.append(name)
+                yield RepoFile(name, f'{name}-sha', 1, self.repo)
+
+        with patch.object(self.repo, '_list_tree', side_effect=list_tree) as list_mock:
+            files = self.repo.iter_files()
+            self.assertEqual(next(files).path, 'a.txt')
+            self.assertEqual(listed, ['a.txt'])
+            self.assertEqual([f.path for f in files], ['b.txt'])
+            self.assertEqual(self.repo.version_file.path, 'version')
+            self.assertEqual(self.repo.find_file('b.txt').sha, 'b.txt-sha')
+            self.assertEqual([f.path for f in self.repo.iter_files()], ['a.txt', 'b.txt'])
+            list_mock.assert_called_once()
+
+    def test_iter_files_partially_consumed(self):
+        self.repo.files = []
+        with patch.object(self.repo, '_list_tree', side_effect=lambda path='': iter([RepoFile('a.txt', 'a', 1, self.repo), RepoFile('b.txt', 'b', 1, self.repo)])) as list_mock:
+            files = self.repo.iter_files()
+            next(files)
+            files.close()
+            self.assertEqual([f.path for f in self.repo.get_files()], ['a.txt', 'b.txt'])
+            self.assertEqual(list_mock.call_count, 2)
+
+    def test_release(self):
+        self.repo._source_repo = MagicMock()
+        self.repo._source_repo.get_git_blob.return_value = MagicMock(content='aGVsbG8=')
+        repo_file = RepoFile('afile.txt', 'abc', 5, self.repo)
+        self.assertEqual(repo_file.decoded_content, b'hello')
+        self.assertIn('abc', self.repo._blobs)
+        self.repo.release(repo_file)
+        self.assertNotIn('abc', self.repo._blobs)
+        self.repo.release(repo_file)
+
+    def test_repo_file_decoded_content(self):
+        self.repo._source_repo = MagicMock()
+        self.repo._source_repo.get_git_blob.return_value = MagicMock(content='aGVsbG8=')
+        repo_file = RepoFile('afile.txt', 'abc', 5, self.repo)
+        self.assertEqual(repo_file.decoded_content, b'hello')
+        self.assertEqual(repo_file.decoded_content, b'hello')
+        self.repo._source_repo.get_git_blob.assert_called_once_with('abc')
+
+    def test_blob_cache_is_bounded(self):
+        repo = Repo('test_repo', github=self.mock_git, blob_cache_size=8)
+        repo._source_repo = MagicMock()
+        repo._source_repo.get_git_blob.return_value = MagicMock(content='aGVsbG8=')
+        repo.read_blob('abc')
+        repo.read_blob('def')
+        repo.read_blob('abc')
+        self.assertEqual(repo._source_repo.get_git_blob.call_count, 3)
+
+    def test_changelog_is_loaded_lazily(self):
+        self.repo._set_target_branch('target')
+        self.repo._source_repo = MagicMock()
+        tree = MagicMock(raw_data={'truncated': False})
+        tree.tree = [MagicMock(path='CHANGELOG.md', type='blob', sha='abc', size=3)]
+        self.repo._source_repo.get_git_tree.return_value = tree
+        self.repo._source_repo.get_git_blob.return_value = MagicMock(content='IyBDaGFuZ2Vsb2cK')
+        self.repo.get_files()
+        self.repo._source_repo.get_git_blob.assert_not_called()
+        self.assertIsInstance(self.repo.changelog, ChangelogFile)
+        self.repo._source_repo.get_git_blob.assert_called_once_with('abc')
+
+    def test_prefill(self):
+        repo = Repo('test_repo', github=self.mock_git, semver_label='minor')
+        repo._source_repo = MagicMock()
+        repo.prefill({
+            'values.yaml': ('abc', 8, b'a: test\n'),
+            'image.png': ('def', 3, None),
+            'version': ('ghi', 5, b'1.2.3'),
+            'CHANGELOG.md': None,
+        })
+        self.assertEqual(repo.get_objects('values.yaml').objects, [{'a': 'test'}])
+        self.assertEqual(repo.find_file('image.png').sha, 'def')
+        self.assertIsNone(repo.find_file('CHANGELOG.md'))
+        self.assertIsNone(repo.changelog)
+        self.assertEqual(repo.new_version, '1.3.0')
+        repo._source_repo.get_git_tree.assert_not_called()
+        repo._source_repo.get_git_blob.assert_not_called()
+
+        # Content that wasn't prefilled is fetched on access, other paths need the listing
+        repo._source_repo.get_git_blob.return_value = MagicMock(content='aGVsbG8=')
+        self.assertEqual(repo.find_file('image.png').decoded_content, b'hello')
+        tree = MagicMock(raw_data={'truncated': False})
+        tree.tree = [MagicMock(path='other.yaml', type='blob', sha='jkl', size=3)]
+        repo._source_repo.get_git_tree.return_value = tree
+        self.assertEqual(repo.find_file('other.yaml').sha, 'jkl')
+        repo._source_repo.get_git_tree.assert_called_once()
 
     def test_set_target_branch(self):
         self.repo._set_target_branch('master')
@@ -195,11 +385,15 @@ class TestRepo(unittest.TestCase):
         self.repo._set_target_branch('target')
         self.repo.files = []
         self.repo._source_repo = MagicMock()
-        repository_file = MagicMock(path='test/afile.txt', type='not_dir')
-        self.repo._source_repo.get_contents.side_effect = [[MagicMock(path='directory', type='dir')],[repository_file]]
+        tree = MagicMock(raw_data={'truncated': False})
+        tree.tree = [
+            MagicMock(path='test/afile.txt', type='blob', sha='abc', size=3),
+            MagicMock(path='other/afile.txt', type='blob', sha='def', size=3),
+        ]
+        self.repo._source_repo.get_git_tree.return_value = tree
         self.repo.get_files('test')
-        self.repo._source_repo.get_contents.assert_has_calls([call('test', 'target'), call('directory', 'target')])
-        self.assertEquals(self.repo.files, [repository_file])
+        self.repo._source_repo.get_git_tree.assert_called_once_with('target', recursive=True)
+        self.assertEqual([f.path for f in self.repo.files], ['test/afile.txt'])
 
     def test__get_github_client(self):
         repo = Repo('test_repo', branch='', github=self.mock_git)
@@ -226,3 +420,165 @@ class TestRepo(unittest.TestCase):
         self.repo._source_repo.get_contents.side_effect = [repository_file]
         self.repo._get_repo_contents(path='test/afile.txt')
         self.repo._source_repo.get_contents.assert_has_calls([call('test/afile.txt', 'target')])
+
+    def test_batch_commits_stage_changes(self):
+        repo = Repo('test_repo', github=self.mock_git, batch_commits=True)
+        repo._source_repo = MagicMock()
+        repo_file = RepoFile('afile.txt', 'abc', 5, repo, '100755')
+        repo.update_file(repo_file, 'first', 'first change')
+        repo.update_file(repo_file, b'second', 'second change')
+        repo.create_file('new.txt', 'new', 'create file')
+        repo.delete_file(MagicMock(path='old.txt'), 'delete file')
+        repo._source_repo.update_file.assert_not_called()
+        repo._source_repo.create_file.assert_not_called()
+        repo._source_repo.delete_file.assert_not_called()
+        repo._source_repo.create_git_ref.assert_not_called()
+        self.assertTrue(repo.dirty)
+        self.assertEqual(repo_file.decoded_content, b'second')
+        self.assertEqual(repo.get_staged_content('old.txt'), (True, None))
+
+    def test_batch_commits_single_commit_on_pr(self):
+        repo = Repo('test_repo', github=self.mock_git, batch_commits=True)
+        repo._source_repo = MagicMock()
+        repo._target_repo = MagicMock()
+        repo._source_repo.owner.login = 'someone'
+        base_commit = repo._source_repo.get_branch.return_value.commit.commit
+        repo.update_file(RepoFile('afile.txt', 'abc', 5, repo, '100755'), 'content', 'update file')
+        repo.delete_file(MagicMock(path='old.txt'), 'delete file')
+        repo.create_pr('test', '', 'master')
+
+        repo._source_repo.get_branch.assert_called_once_with('master')
+        elements = repo._source_repo.create_git_tree.call_args[0][0]
+        self.assertEqual([e._identity for e in elements], [
+            {'path': 'afile.txt', 'mode': '100755', 'type': 'blob', 'content': 'content'},
+            {'path': 'old.txt', 'mode': '100644', 'type': 'blob', 'sha': None},
+        ])
+        repo._source_repo.create_git_tree.assert_called_once_with(elements, base_commit.tree)
+        repo._source_repo.create_git_commit.assert_called_once_with(
+            'test\n\n- update file\n- delete file',
+            repo._source_repo.create_git_tree.return_value,
+            [base_commit]
+        )
+        commit = repo._source_repo.create_git_commit.return_value
+        repo._source_repo.create_git_ref.assert_called_once_with(ref=repo.branch_name, sha=commit.sha)
+        repo._target_repo.create_pull.assert_called_once()
+        self.assertEqual(repo.get_staged_content('afile.txt'), (False, None))
+
+    def test_batch_commits_existing_branch(self):
+        repo = Repo('test_repo', branch='existing', github=self.mock_git, batch_commits=True)
+        repo._source_repo = MagicMock()
+        repo._source_repo.create_git_blob.return_value.sha = 'blobsha'
+        repo.update_file(RepoFile('afile.txt', 'abc', 5, repo), b'\xff\xfe', 'binary update')
+        repo.commit_staged('test')
+
+        repo._source_repo.get_branch.assert_called_once_with('existing')
+        repo._source_repo.create_git_blob.assert_called_once_with('//4=', 'base64')
+        commit = repo._source_repo.create_git_commit.return_value
+        repo._source_repo.get_git_ref.assert_called_once_with('heads/existing')
+        repo._source_repo.get_git_ref.return_value.edit.assert_called_once_with(commit.sha)
+        repo._source_repo.create_git_ref.assert_not_called()
+
+    def test_commit_staged_nothing_staged(self):
+        repo = Repo('test_repo', github=self.mock_git, batch_commits=True)
+        repo._source_repo = MagicMock()
+        self.assertIsNone(repo.commit_staged('test'))
+        repo._source_repo.create_git_commit.assert_not_called()
+
+    def test_disk_cache_trees_and_blobs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory)
+            branch = json.dumps({'name': 'master', 'commit': {'sha': 'head'}})
+            responses = [(200, {'etag': '"b1"'}, branch), (304, {}, '')]
+            for response in responses:
+                self.mock_git.get_repo.return_value.url = '/repos/test_repo'
+                self.mock_git.get_repo.return_value._requester.requestJson.return_value = (200, {}, '{"full_name": "org/test_repo"}')
+                repo = Repo('test_repo', github=self.mock_git, cache=cache)
+                repo._source_repo = MagicMock(full_name='org/test_repo', url='/repos/org/test_repo')
+                repo._source_repo._requester.requestJson.return_value = response
+                tree = MagicMock(raw_data={'truncated': False})
+                tree.tree = [MagicMock(path='afile.txt', type='blob', sha='abc', size=5, mode='100644')]
+                repo._source_repo.get_git_tree.return_value = tree
+                repo._source_repo.get_git_blob.return_value = MagicMock(content='aGVsbG8=')
+                self.assertEqual(repo.get_files()[0].decoded_content, b'hello')
+
+            # The second repo was served entirely from the cache
+            self.mock_git.get_repo.assert_called_with('test_repo', lazy=True)
+            self.assertEqual(repo._target_repo.full_name, 'org/test_repo')
+            repo._source_repo._requester.requestJson.assert_called_once_with(
+                'GET', '/repos/org/test_repo/branches/master', None, {'If-None-Match': '"b1"'}
+            )
+            repo._source_repo.get_git_tree.assert_not_called()
+            repo._source_repo.get_git_blob.assert_not_called()
+            self.assertEqual(repo.files[0].path, 'afile.txt')
+            self.assertEqual(repo.files[0].sha, 'abc')
+
+    def test_conditional_get(self):
+        with tempfile.TemporaryDirectory() as directory:
+            repo = Repo('test_repo', github=self.mock_git)
+            repo._cache = DiskCache(directory)
+            requester = MagicMock()
+            requester.requestJson.return_value = (200, {'etag': '"abc"', 'last-modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}, '{"name": "value"}')
+            self.assertEqual(repo._conditional_get(requester, '/url')[1], {'name': 'value'})
+            requester.requestJson.assert_called_once_with('GET', '/url', None, {})
+
+            requester.reset_mock()
+            requester.requestJson.return_value = (304, {}, '')
+            self.assertEqual(repo._conditional_get(requester, '/url')[1], {'name': 'value'})
+            requester.requestJson.assert_called_once_with('GET', '/url', None, {
+                'If-None-Match': '"abc"',
+                'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'
+            })
+
+    def test_conditional_get_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            repo = Repo('test_repo', github=self.mock_git)
+            repo._cache = DiskCache(directory)
+            requester = MagicMock()
+            requester.requestJson.return_value = (404, {}, '{"message": "Not Found"}')
+            with pytest.raises(UnknownObjectException):
+                repo._conditional_get(requester, '/url')
+            requester.requestJson.return_value = (500, {}, '')
+            with pytest.raises(GithubException):
+                repo._conditional_get(requester, '/url')
+
+    def test_api_calls_go_through_scheduler(self):
+        scheduler = RateLimitScheduler(rate=1000)
+        repo = Repo('test_repo', github=self.mock_git, scheduler=scheduler)
+        repo._source_repo = MagicMock()
+        error = GithubException(403, {'message': 'You have exceeded a secondary rate limit'}, {'retry-after': '0'})
+        repo._source_repo.get_branch.side_effect = [error, MagicMock()]
+        repo._get_branch()
+        self.assertEqual(repo._source_repo.get_branch.call_count, 2)
+        self.assertEqual(scheduler.concurrency, scheduler.max_concurrency // 2)
+
+    def test_client_errors_are_not_retried(self):
+        repo = Repo('test_repo', github=self.mock_git, scheduler=RateLimitScheduler(rate=1000))
+        repo._source_repo = MagicMock()
+        repo._source_repo.get_git_tree.side_effect = UnknownObjectException(404, {'message': 'Not Found'}, {})
+        with pytest.raises(UnknownObjectException):
+            repo._get_git_tree('abc')
+        repo._source_repo.get_git_tree.assert_called_once_with('abc')
+
+    def test_find_files_uses_index_built_once(self):
+        self.repo._set_target_branch('target')
+        self.repo._source_repo = MagicMock()
+        tree = MagicMock(raw_data={'truncated': False})
+        tree.tree = [
+            MagicMock(path='deploy/values.yaml', type='blob', sha='a', size=1),
+            MagicMock(path='deploy/prd/values.yaml', type='blob', sha='b', size=1),
+            MagicMock(path='src/main.py', type='blob', sha='c', size=1),
+        ]
+        self.repo._source_repo.get_git_tree.return_value = tree
+        with patch.object(self.repo, '_get_new_version') as get_new_version:
+            self.assertEqual(self.repo.find_file('src/main.py').sha, 'c')
+            self.assertEqual([f.path for f in self.repo.find_files('deploy/**/*.yaml')], ['deploy/prd/values.yaml', 'deploy/values.yaml'])
+            self.assertEqual([f.sha for f in self.repo.find_files_by_name('values.yaml')], ['a', 'b'])
+            self.assertEqual([f.sha for f in self.repo.match_files('src/')], ['c'])
+            get_new_version.assert_called_once()
+        self.repo._source_repo.get_git_tree.assert_called_once()
+
+    def test_assigning_files_resets_index(self):
+        self.repo.find_file('/content.yaml')
+        self.repo.files = [MagicMock(path='other.yaml')]
+        self.assertIsNone(self.repo.find_file('/content.yaml'))
+        self.assertIsNotNone(self.repo.find_file('other.yaml'))
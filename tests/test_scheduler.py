@@ -0,0 +1,121 @@
+import time
+import unittest
+from unittest.mock import MagicMock
+from github import GithubException, RateLimitExceededException
+from gordian.scheduler import RateLimitScheduler, parse_retry_after, SECONDARY_LIMIT_BACKOFF
+
+
+class TestRateLimitScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = RateLimitScheduler(max_concurrency=4, rate=1000, burst=10)
+
+    def test_call(self):
+        fn = MagicMock(return_value='result')
+        self.assertEqual(self.scheduler.call(fn, 'a', b='c'), 'result')
+        fn.assert_called_once_with('a', b='c')
+
+    def test_other_errors_are_raised(self):
+        fn = MagicMock(side_effect=GithubException(404, {'message': 'Not Found'}, {}))
+        with self.assertRaises(GithubException):
+            self.scheduler.call(fn)
+        fn.assert_called_once()
+
+    def test_retry_after(self):
+        error = GithubException(403, {'message': 'You have exceeded a secondary rate limit'}, {'retry-after': '0'})
+        fn = MagicMock(side_effect=[error, 'result'])
+        self.assertEqual(self.scheduler.call(fn), 'result')
+        self.assertEqual(fn.call_count, 2)
+        self.assertEqual(self.scheduler.concurrency, 2)
+
+    def test_primary_rate_limit_waits_for_reset(self):
+        now = time.time()
+        error = RateLimitExceededException(403, {'message': 'API rate limit exceeded'}, {
+            'x-ratelimit-remaining': '0', 'x-ratelimit-reset': str(int(now))
+        })
+        self.assertEqual(self.scheduler._throttle(error), 1)
+        self.assertGreaterEqual(self.scheduler._paused_until, now)
+        self.assertEqual(self.scheduler.concurrency, 4)
+
+    def test_gives_up_after_max_retries(self):
+        self.scheduler.max_retries = 2
+        error = GithubException(429, {'message': 'abuse detection'}, {'retry-after': '0'})
+        fn = MagicMock(side_effect=error)
+        with self.assertRaises(GithubException):
+            self.scheduler.call(fn)
+        self.assertEqual(fn.call_count, 3)
+        self.assertEqual(self.scheduler.concurrency, 1)
+
+    def test_transient_errors_are_retried(self):
+        sleep = MagicMock()
+        scheduler = RateLimitScheduler(rate=1000, sleep=sleep)
+        fn = MagicMock(side_effect=[GithubException(502, {'message': 'Bad Gateway'}, {}), TimeoutError('Read Timeout'), 'result'])
+        self.assertEqual(scheduler.call(fn), 'result')
+        self.assertEqual(sleep.call_args_list, [((1,),), ((2,),)])
+
+        fn = MagicMock(side_effect=TimeoutError('Read Timeout'))
+        with self.assertRaises(TimeoutError):
+            scheduler.call(fn)
+        self.assertEqual(fn.call_count, 3)
+
+    def test_client_errors_are_not_retried(self):
+        sleep = MagicMock()
+        scheduler = RateLimitScheduler(rate=1000, sleep=sleep)
+        for status in (404, 422):
+            fn = MagicMock(side_effect=GithubException(status, {'message': 'error'}, {}))
+            with self.assertRaises(GithubException):
+                scheduler.call(fn)
+            fn.assert_called_once()
+        sleep.assert_not_called()
+
+    def test_parse_retry_after(self):
+        now = 1700000000
+        self.assertEqual(parse_retry_after('30', now), 30)
+        self.assertEqual(parse_retry_after('Tue, 14 Nov 2023 22:13:40 GMT', now), 20)
+        self.assertEqual(parse_retry_after('Tue, 14 Nov 2023 22:00:00 GMT', now), 0)
+        self.assertEqual(parse_retry_after('soon', now), SECONDARY_LIMIT_BACKOFF)
+
+    def test_retry_after_http_date(self):
+        error = GithubException(403, {'message': 'You have exceeded a secondary rate limit'}, {'retry-after': 'Tue, 14 Nov 2023 22:13:40 GMT'})
+        scheduler = RateLimitScheduler(clock=lambda: 1700000000)
+        self.assertEqual(scheduler._throttle(error), 20)
+
+    def test_concurrency_recovers(self):
+        self.scheduler.concurrency = 1
+        for _ in range(10):
+            self.scheduler.call(MagicMock())
+        self.assertEqual(self.scheduler.concurrency, 2)
+
+    def test_observe_paces_to_remaining_budget(self):
+        requester = MagicMock(rate_limiting=(100, 5000), rate_limiting_resettime=int(time.time()) + 1000)
+        self.scheduler.observe(requester)
+        self.assertAlmostEqual(self.scheduler.rate, 0.1, places=2)
+
+    def test_observe_fresh_budget_does_not_throttle(self):
+        requester = MagicMock(rate_limiting=(4999, 5000), rate_limiting_resettime=int(time.time()) + 3600)
+        self.scheduler.observe(requester)
+        self.assertEqual(self.scheduler.rate, 1000)
+
+        # Paced once the budget runs low, back to full speed after the reset
+        self.scheduler.observe(MagicMock(rate_limiting=(100, 5000), rate_limiting_resettime=int(time.time()) + 1000))
+        self.assertLess(self.scheduler.rate, 1)
+        self.scheduler.observe(MagicMock(rate_limiting=(5000, 5000), rate_limiting_resettime=int(time.time()) + 3600))
+        self.assertEqual(self.scheduler.rate, 1000)
+
+    def test_observe_exhausted_pauses(self):
+        reset = int(time.time()) + 1000
+        requester = MagicMock(rate_limiting=(0, 5000), rate_limiting_resettime=reset)
+        self.scheduler.observe(requester)
+        self.assertEqual(self.scheduler._paused_until, reset + 1)
+
+    def test_observe_ignores_unknown_limits(self):
+        self.scheduler.observe(None)
+        self.scheduler.observe(MagicMock(rate_limiting=(-1, -1), rate_limiting_resettime=0))
+        self.assertEqual(self.scheduler.rate, 1000)
+
+    def test_token_bucket_paces_calls(self):
+        scheduler = RateLimitScheduler(rate=100, burst=1)
+        start = time.monotonic()
+        for _ in range(5):
+            scheduler.call(MagicMock())
+        self.assertGreaterEqual(time.monotonic() - start, 0.03)
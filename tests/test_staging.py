@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import MagicMock
+from gordian.staging import StagingMixin, DEFAULT_FILE_MODE
+
+
+class StagedRepo(StagingMixin):
+
+    def __init__(self, batch_commits=True):
+        self.batch_commits = batch_commits
+        self.dirty = False
+        self.new_version = None
+        self.version_file = None
+        self._staged = {}
+        self._staged_messages = []
+        self._update_remote_file = MagicMock()
+        self._create_remote_file = MagicMock()
+        self._delete_remote_file = MagicMock()
+
+
+class TestStagingMixin(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = StagedRepo()
+
+    def test_stage_changes(self):
+        self.repo.update_file(MagicMock(path='a.yaml', mode='100755'), 'a', 'update a')
+        self.repo.create_file('b.yaml', b'b', 'create b')
+        self.repo.delete_file(MagicMock(path='c.yaml'), 'delete c')
+        self.assertTrue(self.repo.dirty)
+        self.assertEqual(self.repo.get_staged_content('a.yaml'), (True, b'a'))
+        self.assertEqual(self.repo.get_staged_content('c.yaml'), (True, None))
+        self.assertEqual(self.repo.get_staged_content('d.yaml'), (False, None))
+        self.assertEqual(self.repo.get_staged_changes(), (
+            [('a.yaml', b'a', '100755'), ('b.yaml', b'b', DEFAULT_FILE_MODE), ('c.yaml', None, DEFAULT_FILE_MODE)],
+            ['update a', 'create b', 'delete c']
+        ))
+        self.assertEqual(self.repo._commit_message('title'), 'title\n\n- update a\n- create b\n- delete c')
+        self.repo._clear_staged()
+        self.assertEqual(self.repo.get_staged_changes(), ([], []))
+
+    def test_dry_run(self):
+        self.repo.update_file(MagicMock(path='a.yaml'), 'a', 'update a', dry_run=True)
+        self.assertTrue(self.repo.dirty)
+        self.assertEqual(self.repo.get_staged_changes(), ([], []))
+
+    def test_without_batch_commits(self):
+        repo = StagedRepo(batch_commits=False)
+        file = MagicMock(path='a.yaml')
+        repo.update_file(file, 'a', 'update a')
+        repo.create_file('b.yaml', 'b', 'create b')
+        repo.delete_file(file, 'delete a')
+        repo._update_remote_file.assert_called_once_with(file, 'a', 'update a')
+        repo._create_remote_file.assert_called_once_with('b.yaml', 'b', 'create b')
+        repo._delete_remote_file.assert_called_once_with(file, 'delete a')
+        self.assertEqual(repo.get_staged_changes(), ([], []))
+
+    def test_bump_version(self):
+        self.repo.bump_version()
+        self.assertFalse(self.repo.dirty)
+        self.repo.new_version = '1.2.4'
+        self.repo.version_file = MagicMock(path='version')
+        self.repo.bump_version()
+        self.assertEqual(self.repo.get_staged_content('version'), (True, b'1.2.4'))
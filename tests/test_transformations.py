@@ -1,8 +1,12 @@
+import json
+import tempfile
 import unittest
 
 from gordian.files.plaintext_file import PlainTextFile
-from gordian.repo import Repo
-from gordian.transformations import SearchAndReplace, PlainTextUpdater
+from gordian.cache import ResultCache
+from gordian.index import Candidates
+from gordian.repo import Repo, RepoFile
+from gordian.transformations import SearchAndReplace, PlainTextUpdater, JsonPatch
 from unittest.mock import MagicMock, patch
 
 from tests.utils import Utils
@@ -63,9 +67,169 @@ class TestSearchAndReplaceTransformation(unittest.TestCase):
         self.mock_repo.update_file.assert_not_called()
         self.mock_repo.create_pull.assert_not_called()
 
+    def test_multiple_changesets_single_update(self):
+        self.instance.branch_exists = True
+        self.instance._source_repo = MagicMock()
+        self.sandr.changesets = [('iam', 'hello'), ('foo', 'bar'), ('missing', 'nothing')]
+        assert(self.sandr.run())
+        self.instance._source_repo.update_file.assert_called_once()
+        path, message, content, sha = self.instance._source_repo.update_file.call_args[0]
+        self.assertEqual(content, b'---\ntest:\n  bar:\n    bar\n  hello:\n    blah\n')
+        self.assertTrue(message.startswith("Replacing 'iam' with 'hello', 'foo' with 'bar' in "))
+
+    def test_changesets_applied_together(self):
+        self.instance.branch_exists = True
+        self.instance._source_repo = MagicMock()
+        self.sandr.changesets = [('foo', 'bar'), ('bar', 'foo')]
+        assert(self.sandr.run())
+        content = self.instance._source_repo.update_file.call_args[0][2]
+        self.assertEqual(content, b'---\ntest:\n  bar:\n    foo\n  iam:\n    blah\n')
+
+    def test_only_matching_files_are_computed(self):
+        self.instance.release = MagicMock()
+        self.sandr.changesets = [('missing', 'nothing')]
+        with patch('gordian.transformations.run_compute') as run_compute:
+            self.assertFalse(self.sandr.run())
+        run_compute.assert_not_called()
+        self.instance.release.assert_called_once_with(self.instance.files[0])
+
+    def test_unchanged_files_are_released(self):
+        self.instance.release = MagicMock()
+        self.sandr.changesets = [('hello', 'iam')]
+        self.assertFalse(self.sandr.run())
+        self.instance.release.assert_called_once_with(self.instance.files[0])
+
+    def test_results_reused_across_repos(self):
+        self.instance.branch_exists = True
+        self.instance._source_repo = MagicMock()
+        self.instance.result_cache = ResultCache()
+        self.instance.files[0].sha = 'blob-sha'
+        self.instance.files[0].path = 'content.yaml'
+        self.assertTrue(self.sandr.run())
+
+        other = MagicMock()
+        other.result_cache = self.instance.result_cache
+        other.search_candidates = None
+        other.get_staged_content.return_value = (False, None)
+        other_file = MagicMock(sha='blob-sha', path='content.yaml')
+        other.iter_files.return_value = [other_file]
+        self.assertTrue(SearchAndReplace(TestSearchAndReplaceTransformation.Args(), other).run())
+        self.assertEqual(other.update_file.call_args[0][1], self.instance._source_repo.update_file.call_args[0][2])
+        self.assertEqual(other.update_file.call_args[0][2], f"Replacing 'iam' with 'hello' in {other_file}")
+
+        # Different search/replace pairs don't share results
+        args = TestSearchAndReplaceTransformation.Args(search=['missing'], replace=['hello'])
+        self.assertNotEqual(SearchAndReplace(args, other).fingerprint(), self.sandr.fingerprint())
+
+    def test_staged_content_is_not_memoized(self):
+        self.instance.result_cache = MagicMock()
+        self.instance.files = [RepoFile('content.yaml', 'blob-sha', 3, self.instance)]
+        self.instance.batch_commits = True
+        self.instance.update_file(self.instance.files[0], b'staged iam', 'staged')
+        self.assertTrue(self.sandr.run())
+        self.instance.result_cache.get.assert_not_called()
+        self.assertEqual(self.instance.get_staged_content('content.yaml'), (True, b'staged hello'))
+
+    def test_search_candidates(self):
+        self.instance.branch_exists = True
+        self.instance._source_repo = MagicMock()
+        self.instance.files[0].path = 'content.yaml'
+        self.instance.files[0].sha = 'sha1'
+        self.instance.search_candidates = Candidates({('content.yaml', 'sha1')}, set())
+        self.assertFalse(self.sandr.run())
+        # The file changed since it was indexed
+        self.instance.files[0].sha = 'sha2'
+        self.assertTrue(self.sandr.run())
+        self.instance._source_repo.update_file.assert_called_once()
+
+    def test_index_terms(self):
+        self.assertEqual(SearchAndReplace.index_terms(TestSearchAndReplaceTransformation.Args(search=['iam', 'foo'])), [b'iam', b'foo'])
+        self.assertIsNone(PlainTextUpdater.index_terms(TestSearchAndReplaceTransformation.Args()))
+
+    def test_is_word_found_bytes(self):
+        self.assertTrue(self.sandr.is_word_found(b'line\nnext', 'line\nnext'))
+        self.assertFalse(self.sandr.is_word_found(b'line\nnext', 'hello'))
+
     def test_PlainTextUpdater(self):
         self.file = Utils.create_github_content_file(file='content.txt')
         self.ptf = PlainTextFile(self.file, self.instance)
         self.instance.files = [self.ptf.github_file]
         self.ptu = PlainTextUpdater(TestSearchAndReplaceTransformation.Args(), self.instance)
         self.assertIs(self.ptu.run(), True)
+
+
+class TestJsonPatchTransformation(unittest.TestCase):
+
+    class Args(object):
+        def __init__(self, patch_path, dry_run=False, file_regexp='.*.yaml'):
+            self.dry_run = dry_run
+            self.patch_path = patch_path
+            self.file_regexp = file_regexp
+
+    CONTENT = b'---\napiVersion: apps/v1\nkind: Deployment\nspec:\n  replicas: 2\n  args:\n  - a\n---\napiVersion: v1\nkind: Service\n'
+
+    def make_transformation(self, patch):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(patch, f)
+        repo = MagicMock(result_cache=None)
+        repo.get_staged_content.return_value = (False, None)
+        repo.match_files.return_value = [MagicMock(path='deploy.yaml', decoded_content=self.CONTENT)]
+        return JsonPatch(TestJsonPatchTransformation.Args(f.name), repo), repo
+
+    def test_changed(self):
+        transformation, repo = self.make_transformation([{'op': 'replace', 'path': '/spec/replicas', 'value': 3}])
+        self.assertTrue(transformation.run())
+        content = repo.update_file.call_args[0][1]
+        self.assertIn(b'replicas: 3', content)
+        self.assertIn(b'kind: Service', content)
+
+    def test_unchanged(self):
+        for patch in (
+            [{'op': 'replace', 'path': '/spec/replicas', 'value': 2}],
+            [{'op': 'test', 'path': '/kind', 'value': 'Deployment'}, {'op': 'add', 'path': '/spec/replicas', 'value': 2}],
+            [{'op': 'remove', 'path': '/spec/missing'}],
+            [{'op': 'test', 'path': '/kind', 'value': 'Other'}, {'op': 'replace', 'path': '/spec/replicas', 'value': 3}],
+            [{'op': 'move', 'from': '/spec', 'path': '/spec'}],
+            # Conflicting operations
+            [{'op': 'add', 'path': '/spec/args/5', 'value': 'b'}],
+            [{'op': 'move', 'from': '/spec', 'path': '/spec/args/0'}],
+        ):
+            transformation, repo = self.make_transformation(patch)
+            self.assertFalse(transformation.run(), patch)
+            repo.update_file.assert_not_called()
+            repo.release.assert_called_once()
+
+    def test_apply_operations(self):
+        transformation, _ = self.make_transformation([
+            {'op': 'test', 'path': '/kind', 'value': 'Deployment'},
+            {'op': 'add', 'path': '/spec/args/-', 'value': 'a'},
+            {'op': 'replace', 'path': '/spec/replicas', 'value': '2'},
+        ])
+        doc = {'kind': 'Deployment', 'spec': {'replicas': 2, 'args': ['a']}}
+        doc, changed = transformation.apply_operations(doc)
+        self.assertTrue(changed)
+        self.assertEqual(doc, {'kind': 'Deployment', 'spec': {'replicas': '2', 'args': ['a', 'a']}})
+
+    def test_failed_operation_keeps_earlier_changes(self):
+        transformation, _ = self.make_transformation([
+            {'op': 'add', 'path': '/metadata', 'value': {}},
+            {'op': 'replace', 'path': '/spec/missing', 'value': 1},
+            {'op': 'add', 'path': '/other', 'value': 1},
+        ])
+        doc, changed = transformation.apply_operations({'spec': {}})
+        self.assertTrue(changed)
+        self.assertEqual(doc, {'spec': {}, 'metadata': {}})
+
+    def test_conflicting_operation_keeps_earlier_changes(self):
+        for conflict in (
+            {'op': 'add', 'path': '/spec/args/2', 'value': 'c'},
+            {'op': 'move', 'from': '/spec', 'path': '/spec/child'},
+        ):
+            transformation, _ = self.make_transformation([
+                {'op': 'add', 'path': '/metadata', 'value': {}},
+                conflict,
+                {'op': 'add', 'path': '/other', 'value': 1},
+            ])
+            doc, changed = transformation.apply_operations({'spec': {'args': ['a']}})
+            self.assertTrue(changed, conflict)
+            self.assertEqual(doc, {'spec': {'args': ['a']}, 'metadata': {}}, conflict)